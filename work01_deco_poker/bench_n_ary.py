@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Сравнение вариантов n_ary на 10^6 аргументов:
+#   python bench_n_ary.py [-n 1000000] [-p 4]
+import time
+import argparse
+from deco import n_ary, n_ary_with
+
+
+def add(a, b):
+    return a + b
+
+
+def bench(name, func, args):
+    start = time.perf_counter()
+    result = func(*args)
+    print('%-28s %10.3f s  result=%s' % (name, time.perf_counter() - start, result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='n', type=int, default=10 ** 6)
+    parser.add_argument('-p', dest='processes', type=int, default=4)
+    opts = parser.parse_args()
+    args = tuple(range(opts.n))
+
+    bench('n_ary (right fold)', n_ary(add), args)
+    bench('n_ary_with (tree)', n_ary_with(associative=True)(add), args)
+    bench('n_ary_with (tree, %d procs)' % opts.processes,
+          n_ary_with(associative=True, processes=opts.processes)(add), args)
+
+
+if __name__ == '__main__':
+    main()
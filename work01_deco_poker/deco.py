@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+import asyncio
+import inspect
+import threading
+import multiprocessing
+from collections import OrderedDict
 from functools import update_wrapper
 
 _disabled = set()
@@ -33,21 +39,138 @@ def countcalls(func):
     return wrapper
 
 
+def _make_key(args, kwargs):
+    if not kwargs:
+        return args
+    return args + tuple(sorted(kwargs.items()))
+
+
+def _memoize(func, maxsize=None, ttl=None):
+    """Wrap func with a cache of at most maxsize entries (LRU), each living ttl seconds.
+    Coroutine functions cache awaited results; concurrent awaiters of the same
+    arguments share one in-flight task instead of running the body again."""
+    temp = OrderedDict()
+    in_flight = {}
+
+    def lookup(key):
+        if key not in temp:
+            return False, None
+        result, expires = temp[key]
+        if expires is not None and expires < time.monotonic():
+            del temp[key]
+            return False, None
+        temp.move_to_end(key)
+        return True, result
+
+    def store(key, result):
+        temp[key] = (result, time.monotonic() + ttl if ttl is not None else None)
+        temp.move_to_end(key)
+        if maxsize is not None and len(temp) > maxsize:
+            temp.popitem(last=False)
+
+    if inspect.iscoroutinefunction(func):
+        def done(key, task):
+            in_flight.pop(key, None)
+            if not task.cancelled() and task.exception() is None:
+                store(key, task.result())
+
+        async def wrapper(*args, **kwargs):
+            if memo in _disabled:
+                return await func(*args, **kwargs)
+            key = _make_key(args, kwargs)
+            hit, result = lookup(key)
+            if hit:
+                return result
+            task = in_flight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                in_flight[key] = task
+                task.add_done_callback(lambda t: done(key, t))
+            # shield: a cancelled awaiter must not cancel the shared task
+            return await asyncio.shield(task)
+    else:
+        def wrapper(*args, **kwargs):
+            if memo in _disabled:
+                return func(*args, **kwargs)
+            key = _make_key(args, kwargs)
+            hit, result = lookup(key)
+            if hit:
+                return result
+            result = func(*args, **kwargs)
+            store(key, result)
+            return result
+
+    wrapper.cache_clear = temp.clear
+    return wrapper
+
+
 @decorator
 def memo(func):
-    """Memoize a function so that it caches all return values for faster future lookups."""
-    temp = {}
+    """Memoize a function so that it caches all return values for faster future lookups.
+    Works for coroutine functions too."""
+    return _memoize(func)
 
-    def wrapper(*args, **kwargs):
-        if memo in _disabled:
-            return func(*args, *kwargs)
-        if args in temp:
-            return temp[args]
-        else:
-            result = func(*args, **kwargs)
-            temp[args] = result
-        return result
-    return wrapper
+
+def memo_with(maxsize=None, ttl=None):
+    """Memoize with eviction controls: keep at most maxsize results (least recently
+    used are evicted first), each for at most ttl seconds.
+
+    @memo_with(maxsize=1024, ttl=60)
+    async def fetch(url):
+        ....
+    """
+    @decorator
+    def outer(func):
+        return _memoize(func, maxsize=maxsize, ttl=ttl)
+    return outer
+
+
+def _right_fold(func, args, kwargs):
+    if len(args) <= 2:
+        return func(*args, **kwargs)
+    result = func(args[-2], args[-1])
+    for arg in reversed(args[:-2]):
+        result = func(arg, result)
+    return result
+
+
+def _tree_reduce(func, args):
+    """Reduce args pairwise as a balanced tree, keeping their order.
+    Equals the right fold only when func is associative."""
+    args = list(args)
+    while len(args) > 1:
+        reduced = [func(args[i], args[i + 1]) for i in range(0, len(args) - 1, 2)]
+        if len(args) % 2:
+            reduced.append(args[-1])
+        args = reduced
+    return args[0]
+
+
+# functions handed to pool workers; fork lets children inherit them
+# even when they can't be pickled (e.g. wrapped by other decorators)
+_pool_funcs = {}
+
+
+def _pool_reduce(job):
+    key, chunk = job
+    return _tree_reduce(_pool_funcs[key], chunk)
+
+
+def _parallel_tree_reduce(func, args, processes):
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        return _tree_reduce(func, args)
+    key = id(func)
+    _pool_funcs[key] = func
+    size = -(-len(args) // processes)
+    jobs = [(key, args[i:i + size]) for i in range(0, len(args), size)]
+    try:
+        with context.Pool(processes) as pool:
+            partial = pool.map(_pool_reduce, jobs)
+    finally:
+        del _pool_funcs[key]
+    return _tree_reduce(func, partial)
 
 
 @decorator
@@ -55,10 +178,31 @@ def n_ary(func):
     """ Given binary function f(x, y), return an n_ary function such
     that f(x, y, z) = f(x, f(y,z)), etc. Also allow f(x) = x. """
     def wrapper(*args, **kwargs):
-        return func(*args, *kwargs) if len(args) <= 2 else func(args[0], wrapper(*args[1:]))
+        return _right_fold(func, args, kwargs)
     return wrapper
 
 
+def n_ary_with(associative=False, processes=None, threshold=10000):
+    """n_ary with an opt-in fast path for associative functions: calls with
+    at least threshold arguments are reduced as a balanced tree, split across
+    a pool of processes when processes > 1.
+
+    @n_ary_with(associative=True, processes=4)
+    def add(a, b):
+        return a + b
+    """
+    @decorator
+    def outer(func):
+        def wrapper(*args, **kwargs):
+            if not associative or kwargs or len(args) < max(threshold, 3):
+                return _right_fold(func, args, kwargs)
+            if processes and processes > 1:
+                return _parallel_tree_reduce(func, args, processes)
+            return _tree_reduce(func, args)
+        return wrapper
+    return outer
+
+
 def trace(arg):
     """Trace calls made to function decorated.
 
@@ -83,20 +227,136 @@ def trace(arg):
     def outer(func):
         level = 0
 
+        name = func.__name__
+
         def wrapper(*args, **kwargs):
             nonlocal level
+            call = '%s(%s)' % (name, ', '.join(map(str, args)))
             if level == 0:
-                print('%s\n >>> fib(%s)' % (str(arg), str(args[0])))
+                print('%s\n >>> %s' % (str(arg), call))
             level += 1
-            print('  ' * level + '%s fib(%s)' % ('-->', str(args[0])))
+            print('  ' * level + '%s %s' % ('-->', call))
             result = func(*args, **kwargs)
-            print('  ' * level + '%s fib(%s) == %s' % ('<--', str(args[0]), str(result)))
+            print('  ' * level + '%s %s == %s' % ('<--', call, str(result)))
             level -= 1
             return result
         return wrapper
     return outer
 
 
+class CallStats(object):
+    """Counters collected by profile for one function. Times are in seconds;
+    histogram maps a bucket b to the number of timed calls that took
+    [2**(b-1), 2**b) microseconds. Shared by every function profiled under
+    the same name, so updates are done under a lock."""
+    __slots__ = ('name', 'calls', 'timed', 'cumulative', 'self_time', 'histogram', '_lock')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.timed = 0
+        self.cumulative = 0.0
+        self.self_time = 0.0
+        self.histogram = {}
+        self._lock = threading.Lock()
+
+    def count(self):
+        """Count one call and return the new total."""
+        with self._lock:
+            self.calls += 1
+            return self.calls
+
+    def record(self, elapsed, self_elapsed):
+        bucket = int(elapsed * 1e6).bit_length()
+        with self._lock:
+            self.timed += 1
+            self.cumulative += elapsed
+            self.self_time += self_elapsed
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def percentile(self, p):
+        """Upper bound (seconds) of the histogram bucket holding the p-th percentile."""
+        rank = self.timed * p / 100.0
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return (1 << bucket) / 1e6
+        return 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'timed': self.timed,
+            'cumulative': self.cumulative,
+            'self': self.self_time,
+            'histogram': dict(self.histogram),
+        }
+
+
+profile_registry = {}
+_profile_local = threading.local()
+
+
+def profile(sample=1, registry=profile_registry):
+    """Record call count, cumulative and self time and a latency histogram
+    of the decorated function in registry (see profile_stats, dump_profile).
+    Every call is counted, but only 1 call in sample is timed. Self time
+    subtracts the time of timed calls to other profiled functions.
+
+    Applied while disabled (disable(profile)) it returns the function itself,
+    so there is no per-call cost at all.
+
+    @profile(sample=100)
+    def handler(request):
+        ....
+    """
+    if not isinstance(sample, int) or sample < 1:
+        raise ValueError('sample must be a positive integer, got %r' % (sample,))
+
+    def outer(func):
+        if profile in _disabled:
+            return func
+        name = '%s.%s' % (func.__module__, func.__qualname__)
+        stats = registry.setdefault(name, CallStats(name))
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            if stats.count() % sample:
+                return func(*args, **kwargs)
+            stack = getattr(_profile_local, 'stack', None)
+            if stack is None:
+                stack = _profile_local.stack = []
+            stack.append(0.0)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                stats.record(elapsed, elapsed - children)
+        wrapper.stats = stats
+        return update_wrapper(wrapper, func)
+    return outer
+
+
+def profile_stats(registry=profile_registry):
+    """Snapshot of the registry as plain dicts, e.g. to be served as JSON."""
+    return {name: stats.as_dict() for name, stats in registry.items()}
+
+
+def dump_profile(registry=profile_registry, file=None):
+    """Print one line per profiled function, the slowest (by self time) first."""
+    print('%-40s %10s %10s %12s %12s %10s %10s' % (
+        'function', 'calls', 'timed', 'cumulative', 'self', 'p50', 'p99'), file=file)
+    for stats in sorted(registry.values(), key=lambda s: s.self_time, reverse=True):
+        print('%-40s %10d %10d %12.6f %12.6f %10.6f %10.6f' % (
+            stats.name, stats.calls, stats.timed, stats.cumulative, stats.self_time,
+            stats.percentile(50), stats.percentile(99)), file=file)
+
+
 @memo
 @countcalls
 @n_ary
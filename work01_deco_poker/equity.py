@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Таблица префлоп-эквити для 169 классов стартовых рук
+# (13 пар, 78 одномастных и 78 разномастных) против 1..N случайных соперников.
+#
+# Построение таблицы (симуляция на best_hand из poker.py, в несколько процессов):
+#   python equity.py build -o equity.bin -n 9 -t 2000 -p 4
+# Запрос к готовой таблице (файл отображается в память, симуляции нет):
+#   python equity.py lookup AKs 3 -f equity.bin
+# -----------------
+import mmap
+import random
+import struct
+import argparse
+import itertools
+import multiprocessing
+from poker import best_hand, hand_rank
+
+RANKS = '23456789TJQKA'
+SUITS = 'CSHD'
+DECK = ['%s%s' % (rank, suit) for rank, suit in itertools.product(RANKS, SUITS)]
+
+MAGIC = b'EQT1'
+HEADER = struct.Struct('<4sHI')       # magic, max opponents, trials per cell
+CELL = struct.Struct('<f')
+
+
+def hand_classes():
+    """Все 169 классов стартовых рук в порядке хранения в файле: 'AA', 'AKs', 'AKo', ..."""
+    classes = []
+    for i, high in enumerate(reversed(RANKS)):
+        for low in reversed(RANKS[:len(RANKS) - i]):
+            if high == low:
+                classes.append(high + low)
+            else:
+                classes.append(high + low + 's')
+                classes.append(high + low + 'o')
+    return classes
+
+
+CLASSES = hand_classes()
+CLASS_INDEX = {name: i for i, name in enumerate(CLASSES)}
+
+
+def hand_class(cards):
+    """Класс стартовой руки по двум картам: ['KS', 'AS'] -> 'AKs'"""
+    (r1, s1), (r2, s2) = sorted(cards, key=lambda c: RANKS.index(c[0]), reverse=True)
+    if r1 == r2:
+        return r1 + r2
+    return r1 + r2 + ('s' if s1 == s2 else 'o')
+
+
+def class_cards(name):
+    """Конкретные карты, представляющие класс руки: 'AKo' -> ['AS', 'KH']"""
+    if len(name) == 2 or name[2] == 'o':
+        return [name[0] + 'S', name[1] + 'H']
+    return [name[0] + 'S', name[1] + 'S']
+
+
+def simulate(hole, opponents, trials, rnd=random):
+    """Доля банка, выигранная рукой hole против opponents случайных рук
+    (ничья делит банк поровну)."""
+    deck = [card for card in DECK if card not in hole]
+    need = 5 + 2 * opponents
+    won = 0.0
+    for _ in range(trials):
+        cards = rnd.sample(deck, need)
+        board = cards[:5]
+        ours = hand_rank(best_hand(hole + board))
+        best, ties = ours, 1
+        for i in range(opponents):
+            theirs = hand_rank(best_hand(cards[5 + 2 * i:7 + 2 * i] + board))
+            if theirs > best:
+                best, ties = theirs, 0
+                break
+            if theirs == best:
+                ties += 1
+        if best == ours and ties:
+            won += 1.0 / ties
+    return won / trials
+
+
+def _simulate_class(job):
+    name, max_opponents, trials, seed = job
+    rnd = random.Random(seed)
+    hole = class_cards(name)
+    return [simulate(hole, n, trials, rnd) for n in range(1, max_opponents + 1)]
+
+
+def build_table(path, max_opponents=9, trials=1000, processes=None, seed=0):
+    """Считает эквити всех классов и записывает таблицу в path"""
+    jobs = [(name, max_opponents, trials, seed + i) for i, name in enumerate(CLASSES)]
+    with multiprocessing.Pool(processes) as pool:
+        rows = pool.map(_simulate_class, jobs)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, max_opponents, trials))
+        for row in rows:
+            f.write(b''.join(CELL.pack(value) for value in row))
+
+
+class EquityTable(object):
+    """Таблица эквити, отображенная в память. Запрос - это одно чтение
+    float32 по смещению, без симуляции."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.max_opponents, self.trials = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError("Неизвестный формат файла: %s" % path)
+
+    def equity(self, hand, opponents=1):
+        """hand - имя класса ('AKs') или две карты (['AS', 'KS'])"""
+        if not isinstance(hand, str):
+            hand = hand_class(hand)
+        if not 1 <= opponents <= self.max_opponents:
+            raise ValueError("Число соперников должно быть от 1 до %d" % self.max_opponents)
+        offset = HEADER.size + CELL.size * (CLASS_INDEX[hand] * self.max_opponents + opponents - 1)
+        return CELL.unpack_from(self._mm, offset)[0]
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_cmd_args():
+    parser = argparse.ArgumentParser("Preflop equity tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build")
+    build.add_argument("-o", dest="path", default="equity.bin")
+    build.add_argument("-n", dest="max_opponents", type=int, default=9)
+    build.add_argument("-t", dest="trials", type=int, default=1000)
+    build.add_argument("-p", dest="processes", type=int, default=None)
+    build.add_argument("-s", dest="seed", type=int, default=0)
+    lookup = commands.add_parser("lookup")
+    lookup.add_argument("hand")
+    lookup.add_argument("opponents", type=int, nargs="?", default=1)
+    lookup.add_argument("-f", dest="path", default="equity.bin")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_cmd_args()
+    if args.command == "build":
+        build_table(args.path, args.max_opponents, args.trials, args.processes, args.seed)
+    else:
+        hand = args.hand.split() if ' ' in args.hand else args.hand
+        with EquityTable(args.path) as table:
+            print('%.4f' % table.equity(hand, args.opponents))
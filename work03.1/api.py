@@ -4,13 +4,28 @@
 import json
 import datetime
 import logging
-import hashlib
 import uuid
-from lib.store import Storage, RedisStorage
-from lib.scoring import get_interests, get_score
+import os
+import signal
+import socket
+import selectors
+import threading
+import time
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from lib.codec import (CODECS, COMPRESS_LEVEL, COMPRESS_MIN_SIZE, STREAM_CHUNK_SIZE, choose_encoding, compress,
+                       compress_chunks, get_codec)
+from lib.auth import AdminToken, TokenCache
+from lib.admission import AdmissionController, RETRY_AFTER
+from lib.store import Storage, RedisStorage, request_deadline, MAX_POOL_CONNECTIONS, POOL_TIMEOUT
+from lib.sharded import ShardedStorage, parse_nodes
+from lib.memory_store import MemoryStorage
+from lib.metrics import Metrics, start_timer, stop_timer, mark
+from lib.request_log import RequestLogger, SLOW_REQUEST, setup_logging, stop_logging
+from lib.scoring import get_interests_many, get_score, get_scores_many, score_flight
 from optparse import OptionParser
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from weakref import WeakKeyDictionary
 
 
 SALT = "Otus"
@@ -22,12 +37,14 @@ FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
 }
 UNKNOWN = 0
 MALE = 1
@@ -37,26 +54,36 @@ GENDERS = {
     MALE: "male",
     FEMALE: "female",
 }
+METHODS = ("online_score", "clients_interests")
+SERVER_MODES = ("single", "thread", "prefork")
+DEFAULT_WORKERS = 8
+KEEP_ALIVE_TIMEOUT = 5           # секунд простоя до закрытия соединения
+MAX_KEEP_ALIVE_REQUESTS = 1000   # запросов на одно соединение
+REQUEST_STORE_DEADLINE = 1       # с, бюджет на все обращения к хранилищу за запрос
+LINGER_TIME = 0.5                # с, сколько держать отклоненное соединение до закрытия
+IDLE_POLL_INTERVAL = 0.1         # с, как часто закрывать простоявшие соединения
 
 
 class Field(object):
+    """Описание поля запроса. clean проверяет значение и возвращает его в том виде,
+    в котором оно хранится в запросе (разбирается один раз, например дата -> date)."""
+
     def __init__(self, required=False, nullable=False):
         self.required = required
         self.nullable = nullable
-        self._data = WeakKeyDictionary()
-
-    def __get__(self, instance, owner):
-        return self._data.get(instance)
-
-    def __set__(self, instance, value):
-        self.validate(value)
-        self._data[instance] = value
 
     def validate(self, value):
+        self.clean(value)
+        return value
+
+    def clean(self, value):
         if value is None and self.required:
             raise ValueError("Обязательное поле")
         if not value and not self.nullable:
             raise ValueError("Поле не может быть пустым")
+        return self.parse(value)
+
+    def parse(self, value):
         if value is not None:
             self.check_value(value)
         return value
@@ -70,11 +97,8 @@ class CharField(Field):
         if value is not None and not isinstance(value, str):
             raise TypeError("Поле должно быть строкой")
 
-    def __get__(self, instance, owner):
-        value = super().__get__(instance, owner)
-        if not value:
-            value = ''
-        return value
+    def parse(self, value):
+        return super().parse(value) or ''
 
 
 class ArgumentsField(Field):
@@ -105,6 +129,13 @@ class PhoneField(Field):
                 raise ValueError("Поле должно содержать только цифры")
         if not value.startswith("7") or len(value) != 11:
             raise ValueError("Неверно указан номер телефона")
+        return int(value)
+
+    def parse(self, value):
+        if value is None:
+            return None
+        phone = self.check_value(value)
+        return value if phone is None else phone
 
 
 class DateField(CharField):
@@ -116,11 +147,10 @@ class DateField(CharField):
                 raise ValueError("Формат даты должен быть: DD.MM.YYYY")
             return res
 
-    def __get__(self, instance, owner):
-        value = super().__get__(instance, owner)
-        if not value:
+    def parse(self, value):
+        if value is None:
             return None
-        return self.strftime(value, "%d.%m.%Y")
+        return self.check_value(value)
 
     def strftime(self, value, date_format="%d.%m.%Y"):
         return datetime.datetime.strptime(value, date_format).date()
@@ -128,12 +158,12 @@ class DateField(CharField):
 
 class BirthDayField(DateField):
     def check_value(self, value):
-        super().check_value(value)
-        if value:
-            birthday = self.strftime(value, "%d.%m.%Y")
+        birthday = super().check_value(value)
+        if birthday:
             year_limit = datetime.date.today() - datetime.timedelta(days=365.25*70)
             if year_limit > birthday:
                 raise ValueError("Ввозраст должен быть не старше 70 лет")
+        return birthday
 
 
 class GenderField(Field):
@@ -153,21 +183,59 @@ class ClientIDsField(Field):
             raise ValueError("Поле должно положительное значение")
 
 
+EMPTY_VALUES = (None, '', [], (), {})
+
+FIELD_VALIDATOR_TEMPLATE = """
+    value = data.get({name!r})
+    try:
+        self.{name} = clean_{name}(value)
+        if value not in EMPTY_VALUES:
+            non_empty_fields.append({name!r})
+    except (TypeError, ValueError) as e:
+        self.{name} = None
+        errors[{name!r}] = str(e)
+"""
+
+
+def compile_validator(class_name, fields):
+    """Собирает для класса запроса функцию проверки всех его полей: без цикла
+    по словарю полей и без дескрипторов, значения кладутся прямо в __slots__."""
+    lines = ["def validate_fields(self):",
+             "    data = self.data",
+             "    errors = {}",
+             "    non_empty_fields = []"]
+    lines += [FIELD_VALIDATOR_TEMPLATE.format(name=name) for name in fields]
+    lines += ["    self._errors = errors",
+              "    self.non_empty_fields = non_empty_fields"]
+    namespace = {"EMPTY_VALUES": EMPTY_VALUES}
+    namespace.update(("clean_%s" % name, field.clean) for name, field in fields.items())
+    exec(compile("\n".join(lines), "<%s.validate_fields>" % class_name, "exec"), namespace)
+    return namespace["validate_fields"]
+
+
 class RequestMeta(type):
     def __new__(cls, name, bases, attr):
-        fields = {
+        fields = {}
+        for base in bases:
+            fields.update(getattr(base, "_attr_fields", {}))
+        own_fields = {
             filed_name: field
             for filed_name, field in attr.items()
             if isinstance(field, Field)
         }
-        new_attr = attr.copy()
+        fields.update(own_fields)
+        new_attr = {key: value for key, value in attr.items() if key not in own_fields}
         new_attr["_attr_fields"] = fields
+        new_attr.setdefault("__slots__", tuple(own_fields))
+        new_attr["_validate_fields"] = compile_validator(name, fields)
         return super().__new__(cls, name, bases, new_attr)
 
 
 class Request(metaclass=RequestMeta):
+    __slots__ = ("data", "_errors", "non_empty_fields")
+    empty_values = EMPTY_VALUES
+
     def __init__(self, request=None):
-        self.empty_values = (None, '', [], (), {})
         self.data = {} if not request else request
         self._errors = None
         self.non_empty_fields = []
@@ -179,15 +247,7 @@ class Request(metaclass=RequestMeta):
         return self._errors
 
     def validate(self):
-        self._errors = {}
-        for name, field in self._attr_fields.items():
-            try:
-                value = self.data.get(name)
-                self.__setattr__(name, value)
-                if value not in self.empty_values:
-                    self.non_empty_fields.append(name)
-            except (TypeError, ValueError) as e:
-                self._errors[name] = str(e)
+        self._validate_fields()
 
     def is_valid(self):
         return not self.errors
@@ -231,38 +291,142 @@ class ClientsInterestsRequest(Request):
 
 
 class OnlineScoreHandler(object):
-    def execute_request(self, request, context, store):
+    def validate_request(self, request, context):
         r = OnlineScoreRequest(request.arguments)
         if not r.is_valid():
-            return r.errors, INVALID_REQUEST
+            return r, (r.errors, INVALID_REQUEST)
+        context["has"] = r.non_empty_fields
+        return r, None
+
+    def execute_request(self, request, context, store):
+        r, error = self.validate_request(request, context)
+        mark("validate")
+        if error:
+            return error
         if request.is_admin:
             score = 42
         else:
             score = get_score(store, r.phone, r.email, r.birthday, r.gender, r.first_name, r.last_name)
-        context["has"] = r.non_empty_fields
+        mark("store")
         return {"score": score}, OK
-    pass
 
 
 class ClientsInterestsHandler(object):
-    def execute_request(self, request, context, store):
+    def validate_request(self, request, context):
         r = ClientsInterestsRequest(request.arguments)
         if not r.is_valid():
-            return r.errors, INVALID_REQUEST
+            return r, (r.errors, INVALID_REQUEST)
         context["nclients"] = len(r.client_ids)
-        response_body = {c_id: get_interests(store, c_id) for c_id in r.client_ids}
+        return r, None
+
+    def execute_request(self, request, context, store):
+        r, error = self.validate_request(request, context)
+        mark("validate")
+        if error:
+            return error
+        response_body = get_interests_many(store, r.client_ids)
+        mark("store")
         return response_body, OK
-    pass
+
+
+user_tokens = TokenCache(SALT)
+admin_token = AdminToken(ADMIN_SALT)
 
 
 def check_auth(request):
     if request.is_admin:
-        digest = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+        return admin_token.check(request.token)
+    return user_tokens.check(request.account, request.login, request.token)
+
+
+def authorize_request(body, auth_cache=None):
+    """Проверяет запрос к /method и авторизацию.
+    Возвращает (MethodRequest, None) либо (None, (ответ, код ошибки)).
+    auth_cache - словарь с результатами check_auth по (account, login, token)"""
+    if not isinstance(body, dict):
+        return None, ("Неверный формат запроса", INVALID_REQUEST)
+    method_request = MethodRequest(body)
+    valid = method_request.is_valid()
+    mark("validate")
+    if not valid:
+        return None, (method_request.errors, INVALID_REQUEST)
+    if auth_cache is None:
+        authorized = check_auth(method_request)
     else:
-        digest = hashlib.sha512((request.account + request.login + SALT).encode()).hexdigest()
-    if digest == request.token:
-        return True
-    return False
+        auth_key = (method_request.account, method_request.login, method_request.token)
+        authorized = auth_cache.get(auth_key)
+        if authorized is None:
+            authorized = auth_cache[auth_key] = check_auth(method_request)
+    mark("auth")
+    if not authorized:
+        return None, ("Forbidden", FORBIDDEN)
+    return method_request, None
+
+
+def render_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+
+
+def batch_method_handler(request, ctx, store):
+    """Пакет запросов к /method: тело - список обычных запросов. Авторизация
+    проверяется один раз на каждую тройку (account, login, token), обращения
+    к хранилищу всех элементов пакета объединяются. Ответ - список результатов
+    в порядке запросов, у каждого свой код."""
+    handlers = {
+        "online_score": OnlineScoreHandler,
+        "clients_interests": ClientsInterestsHandler
+    }
+    bodies = request["body"]
+    auth_cache = {}
+    results = [None] * len(bodies)
+    contexts = [{} for _ in bodies]
+    scores, interests = [], []
+    for i, body in enumerate(bodies):
+        method_request, error = authorize_request(body, auth_cache)
+        if not error and method_request.method not in handlers:
+            error = "Неизвестный метод", NOT_FOUND
+        if error:
+            results[i] = error
+            continue
+        r, error = handlers[method_request.method]().validate_request(method_request, contexts[i])
+        if error:
+            results[i] = error
+        elif method_request.method == "clients_interests":
+            interests.append((i, r.client_ids))
+        elif method_request.is_admin:
+            results[i] = {"score": 42}, OK
+        else:
+            scores.append((i, {"phone": r.phone, "email": r.email, "birthday": r.birthday, "gender": r.gender,
+                               "first_name": r.first_name, "last_name": r.last_name}))
+
+    mark("validate")
+    if scores:
+        for (i, _), score in zip(scores, get_scores_many(store, [args for _, args in scores])):
+            results[i] = {"score": score}, OK
+    if interests:
+        all_interests = get_interests_many(store, sorted({c_id for _, ids in interests for c_id in ids}))
+        for i, client_ids in interests:
+            results[i] = {c_id: all_interests[c_id] for c_id in client_ids}, OK
+    mark("store")
+
+    ctx["batch"] = contexts
+    return [render_response(response, code) for response, code in results], OK
+
+
+def metric_method(request):
+    """Метка метода для метрик: только известные значения, чтобы не плодить серии"""
+    if isinstance(request, list):
+        return "batch"
+    if isinstance(request, dict) and request.get("method") in METHODS:
+        return request["method"]
+    return "other"
+
+
+def is_admin_request(request):
+    """Запрос от имени администратора (для приоритета при перегрузке; токен проверяется позже)"""
+    return isinstance(request, dict) and request.get("login") == ADMIN_LOGIN
 
 
 def method_handler(request, ctx, store):
@@ -270,11 +434,11 @@ def method_handler(request, ctx, store):
         "online_score": OnlineScoreHandler,
         "clients_interests": ClientsInterestsHandler
     }
-    method_request = MethodRequest(request["body"])
-    if not method_request.is_valid():
-        return method_request.errors, INVALID_REQUEST
-    if not check_auth(method_request):
-        return "Forbidden", FORBIDDEN
+    if isinstance(request["body"], list):
+        return batch_method_handler(request, ctx, store)
+    method_request, error = authorize_request(request["body"])
+    if error:
+        return error
     handler = handlers[method_request.method]()
     response = handler.execute_request(method_request, ctx, store)
     return response
@@ -285,11 +449,99 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         "method": method_handler
     }
     store = Storage(RedisStorage(host='172.17.0.2'))
+    metrics = Metrics()
+    request_log = RequestLogger()
+    admission = AdmissionController()
+    codec = get_codec()
+    compress_min_size = COMPRESS_MIN_SIZE
+    compress_level = COMPRESS_LEVEL
+    # постоянные соединения HTTP/1.1: запросы одного соединения (в т.ч. конвейерные)
+    # читаются из rfile и обрабатываются строго по очереди
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+    max_keep_alive_requests = MAX_KEEP_ALIVE_REQUESTS
+    # заголовки и тело уходят одной записью в сокет
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        """Запросы соединения обрабатываются, пока есть прочитанные данные. Сервер с
+        пулом (idle) забирает простаивающее соединение и вернет его, когда придет
+        следующий запрос, - поток пула не ждет клиента в readline"""
+        idle = getattr(self.server, "idle", None)
+        self.requests_handled = idle.resumed(self.request) if idle else 0
+        while True:
+            if idle is not None and not self.data_pending():
+                idle.keep(self.request, self.client_address, self.requests_handled, self.timeout)
+                return
+            self.handle_one_request()
+            if self.close_connection:
+                return
+
+    def data_pending(self):
+        """Есть ли непрочитанные данные: в буфере rfile или уже пришедшие в сокет"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            # ошибку сокета увидит handle_one_request
+            return True
+        finally:
+            self.connection.settimeout(self.timeout)
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_json(NOT_FOUND, render_response({}, NOT_FOUND))
+            return
+        body = self.metrics.render(dict(self.store.stats(), single_flight=score_flight.stats()),
+                                   {"admission": self.admission.stats(), "auth": user_tokens.stats()}).encode()
+        self.send_body(OK, body, "text/plain; version=0.0.4; charset=utf-8")
+
+    def send_json(self, code, r):
+        self.send_body(code, json.dumps(r, ensure_ascii=False).encode(encoding='UTF-8'), "application/json")
+
+    def send_body(self, code, body, content_type):
+        """Большое тело сжимается, если клиент принимает gzip/deflate; тело больше
+        STREAM_CHUNK_SIZE сжимается по частям, и каждая часть сразу уходит в wfile
+        (Transfer-Encoding: chunked), не дожидаясь сжатия всего ответа"""
+        self.requests_handled += 1
+        compressible = self.compress_level and len(body) >= self.compress_min_size
+        encoding = compressible and choose_encoding(self.headers.get("Accept-Encoding"))
+        # chunked есть только в HTTP/1.1, и у клиента, и в строке статуса ответа
+        stream = (encoding and len(body) > STREAM_CHUNK_SIZE and self.request_version == "HTTP/1.1"
+                  and self.protocol_version == "HTTP/1.1")
+        if encoding and not stream:
+            body = compress(body, encoding, self.compress_level)
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        if compressible:
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if stream:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+        if code == SERVICE_UNAVAILABLE:
+            self.send_header("Retry-After", str(self.admission.retry_after))
+        if self.close_connection or self.requests_handled >= self.max_keep_alive_requests:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        if not stream:
+            self.wfile.write(body)
+            return
+        for data in compress_chunks(body, encoding, self.compress_level):
+            if data:
+                self.wfile.write(b"%x\r\n" % len(data))
+                self.wfile.write(data)
+                self.wfile.write(b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
     def do_POST(self):
+        timer = start_timer()
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
         request = None
@@ -297,49 +549,374 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
 
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
+            timer.mark("read")
             data_string = data_string.decode('UTF-8')
             request = json.loads(data_string)
+            timer.mark("parse")
         except:
             code = BAD_REQUEST
+            # без корректного Content-Length граница следующего запроса неизвестна
+            self.close_connection = True
+
+        shed = request and self.admission.admit(is_admin_request(request))
+        try:
+            if shed:
+                code = SERVICE_UNAVAILABLE
+                context["shed"] = shed
+                self.close_connection = True
+            elif request:
+                path = self.path.strip("/")
+                code = NOT_FOUND
+                if path in self.router:
+                    try:
+                        with request_deadline(REQUEST_STORE_DEADLINE):
+                            response, code = self.router[path]({"body": request, "headers": self.headers}, context,
+                                                               self.store)
+                    except Exception as e:
+                        logging.exception("Unexpected error: %s" % e)
+                        code = INTERNAL_ERROR
+
+            r = render_response(response, code)
+            context.update(r)
+            try:
+                body = self.codec.dumps(r)
+            except (TypeError, ValueError) as e:
+                logging.exception("Response serialization error: %s" % e)
+                code = INTERNAL_ERROR
+                r = render_response({}, code)
+                context.update(r)
+                body = self.codec.dumps(r)
+            timer.mark("serialize")
+
+            self.send_body(code, body, "application/json")
+        finally:
+            if request and not shed:
+                self.admission.done()
+        timer.mark("write")
+        stop_timer()
+        self.metrics.record(metric_method(request), code, timer)
+        self.request_log.log(context, code, timer.elapsed, self.path, data_string)
+
+    def log_request(self, code='-', size='-'):
+        # запросы пишет request_log, строка access-лога на каждый запрос не нужна
+        pass
 
-        if request:
-            path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
-            code = NOT_FOUND
-            if path in self.router:
-                try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception("Unexpected error: %s" % e)
-                    code = INTERNAL_ERROR
+    def log_message(self, format, *args):
+        logging.info("%s - %s" % (self.address_string(), format % args))
 
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
 
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+def configure_keep_alive(timeout=KEEP_ALIVE_TIMEOUT, max_requests=MAX_KEEP_ALIVE_REQUESTS):
+    """timeout=0 отключает постоянные соединения (HTTP/1.0, соединение на каждый запрос)"""
+    if timeout:
+        MainHTTPHandler.protocol_version = "HTTP/1.1"
+        MainHTTPHandler.timeout = timeout
+    else:
+        MainHTTPHandler.protocol_version = "HTTP/1.0"
+        MainHTTPHandler.timeout = None
+    MainHTTPHandler.max_keep_alive_requests = max_requests
+
+
+class IdleConnections:
+    """Простаивающие постоянные соединения ждут следующего запроса в селекторе
+    своего потока, а не в потоке пула. Соединение, в котором появились данные,
+    передается в resume(sock, client_address), простоявшее дольше своего
+    таймаута - в close(sock)."""
+
+    def __init__(self, resume, close):
+        self.resume = resume
+        self.close = close
+        self.selector = selectors.DefaultSelector()
+        self.deadlines = OrderedDict()  # соединение -> срок простоя, по порядку постановки
+        self._kept = {}
+        self._handled = {}
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def keep(self, sock, client_address, requests_handled, timeout):
+        """Из обработчика: соединение надо не закрывать, а отложить до следующего запроса"""
+        self._kept[sock] = (client_address, requests_handled, timeout or KEEP_ALIVE_TIMEOUT)
+
+    def resumed(self, sock):
+        """Сколько запросов соединения уже обработано до того, как его отложили"""
+        return self._handled.pop(sock, 0)
+
+    def discard(self, sock):
+        self._kept.pop(sock, None)
+        self._handled.pop(sock, None)
+
+    def park(self, sock):
+        """После обработчика: True - соединение отложено и закрывать его не надо"""
+        kept = self._kept.pop(sock, None)
+        if kept is None:
+            return False
+        client_address, requests_handled, timeout = kept
+        with self._lock:
+            if self._stopped:
+                return False
+            self.selector.register(sock, selectors.EVENT_READ, (client_address, requests_handled))
+            self.deadlines[sock] = time.monotonic() + timeout
+        return True
+
+    def run(self):
+        while not self._stopped:
+            events = self.selector.select(IDLE_POLL_INTERVAL)
+            ready, expired = [], []
+            with self._lock:
+                for key, _ in events:
+                    self._release(key.fileobj)
+                    ready.append((key.fileobj, key.data))
+                now = time.monotonic()
+                while self.deadlines and next(iter(self.deadlines.values())) <= now:
+                    sock = next(iter(self.deadlines))
+                    self._release(sock)
+                    expired.append(sock)
+            for sock, (client_address, requests_handled) in ready:
+                if requests_handled:
+                    self._handled[sock] = requests_handled
+                self.resume(sock, client_address)
+            for sock in expired:
+                self.close(sock)
+
+    def _release(self, sock):
+        self.selector.unregister(sock)
+        del self.deadlines[sock]
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+        self._thread.join()
+        with self._lock:
+            socks = list(self.deadlines)
+            for sock in socks:
+                self._release(sock)
+        for sock in socks:
+            self.close(sock)
+        self.selector.close()
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer, обрабатывающий запросы в пуле из workers потоков.
+    Соединения сверх лимита очереди admission (контроля допуска обработчика) не ставятся
+    в очередь пула: ответ 503 пишется сразу в потоке приема. Простаивающие постоянные
+    соединения поток пула не занимают (IdleConnections)"""
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.idle = IdleConnections(self.process_request, self.shutdown_request)
+        self.admission = getattr(handler_class, "admission", None) or AdmissionController()
+        body = json.dumps(render_response({}, SERVICE_UNAVAILABLE)).encode()
+        head = ("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                "Retry-After: %s\r\nConnection: close\r\n\r\n" % (
+                    SERVICE_UNAVAILABLE, ERRORS[SERVICE_UNAVAILABLE], len(body), self.admission.retry_after))
+        self.shed_response = head.encode() + body
+        self.lingering = deque()
+        super().__init__(server_address, handler_class)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        if not self.admission.accept():
+            self.reject_request(request)
+            return
+        self.pool.submit(self.process_request_thread, request, client_address, time.monotonic())
+
+    def process_request_thread(self, request, client_address, accepted):
+        self.admission.started(accepted)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.idle.discard(request)
+        if not self.idle.park(request):
+            self.shutdown_request(request)
+
+    def close_request(self, request):
+        self.idle.discard(request)
+        super().close_request(request)
+
+    def reject_request(self, request):
+        """Ответ 503 без чтения запроса. Сокет закрывается не сразу (lingering close):
+        если закрыть его с непрочитанным запросом клиента, ядро сбросит соединение (RST)
+        и клиент может не успеть прочитать ответ"""
+        try:
+            request.setblocking(False)
+            request.send(self.shed_response)
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            self.close_request(request)
+            return
+        self.lingering.append((time.monotonic() + LINGER_TIME, request))
+
+    def close_lingering(self, force=False):
+        now = time.monotonic()
+        while self.lingering and (force or self.lingering[0][0] <= now):
+            _, request = self.lingering.popleft()
+            try:
+                while request.recv(65536):
+                    pass
+            except OSError:
+                pass
+            self.close_request(request)
+
+    def service_actions(self):
+        # вызывается из serve_forever в потоке приема - там же, где reject_request
+        super().service_actions()
+        self.close_lingering()
+
+    def server_close(self):
+        super().server_close()
+        self.idle.stop()
+        self.close_lingering(force=True)
+        self.pool.shutdown(wait=True)
+
+
+class ReusePortHTTPServer(HTTPServer):
+    """Однопоточный HTTPServer, разделяющий порт с другими процессами (SO_REUSEPORT)"""
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def make_server(port, workers=1, reuse_port=False, host="localhost"):
+    if workers > 1:
+        return ThreadPoolHTTPServer((host, port), MainHTTPHandler, workers=workers, reuse_port=reuse_port)
+    if reuse_port:
+        return ReusePortHTTPServer((host, port), MainHTTPHandler)
+    return HTTPServer((host, port), MainHTTPHandler)
+
+
+def serve(server, warm_up=0):
+    """Обслуживает запросы до SIGTERM/SIGINT, затем дожидается начатых запросов.
+    warm_up > 0 - сколько соединений с хранилищем открыть до первого запроса"""
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if warm_up:
+        opened = server.RequestHandlerClass.store.warm_up(warm_up)
+        logging.info("Storage connections opened: %s" % opened)
+    server.serve_forever()
+    server.server_close()
+    server.RequestHandlerClass.store.close()
+    logging.info("Server stopped. PID: %s" % os.getpid())
+    stop_logging()
 
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r, ensure_ascii=False).encode(encoding='UTF-8'))
-        return
+
+def serve_prefork(port, processes, workers=1):
+    """Запускает processes процессов, слушающих один порт через SO_REUSEPORT"""
+    def run():
+        # соединения с хранилищем открываются в каждом процессе свои
+        serve(make_server(port, workers, reuse_port=True), warm_up=workers)
+
+    children = [multiprocessing.Process(target=run) for _ in range(processes)]
+    for child in children:
+        child.start()
+
+    def stop(signum, frame):
+        for child in children:
+            if child.is_alive():
+                os.kill(child.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        child.join()
+    stop_logging()
 
 
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-m", "--mode", action="store", type="choice", choices=SERVER_MODES, default="single",
+                  help="single | thread (пул потоков) | prefork (процессы с SO_REUSEPORT)")
+    op.add_option("-w", "--workers", action="store", type=int, default=DEFAULT_WORKERS,
+                  help="число потоков в пуле (режимы thread и prefork)")
+    op.add_option("-n", "--processes", action="store", type=int, default=os.cpu_count(),
+                  help="число процессов в режиме prefork")
+    op.add_option("-k", "--keep-alive", action="store", type=int, default=None,
+                  help="таймаут простоя постоянного соединения, сек; 0 - отключить "
+                       "(по умолчанию %s, в режиме single - 0)" % KEEP_ALIVE_TIMEOUT)
+    op.add_option("--max-requests", action="store", type=int, default=MAX_KEEP_ALIVE_REQUESTS,
+                  help="максимум запросов на одно соединение")
+    op.add_option("--write-behind", action="store_true", default=False,
+                  help="записывать кэш скоринга в Redis в фоне пачками")
+    op.add_option("--stale-ttl", action="store", type=float, default=0,
+                  help="сколько секунд отдавать истекшее значение скоринга, обновляя его в фоне")
+    op.add_option("--negative-ttl", action="store", type=float, default=0,
+                  help="сколько секунд помнить отсутствие ключа в Redis, не перечитывая его")
+    op.add_option("--score-lock", action="store_true", default=False,
+                  help="пересчет скоринга одного пользователя в разных процессах - под блокировкой в Redis")
+    op.add_option("--redis", action="store", default=None,
+                  help="узлы Redis host:port[,host:port...]; несколько узлов - шардирование по ключу")
+    op.add_option("--pool-size", action="store", type=int, default=MAX_POOL_CONNECTIONS,
+                  help="максимум соединений с каждым узлом Redis")
+    op.add_option("--pool-timeout", action="store", type=float, default=POOL_TIMEOUT,
+                  help="сколько ждать свободного соединения в пуле, сек")
+    op.add_option("--memory", action="store_true", default=False,
+                  help="хранить данные в памяти процесса вместо Redis (одиночный узел)")
+    op.add_option("--max-memory", action="store", type=int, default=64,
+                  help="предел хранилища в памяти, МБ")
+    op.add_option("--snapshot", action="store", default=None,
+                  help="файл снимка хранилища в памяти: загружается при старте, сохраняется при остановке")
+    op.add_option("--log-sample", action="store", type=float, default=1.0,
+                  help="доля успешных запросов, попадающих в журнал (ошибки и медленные - всегда)")
+    op.add_option("--slow-request", action="store", type=float, default=SLOW_REQUEST,
+                  help="запросы дольше стольких секунд пишутся в журнал всегда")
+    op.add_option("--json-codec", action="store", type="choice", choices=("auto",) + tuple(CODECS), default="auto",
+                  help="сериализация ответов: auto (orjson, если установлен) | json | orjson")
+    op.add_option("--compress-min-size", action="store", type=int, default=COMPRESS_MIN_SIZE,
+                  help="сжимать (gzip/deflate по Accept-Encoding) ответы не меньше стольких байт")
+    op.add_option("--compress-level", action="store", type=int, default=COMPRESS_LEVEL,
+                  help="уровень сжатия 1-9, 0 - не сжимать")
+    op.add_option("--max-inflight", action="store", type=int, default=0,
+                  help="максимум запросов в обработке на процесс, сверх - 503; 0 - без ограничения")
+    op.add_option("--max-queue-time", action="store", type=float, default=0,
+                  help="запрос, ждавший свободного потока дольше стольких секунд, получает 503; 0 - без ограничения")
+    op.add_option("--admin-reserve", action="store", type=int, default=0,
+                  help="мест сверх --max-inflight только для запросов администратора")
+    op.add_option("--retry-after", action="store", type=int, default=RETRY_AFTER,
+                  help="значение Retry-After в ответе 503, сек")
     (opts, args) = op.parse_args()
-    logging.basicConfig(filename=opts.log, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
+    setup_logging(opts.log)
+    MainHTTPHandler.request_log = RequestLogger(opts.log_sample, opts.slow_request)
+    MainHTTPHandler.codec = get_codec(opts.json_codec)
+    MainHTTPHandler.compress_min_size = opts.compress_min_size
+    MainHTTPHandler.compress_level = opts.compress_level
+    MainHTTPHandler.admission = AdmissionController(opts.max_inflight, opts.max_queue_time, opts.admin_reserve,
+                                                    opts.retry_after)
+    if MainHTTPHandler.admission.enabled and (opts.mode == "single" or opts.workers < 2):
+        # без пула потоков нет ни очереди к пулу, ни параллельных запросов - ограничивать нечего
+        op.error("--max-inflight и --max-queue-time работают только с пулом потоков: -m thread или prefork, -w 2+")
+    if opts.snapshot and opts.mode == "prefork":
+        # каждый процесс при остановке перезаписал бы общий файл своим хранилищем
+        op.error("--snapshot работает только в режимах single и thread")
+    logging.info("Starting server at %s, mode: %s" % (opts.port, opts.mode))
+    if opts.keep_alive is None:
+        # в однопоточном режиме постоянное соединение заняло бы сервер целиком
+        opts.keep_alive = 0 if opts.mode == "single" else KEEP_ALIVE_TIMEOUT
+    configure_keep_alive(opts.keep_alive, opts.max_requests)
+    if opts.memory:
+        storage = MemoryStorage(max_memory=opts.max_memory * 1024 * 1024, snapshot_path=opts.snapshot)
+    else:
+        default = MainHTTPHandler.store.storage
+        nodes = parse_nodes(opts.redis) if opts.redis else [(default.host, default.port)]
+        pool = {"max_connections": opts.pool_size, "pool_timeout": opts.pool_timeout}
+        if len(nodes) > 1:
+            storage = ShardedStorage(nodes, storage_factory=lambda host, port: RedisStorage(host, port, **pool))
+        else:
+            storage = RedisStorage(*nodes[0], **pool)
+    MainHTTPHandler.store = Storage(storage, write_behind=opts.write_behind, stale_ttl=opts.stale_ttl,
+                                    score_lock=opts.score_lock, negative_ttl=opts.negative_ttl)
 
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
+    if opts.mode == "prefork":
+        serve_prefork(opts.port, opts.processes, opts.workers)
+    else:
+        workers = opts.workers if opts.mode == "thread" else 1
+        serve(make_server(opts.port, workers), warm_up=workers)
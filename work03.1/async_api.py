@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Асинхронная (asyncio) версия сервера скоринга: тот же /method, те же запросы
+и обработчики, что в api.py, но обращения к хранилищу не блокируют процесс,
+поэтому один процесс обслуживает тысячи запросов, ожидающих Redis."""
+import json
+import uuid
+import signal
+import asyncio
+import logging
+from optparse import OptionParser
+
+from api import (OK, BAD_REQUEST, NOT_FOUND, INTERNAL_ERROR, ERRORS, KEEP_ALIVE_TIMEOUT,
+                 OnlineScoreHandler, ClientsInterestsHandler, authorize_request, render_response)
+from lib.codec import get_codec
+from lib.async_store import AsyncStorage, AsyncRedisStorage
+from lib.scoring import async_get_score, async_get_interests
+
+MAX_HEADERS_SIZE = 64 * 1024
+
+
+class AsyncOnlineScoreHandler(OnlineScoreHandler):
+    async def execute_request(self, request, context, store):
+        r, error = self.validate_request(request, context)
+        if error:
+            return error
+        if request.is_admin:
+            score = 42
+        else:
+            score = await async_get_score(store, r.phone, r.email, r.birthday, r.gender, r.first_name, r.last_name)
+        return {"score": score}, OK
+
+
+class AsyncClientsInterestsHandler(ClientsInterestsHandler):
+    async def execute_request(self, request, context, store):
+        r, error = self.validate_request(request, context)
+        if error:
+            return error
+        interests = await asyncio.gather(*(async_get_interests(store, c_id) for c_id in r.client_ids))
+        return dict(zip(r.client_ids, interests)), OK
+
+
+async def method_handler(request, ctx, store):
+    handlers = {
+        "online_score": AsyncOnlineScoreHandler,
+        "clients_interests": AsyncClientsInterestsHandler
+    }
+    method_request, error = authorize_request(request["body"])
+    if error:
+        return error
+    handler = handlers[method_request.method]()
+    return await handler.execute_request(method_request, ctx, store)
+
+
+class AsyncHTTPServer:
+    """HTTP/1.1 сервер на asyncio streams с постоянными соединениями"""
+    router = {
+        "method": method_handler
+    }
+    codec = get_codec()
+
+    def __init__(self, store, host="localhost", port=8080, keep_alive_timeout=KEEP_ALIVE_TIMEOUT):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.keep_alive_timeout = keep_alive_timeout
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                 limit=MAX_HEADERS_SIZE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def read_request(self, reader):
+        """Возвращает (метод, путь, заголовки, тело, keep_alive) или None, если соединение закрыто"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keep_alive_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return method, path, headers, body, keep_alive
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    parsed = await self.read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(self.render(BAD_REQUEST, {}, {}, keep_alive=False))
+                    break
+                if parsed is None:
+                    break
+                method, path, headers, body, keep_alive = parsed
+                writer.write(await self.handle_request(method, path, headers, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, path, headers, body, keep_alive):
+        response, code = {}, OK
+        context = {"request_id": headers.get("x-request-id", uuid.uuid4().hex)}
+        request = None
+        if method != "POST":
+            code = NOT_FOUND
+        else:
+            try:
+                request = json.loads(body.decode("UTF-8"))
+            except:
+                code = BAD_REQUEST
+
+        if request:
+            logging.info("%s: %s %s" % (path, body.decode("UTF-8"), context["request_id"]))
+            path = path.strip("/")
+            code = NOT_FOUND
+            if path in self.router:
+                try:
+                    response, code = await self.router[path]({"body": request, "headers": headers}, context,
+                                                             self.store)
+                except Exception as e:
+                    logging.exception("Unexpected error: %s" % e)
+                    code = INTERNAL_ERROR
+
+        return self.render(code, response, context, keep_alive)
+
+    def render(self, code, response, context, keep_alive):
+        r = render_response(response, code)
+        context.update(r)
+        logging.info(context)
+        body = self.codec.dumps(r)
+        head = "HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n" % (
+            code, ERRORS.get(code, "OK"), len(body), "" if keep_alive else "Connection: close\r\n")
+        return head.encode("latin-1") + body
+
+
+async def serve(opts):
+    store = AsyncStorage(AsyncRedisStorage(host=opts.redis_host, port=opts.redis_port))
+    server = await AsyncHTTPServer(store, "localhost", opts.port).start()
+    logging.info("Starting async server at %s" % server.port)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    await stopped.wait()
+    await server.stop()
+    await store.storage.close()
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--redis-host", action="store", default="172.17.0.2")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    (opts, args) = op.parse_args()
+    logging.basicConfig(filename=opts.log, level=logging.INFO,
+                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    asyncio.run(serve(opts))
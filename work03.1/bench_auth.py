@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Микробенчмарк проверки авторизации: check_auth с кэшем токенов и часовым
+токеном администратора против прежнего расчета sha512 на каждый запрос.
+    python3 bench_auth.py [-n 200000]"""
+import time
+import hashlib
+import datetime
+from optparse import OptionParser
+
+from api import SALT, ADMIN_LOGIN, ADMIN_SALT, MethodRequest, check_auth
+
+
+def check_auth_uncached(request):
+    """check_auth до кэширования: sha512 (и для администратора strftime) на каждый запрос"""
+    if request.is_admin:
+        digest = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+    else:
+        digest = hashlib.sha512((request.account + request.login + SALT).encode()).hexdigest()
+    return digest == request.token
+
+
+def make_request(login):
+    if login == ADMIN_LOGIN:
+        token = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+    else:
+        token = hashlib.sha512(("horns&hoofs" + login + SALT).encode()).hexdigest()
+    request = MethodRequest({"account": "horns&hoofs", "login": login, "method": "online_score", "token": token,
+                             "arguments": {}})
+    if not request.is_valid():
+        raise AssertionError(request.errors)
+    return request
+
+
+def bench(name, func, request, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        if not func(request):
+            raise AssertionError("%s: запрос не прошел авторизацию" % name)
+    elapsed = time.perf_counter() - start
+    print("%-20s %10.0f checks/s  %6.2f us/check" % (name, n / elapsed, elapsed / n * 1e6))
+    return elapsed
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", action="store", type=int, default=200000)
+    (opts, args) = op.parse_args()
+    for login in ("h&f", ADMIN_LOGIN):
+        request = make_request(login)
+        before = bench("%s uncached" % login, check_auth_uncached, request, opts.n)
+        after = bench("%s cached" % login, check_auth, request, opts.n)
+        print("%-20s %10.1fx" % ("%s speedup" % login, before / after))
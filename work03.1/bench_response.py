@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Бенчмарк ответов clients_interests: сколько байт уходит в сеть и сколько
+процессорного времени занимает сериализация и сжатие ответа при разном числе клиентов.
+    python3 bench_response.py [-c 10,100,1000,10000] [-l 1,6] [-n 200]"""
+import time
+import random
+from optparse import OptionParser
+
+from api import OK, render_response
+from lib.codec import ENCODINGS, available_codecs, compress, get_codec
+from lib.interests import INTERESTS
+
+
+def make_response(clients, rnd):
+    interests = {cid: rnd.sample(INTERESTS, rnd.randint(1, 5)) for cid in range(1, clients + 1)}
+    return render_response(interests, OK)
+
+
+def cpu_per_call(func, n):
+    """Процессорное время на вызов, мкс (process_time не учитывает ожидание и другие процессы)"""
+    start = time.process_time()
+    for _ in range(n):
+        func()
+    return (time.process_time() - start) / n * 1e6
+
+
+def bench(clients, levels, n):
+    response = make_response(clients, random.Random(clients))
+    body = get_codec("json").dumps(response)
+    for name in available_codecs():
+        codec = get_codec(name)
+        print("%6d clients  %-14s %9d bytes  %9.1f us" % (
+            clients, "dumps " + name, len(codec.dumps(response)), cpu_per_call(lambda: codec.dumps(response), n)))
+    for encoding in ENCODINGS:
+        for level in levels:
+            compressed = compress(body, encoding, level)
+            print("%6d clients  %-14s %9d bytes  %9.1f us  %5.1f%%" % (
+                clients, "%s-%d" % (encoding, level), len(compressed),
+                cpu_per_call(lambda: compress(body, encoding, level), n), 100.0 * len(compressed) / len(body)))
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-c", "--clients", action="store", default="10,100,1000,10000",
+                  help="размеры ответа: число клиентов через запятую")
+    op.add_option("-l", "--levels", action="store", default="1,6", help="уровни сжатия через запятую")
+    op.add_option("-n", action="store", type=int, default=200, help="повторов на измерение")
+    (opts, args) = op.parse_args()
+    levels = [int(level) for level in opts.levels.split(",")]
+    for clients in opts.clients.split(","):
+        bench(int(clients), levels, opts.n)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Микробенчмарк проверки запросов: сколько запросов в секунду проходят
+MethodRequest + OnlineScoreRequest / ClientsInterestsRequest.
+    python3 bench_validation.py [-n 100000]"""
+import time
+from optparse import OptionParser
+
+from api import MethodRequest, OnlineScoreRequest, ClientsInterestsRequest
+
+SCORE_REQUEST = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "x" * 128,
+                 "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "a",
+                               "last_name": "b", "birthday": "01.01.1990", "gender": 1}}
+INTERESTS_REQUEST = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "token": "x" * 128,
+                     "arguments": {"client_ids": [1, 2, 3, 4], "date": "20.07.2017"}}
+
+
+def validate(body, arguments_class):
+    method_request = MethodRequest(body)
+    if not method_request.is_valid():
+        raise AssertionError(method_request.errors)
+    r = arguments_class(method_request.arguments)
+    if not r.is_valid():
+        raise AssertionError(r.errors)
+    return r
+
+
+def bench(name, body, arguments_class, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        validate(body, arguments_class)
+    elapsed = time.perf_counter() - start
+    print("%-20s %10.0f requests/s  %6.2f us/request" % (name, n / elapsed, elapsed / n * 1e6))
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", action="store", type=int, default=100000)
+    (opts, args) = op.parse_args()
+    bench("online_score", SCORE_REQUEST, OnlineScoreRequest, opts.n)
+    bench("clients_interests", INTERESTS_REQUEST, ClientsInterestsRequest, opts.n)
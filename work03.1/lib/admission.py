@@ -0,0 +1,77 @@
+"""Контроль допуска запросов: при перегрузке (например, когда замедлился Redis)
+сервер сразу отвечает 503 с Retry-After, а не копит соединения в очереди пула
+потоков, пока клиенты не отвалятся по таймауту."""
+import time
+import threading
+
+RETRY_AFTER = 1         # с, значение заголовка Retry-After в ответе 503
+SHED_REASONS = ("backlog", "inflight", "queue_time")
+
+
+class AdmissionController:
+    """Контроль допуска для сервера с пулом потоков:
+    - запросов в обработке не больше max_inflight, сверх - 503 (inflight);
+    - запрос, ждавший свободного потока дольше max_queue_time с, получает 503 (queue_time);
+    - соединений, принятых и еще не взятых потоком пула, не больше max_inflight + admin_reserve,
+      сверх - 503 сразу при приеме, без очереди (backlog).
+    Простаивающие постоянные соединения в лимиты не входят. Запросам администратора
+    доступны еще admin_reserve мест сверх max_inflight, ожидание в очереди для них
+    не ограничено. Нулевой лимит - проверка отключена."""
+
+    def __init__(self, max_inflight=0, max_queue_time=0, admin_reserve=0, retry_after=RETRY_AFTER):
+        self.max_inflight = max_inflight
+        self.max_queue_time = max_queue_time
+        self.admin_reserve = admin_reserve
+        self.retry_after = retry_after
+        self.inflight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = dict.fromkeys(SHED_REASONS, 0)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.max_inflight or self.max_queue_time)
+
+    def accept(self):
+        """При приеме соединения. False - очередь к пулу полна, соединение надо сразу отклонить"""
+        with self._lock:
+            if self.max_inflight and self.queued >= self.max_inflight + self.admin_reserve:
+                self.shed["backlog"] += 1
+                return False
+            self.queued += 1
+            return True
+
+    def started(self, accepted):
+        """В потоке пула, когда соединение, принятое в момент accepted (time.monotonic), дождалось обработки"""
+        with self._lock:
+            self.queued -= 1
+        self._local.waited = time.monotonic() - accepted
+
+    def admit(self, admin=False):
+        """Решение по разобранному запросу: None - обслужить (по окончании вызвать done),
+        иначе причина отказа. Ожидание в очереди учитывается только у первого запроса
+        соединения, следующие запросы постоянного соединения читает уже занятый им поток."""
+        waited = getattr(self._local, "waited", 0.0)
+        self._local.waited = 0.0
+        limit = self.max_inflight + (self.admin_reserve if admin else 0)
+        with self._lock:
+            if self.max_inflight and self.inflight >= limit:
+                reason = "inflight"
+            elif not admin and self.max_queue_time and waited > self.max_queue_time:
+                reason = "queue_time"
+            else:
+                self.inflight += 1
+                self.admitted += 1
+                return None
+            self.shed[reason] += 1
+            return reason
+
+    def done(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def stats(self):
+        return {"inflight": self.inflight, "queued": self.queued, "max_inflight": self.max_inflight,
+                "admitted": self.admitted, "shed": dict(self.shed)}
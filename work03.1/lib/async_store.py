@@ -0,0 +1,174 @@
+import asyncio
+import functools
+from collections import deque
+
+from lib.store import MAX_RETRIES_RECONNECT, TIME_DELAY_TO_RECONNECT, backoff_delay
+
+
+def async_retry(exceptions, retries=MAX_RETRIES_RECONNECT, time_delay=TIME_DELAY_TO_RECONNECT):
+    """Повторы для корутин: пауза между попытками не блокирует цикл событий.
+    Проще RetryPolicy из lib.store - без бюджета времени, предохранителя и счетчиков"""
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapper(*args, **kwargs):
+            for n in range(retries):
+                try:
+                    return await f(*args, **kwargs)
+                except exceptions:
+                    if n == retries - 1:
+                        raise ConnectionError
+                    await asyncio.sleep(backoff_delay(n, time_delay))
+        return wrapper
+    return decorator
+
+
+class RedisReplyError(Exception):
+    pass
+
+
+def encode_command(*args):
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader):
+    """Читает один ответ в протоколе RESP; строки возвращаются декодированными"""
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Соединение с Redis закрыто")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RedisReplyError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode()
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError("Неизвестный ответ Redis: %r" % line)
+
+
+class AsyncRedisStorage:
+    """Асинхронный клиент Redis на одном соединении: команды конкурирующих
+    корутин отправляются конвейером, ответы разбираются по порядку отправки."""
+
+    def __init__(self, host='172.17.0.2', port=6379, timeout=1):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.pending = deque()
+        self._reader_task = None
+        self._connect_lock = None
+
+    async def reconnect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.writer is not None:
+                return
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                raise ConnectionError
+            self._reader_task = asyncio.ensure_future(self._read_replies(self.reader, self.pending))
+
+    async def _read_replies(self, reader, pending):
+        try:
+            while True:
+                reply = await read_reply(reader)
+                future = pending.popleft()
+                if future.done():
+                    continue
+                if isinstance(reply, RedisReplyError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except (OSError, EOFError, asyncio.IncompleteReadError, IndexError):
+            pass
+        finally:
+            self._disconnect(pending)
+
+    def _disconnect(self, pending):
+        if pending is not self.pending:
+            return
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+        self.pending = deque()
+        while pending:
+            future = pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError())
+
+    async def execute(self, *args):
+        if self.writer is None:
+            await self.reconnect()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.writer.write(encode_command(*args))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError
+
+    async def get(self, key):
+        return await self.execute("GET", key)
+
+    async def set(self, key, value, expires=None):
+        if expires:
+            await self.execute("SET", key, value, "EX", expires)
+        else:
+            await self.execute("SET", key, value)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+class AsyncStorage:
+    """Асинхронная обертка над хранилищем, упрощенная по сравнению с lib.store.Storage.
+    get/set и cache_set повторяются через async_retry при TimeoutError/ConnectionError,
+    cache_get обращается к хранилищу один раз и при ошибке возвращает None. Кэша в
+    памяти процесса (L1, кэширования промахов, stale_ttl), автомата отключения
+    (CircuitBreaker), бюджета времени на запрос и счетчиков stats здесь нет."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    @async_retry((TimeoutError, ConnectionError))
+    async def get(self, key):
+        return await self.storage.get(key)
+
+    @async_retry((TimeoutError, ConnectionError))
+    async def set(self, key, value, time_expires=None):
+        return await self.storage.set(key, value, expires=time_expires)
+
+    async def cache_get(self, key):
+        try:
+            return await self.storage.get(key)
+        except Exception:
+            return None
+
+    async def cache_set(self, key, value, time_expires=60*60):
+        try:
+            return await self.set(key, value, time_expires)
+        except Exception:
+            return None
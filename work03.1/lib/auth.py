@@ -0,0 +1,88 @@
+"""Проверка токенов без повторной работы на каждый запрос: токены сервисных
+аккаунтов, однажды прошедшие проверку, запоминаются по (account, login),
+токен администратора вычисляется один раз на час. Сравнение - за постоянное
+время (hmac.compare_digest), чтобы по времени ответа нельзя было подбирать токен."""
+import hmac
+import time
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+
+TOKEN_CACHE_SIZE = 1024
+ADMIN_TOKEN_FORMAT = "%Y%m%d%H"
+
+
+def token_matches(expected, token):
+    try:
+        return hmac.compare_digest(expected, token)
+    except TypeError:
+        # не строка или строка не из ASCII - заведомо не hex-дайджест
+        return False
+
+
+class TokenCache:
+    """Токены пользователей: sha512(account + login + salt). В кэш (не больше maxsize
+    пар account/login, при переполнении вытесняется самая давняя запись) попадают
+    только токены, прошедшие проверку, поэтому запросы с неверными токенами
+    не вытесняют из него рабочие аккаунты. Чтение из кэша - без блокировки."""
+
+    def __init__(self, salt, maxsize=TOKEN_CACHE_SIZE):
+        self.salt = salt
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, account, login):
+        return hashlib.sha512((account + login + self.salt).encode()).hexdigest()
+
+    def check(self, account, login, token):
+        key = (account, login)
+        expected = self._tokens.get(key)
+        if expected is not None and token_matches(expected, token):
+            self.hits += 1
+            return True
+        self.misses += 1
+        expected = self.digest(account, login)
+        if not token_matches(expected, token):
+            return False
+        with self._lock:
+            self._tokens[key] = expected
+            if len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+        return True
+
+    def stats(self):
+        return {"size": len(self._tokens), "hits": self.hits, "misses": self.misses}
+
+
+class AdminToken:
+    """Токен администратора sha512(<локальное время %Y%m%d%H> + salt). Пересчитывается,
+    только когда наступает следующий час; до этого проверка - одно сравнение времени."""
+
+    def __init__(self, salt, clock=time.time):
+        self.salt = salt
+        self.clock = clock
+        self.rollovers = 0
+        # (токен, до какого момента действует) - одним объектом, чтобы другой поток
+        # не увидел токен одного часа со сроком действия другого
+        self._current = (None, 0.0)
+
+    def _refresh(self, now):
+        hour = datetime.datetime.fromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+        expected = hashlib.sha512((hour.strftime(ADMIN_TOKEN_FORMAT) + self.salt).encode()).hexdigest()
+        self._current = (expected, (hour + datetime.timedelta(hours=1)).timestamp())
+        self.rollovers += 1
+        return expected
+
+    def expected(self):
+        now = self.clock()
+        expected, valid_until = self._current
+        if expected is None or now >= valid_until:
+            expected = self._refresh(now)
+        return expected
+
+    def check(self, token):
+        return token_matches(self.expected(), token)
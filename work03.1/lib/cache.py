@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import OrderedDict
+
+DEFAULT_TTL = 60 * 60
+
+
+class LocalCache:
+    """Ограниченный по размеру кэш в памяти процесса (L1 перед Redis).
+    У каждого ключа свой срок жизни; при переполнении вытесняется ключ,
+    к которому дольше всего не обращались. negative_ttl > 0 включает
+    кэширование промахов (отсутствующих в хранилище ключей) на это время.
+    stale_ttl > 0 оставляет истекшие ключи еще на stale_ttl секунд, чтобы
+    lookup мог отдать устаревшее значение, пока оно обновляется."""
+
+    def __init__(self, maxsize=256, negative_ttl=0, default_ttl=DEFAULT_TTL, stale_ttl=0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает (найден, значение); значение None - закэшированный промах"""
+        found, value, stale = self.lookup(key, allow_stale=False)
+        return found, value
+
+    def lookup(self, key, allow_stale=True):
+        """Возвращает (найден, значение, устарело)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                now = self.clock()
+                if expires > now:
+                    self._data.move_to_end(key)
+                    if value is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return True, value, False
+                if expires + self.stale_ttl <= now:
+                    del self._data[key]
+                elif allow_stale and value is not None:
+                    self.stale_hits += 1
+                    return True, value, True
+            self.misses += 1
+            return False, None, False
+
+    def set(self, key, value, ttl=None):
+        if value is None:
+            ttl = self.negative_ttl
+        elif ttl is None:
+            ttl = self.default_ttl
+        if not ttl or ttl <= 0:
+            self.delete(key)
+            return
+        with self._lock:
+            self._data[key] = (value, self.clock() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.negative_hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
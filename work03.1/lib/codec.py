@@ -0,0 +1,98 @@
+"""Сериализация ответов и сжатие тела ответа.
+JSON-кодек подключаемый: orjson, если установлен (в несколько раз быстрее
+на больших ответах clients_interests), иначе стандартный json. Сжатие gzip/deflate
+согласуется по заголовку Accept-Encoding и включается только для тел больше порога."""
+import json
+import zlib
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPRESS_MIN_SIZE = 1024        # байт, меньшие тела не сжимаются - выигрыш меньше затрат
+# 1 - быстрее, 9 - плотнее, 0 - сжатие выключено. На ответах clients_interests уровень 6
+# сжимает всего на четверть плотнее уровня 1, но в 4-5 раз дольше (bench_response.py)
+COMPRESS_LEVEL = 1
+STREAM_CHUNK_SIZE = 64 * 1024   # байт тела, сжимаемых и отправляемых за один раз
+# wbits zlib: gzip - с заголовком gzip, deflate в HTTP - поток в формате zlib
+ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+class StdlibCodec:
+    name = "json"
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode("UTF-8")
+
+
+class OrjsonCodec:
+    """orjson: сразу отдает UTF-8 без пробелов; ключи-числа (id клиентов) - строками, как json.
+    То, что orjson сериализовать не умеет (например, числа вне 64 бит), отдается стандартному json"""
+    name = "orjson"
+
+    @staticmethod
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return StdlibCodec.dumps(obj)
+
+
+CODECS = {codec.name: codec for codec in (StdlibCodec, OrjsonCodec)}
+
+
+def available_codecs():
+    return [name for name in CODECS if name != OrjsonCodec.name or orjson is not None]
+
+
+def get_codec(name="auto"):
+    """auto - самый быстрый из установленных кодеков"""
+    if name == "auto":
+        return OrjsonCodec if orjson is not None else StdlibCodec
+    if name not in available_codecs():
+        raise ValueError("JSON-кодек %s недоступен, есть: %s" % (name, ", ".join(available_codecs())))
+    return CODECS[name]
+
+
+@lru_cache(maxsize=256)
+def choose_encoding(accept_encoding):
+    """Кодирование из заголовка Accept-Encoding: "gzip", "deflate" или None.
+    Учитываются веса q, при равных предпочтителен gzip; "*" - любое не перечисленное.
+    Значения заголовка у клиентов повторяются, поэтому разбор кэшируется."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip()] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress_chunks(body, encoding, level=COMPRESS_LEVEL, chunk_size=STREAM_CHUNK_SIZE):
+    """Сжимает body по частям chunk_size; части отдаются по мере готовности"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    view = memoryview(body)
+    for start in range(0, len(body), chunk_size):
+        data = compressor.compress(view[start:start + chunk_size])
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress(body, encoding, level=COMPRESS_LEVEL):
+    return b"".join(compress_chunks(body, encoding, level, max(len(body), 1)))
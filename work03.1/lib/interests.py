@@ -0,0 +1,75 @@
+"""Хранение интересов клиентов: ключ "i:<id>", значение - JSON-список либо
+компактная битовая маска по словарю INTERESTS ("#" и маска в hex: "#1a3").
+Маска короче и быстрее разбирается, но теряет порядок интересов и подходит только
+для интересов из словаря; остальные списки записываются в JSON."""
+import json
+import time
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+INTEREST_BITS = {interest: 1 << i for i, interest in enumerate(INTERESTS)}
+ENCODINGS = ("json", "bitmask")
+BITMASK_PREFIX = "#"
+LOAD_CHUNK_SIZE = 1000
+
+
+def interests_key(cid):
+    return "i:%s" % cid
+
+
+def encode_interests(interests, encoding="json"):
+    if encoding == "bitmask" and all(interest in INTEREST_BITS for interest in interests):
+        mask = 0
+        for interest in interests:
+            mask |= INTEREST_BITS[interest]
+        return "%s%x" % (BITMASK_PREFIX, mask)
+    return json.dumps(interests, ensure_ascii=False)
+
+
+def decode_interests(value):
+    """Список интересов из значения в хранилище; для отсутствующего ключа - []"""
+    if not value:
+        return []
+    if value[0] == BITMASK_PREFIX:
+        mask = int(value[1:], 16)
+        return [interest for interest, bit in INTEREST_BITS.items() if mask & bit]
+    return json.loads(value)
+
+
+def parse_line(line):
+    """Строка файла с интересами: JSON {"client_id": 1, "interests": [...]}
+    либо "<id><TAB><интерес>,<интерес>..."; пустые строки и комментарии - None"""
+    line = line.strip()
+    if not line or line.startswith("//"):
+        return None
+    if line[0] == "{":
+        item = json.loads(line)
+        return int(item["client_id"]), list(item["interests"])
+    cid, _, interests = line.partition("\t")
+    return int(cid), [interest.strip() for interest in interests.split(",") if interest.strip()]
+
+
+def load_interests(store, lines, chunk_size=LOAD_CHUNK_SIZE, encoding="json", expires=None, progress=None):
+    """Записывает интересы из lines в хранилище пачками по chunk_size через set_many
+    (для Redis - один конвейер на пачку). progress(загружено, секунд) вызывается
+    после каждой пачки. Возвращает число загруженных клиентов."""
+    started = time.monotonic()
+    loaded = 0
+    chunk = {}
+    for line in lines:
+        item = parse_line(line)
+        if item is None:
+            continue
+        cid, interests = item
+        chunk[interests_key(cid)] = encode_interests(interests, encoding)
+        if len(chunk) >= chunk_size:
+            store.set_many(chunk, expires)
+            loaded += len(chunk)
+            chunk = {}
+            if progress is not None:
+                progress(loaded, time.monotonic() - started)
+    if chunk:
+        store.set_many(chunk, expires)
+        loaded += len(chunk)
+        if progress is not None:
+            progress(loaded, time.monotonic() - started)
+    return loaded
@@ -0,0 +1,236 @@
+import os
+import json
+import logging
+import time
+import threading
+from collections import OrderedDict
+
+STRIPES = 16
+MAX_MEMORY = 64 * 1024 * 1024   # байт
+SWEEP_INTERVAL = 1              # с, период фоновой очистки истекших ключей
+ITEM_OVERHEAD = 64              # байт, оценка накладных расходов на один ключ
+
+
+def _to_str(value):
+    # как redis-py с decode_responses: хранится и возвращается строка
+    if isinstance(value, bytes):
+        return value.decode()
+    return value if isinstance(value, str) else str(value)
+
+
+class _Stripe:
+    __slots__ = ("lock", "data", "memory")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = OrderedDict()   # ключ -> (значение, истекает, размер)
+        self.memory = 0
+
+
+class MemoryStorage:
+    """Хранилище в памяти процесса с тем же интерфейсом, что у RedisStorage
+    (для одиночных узлов без Redis и для тестов). Ключи разложены по stripes
+    частям со своими блокировками, чтобы потоки сервера не ждали друг друга.
+    Истекшие ключи удаляются при чтении и фоновым потоком раз в sweep_interval.
+    Объем ограничен max_memory байт (оценка по длине ключей и значений): при
+    превышении вытесняются давно не использованные ключи. Если задан
+    snapshot_path, при создании хранилище загружается из снимка, а при close
+    сохраняется в него."""
+
+    def __init__(self, max_memory=MAX_MEMORY, stripes=STRIPES, sweep_interval=SWEEP_INTERVAL,
+                 snapshot_path=None, clock=time.monotonic):
+        self.stripes = [_Stripe() for _ in range(stripes)]
+        self.stripe_memory = max_memory // stripes
+        self.max_memory = max_memory
+        self.sweep_interval = sweep_interval
+        self.snapshot_path = snapshot_path
+        self.clock = clock
+        self.evictions = 0
+        self.expired = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load_snapshot(snapshot_path)
+
+    def _stripe(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    def _ensure_started(self):
+        # поток очистки запускается при первом обращении в том процессе, который
+        # работает с хранилищем (после fork поток родителя в дочернем не существует)
+        with self._start_lock:
+            if self.sweep_interval and (self._thread is None or self._pid != os.getpid()):
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.sweep_interval):
+            self.sweep()
+
+    def _get(self, stripe, key, now):
+        """Возвращает (значение, истекает) или None; вызывается под stripe.lock"""
+        item = stripe.data.get(key)
+        if item is None:
+            return None
+        value, expires, size = item
+        if expires is not None and expires <= now:
+            del stripe.data[key]
+            stripe.memory -= size
+            self.expired += 1
+            return None
+        stripe.data.move_to_end(key)
+        return value, expires
+
+    def _set(self, stripe, key, value, expires, now):
+        value = _to_str(value)
+        size = len(key) + len(value) + ITEM_OVERHEAD
+        old = stripe.data.pop(key, None)
+        if old is not None:
+            stripe.memory -= old[2]
+        stripe.data[key] = (value, now + expires if expires else None, size)
+        stripe.memory += size
+        while stripe.memory > self.stripe_memory and len(stripe.data) > 1:
+            _, (_, _, evicted) = stripe.data.popitem(last=False)
+            stripe.memory -= evicted
+            self.evictions += 1
+
+    def get(self, key):
+        if self._pid != os.getpid():
+            self._ensure_started()
+        stripe = self._stripe(key)
+        with stripe.lock:
+            item = self._get(stripe, key, self.clock())
+        return item[0] if item else None
+
+    def set(self, key, value, expires=None):
+        if self._pid != os.getpid():
+            self._ensure_started()
+        stripe = self._stripe(key)
+        with stripe.lock:
+            self._set(stripe, key, value, expires, self.clock())
+
+    def get_with_ttl(self, key):
+        """Значение ключа и оставшийся срок его жизни в секундах (None - бессрочно)"""
+        return self.get_many_with_ttl([key])[0]
+
+    def get_many_with_ttl(self, keys):
+        if self._pid != os.getpid():
+            self._ensure_started()
+        now = self.clock()
+        result = []
+        for key in keys:
+            stripe = self._stripe(key)
+            with stripe.lock:
+                item = self._get(stripe, key, now)
+            if item is None:
+                result.append((None, None))
+            else:
+                value, expires = item
+                result.append((value, expires - now if expires is not None else None))
+        return result
+
+    def get_many(self, keys):
+        return [value for value, ttl in self.get_many_with_ttl(keys)]
+
+    def set_many(self, mapping, expires=None):
+        if self._pid != os.getpid():
+            self._ensure_started()
+        now = self.clock()
+        for key, value in mapping.items():
+            stripe = self._stripe(key)
+            with stripe.lock:
+                self._set(stripe, key, value, expires, now)
+
+    def lock(self, key, token, ttl):
+        """Занимает key значением token на ttl секунд, если ключ свободен"""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            now = self.clock()
+            if self._get(stripe, key, now) is not None:
+                return False
+            self._set(stripe, key, token, ttl, now)
+            return True
+
+    def unlock(self, key, token):
+        stripe = self._stripe(key)
+        with stripe.lock:
+            item = self._get(stripe, key, self.clock())
+            if item is not None and item[0] == token:
+                stripe.memory -= stripe.data.pop(key)[2]
+
+    def delete(self, key):
+        stripe = self._stripe(key)
+        with stripe.lock:
+            item = stripe.data.pop(key, None)
+            if item is not None:
+                stripe.memory -= item[2]
+        return item is not None
+
+    def sweep(self):
+        """Удаляет истекшие ключи; части блокируются по очереди"""
+        removed = 0
+        for stripe in self.stripes:
+            with stripe.lock:
+                now = self.clock()
+                for key in [k for k, (_, expires, _) in stripe.data.items()
+                            if expires is not None and expires <= now]:
+                    stripe.memory -= stripe.data.pop(key)[2]
+                    removed += 1
+        self.expired += removed
+        return removed
+
+    def save_snapshot(self, path):
+        """Сохраняет живые ключи в JSON; сроки жизни - в абсолютном времени (time.time),
+        чтобы их можно было восстановить после перезапуска"""
+        now, wall = self.clock(), time.time()
+        items = []
+        for stripe in self.stripes:
+            with stripe.lock:
+                for key, (value, expires, _) in stripe.data.items():
+                    if expires is None or expires > now:
+                        items.append([key, value, expires - now + wall if expires is not None else None])
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return len(items)
+
+    def load_snapshot(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Не удалось загрузить снимок %s: %s" % (path, e))
+            return 0
+        now, wall = self.clock(), time.time()
+        loaded = 0
+        for key, value, expires_at in items:
+            if expires_at is not None and expires_at <= wall:
+                continue
+            stripe = self._stripe(key)
+            with stripe.lock:
+                self._set(stripe, key, value, expires_at - wall if expires_at is not None else None, now)
+            loaded += 1
+        return loaded
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        if self.snapshot_path:
+            self.save_snapshot(self.snapshot_path)
+
+    def __len__(self):
+        return sum(len(stripe.data) for stripe in self.stripes)
+
+    def stats(self):
+        return {
+            "keys": len(self),
+            "memory": sum(stripe.memory for stripe in self.stripes),
+            "max_memory": self.max_memory,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
@@ -0,0 +1,191 @@
+"""Метрики сервера скоринга: счетчики и гистограммы длительности запросов
+по методам и фазам обработки, вывод в текстовом формате Prometheus."""
+import re
+import bisect
+import threading
+from collections import deque
+from time import perf_counter
+
+# с, верхние границы корзин гистограмм
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+MAX_PENDING = 10000     # сколько запросов копить до раскладки по гистограммам
+METRIC_NAME = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+
+_local = threading.local()
+
+
+class PhaseTimer:
+    """Секундомер запроса: mark(фаза) запоминает фазу и момент ее окончания.
+    Длительности считаются позже, при раскладке по гистограммам."""
+    __slots__ = ("marks",)
+
+    def __init__(self):
+        self.marks = [(None, perf_counter())]
+
+    def mark(self, phase):
+        self.marks.append((phase, perf_counter()))
+
+    @property
+    def elapsed(self):
+        return self.marks[-1][1] - self.marks[0][1]
+
+    @property
+    def phases(self):
+        """Фаза -> суммарная длительность (фаза может встречаться несколько раз)"""
+        phases = {}
+        marks = self.marks
+        for i in range(1, len(marks)):
+            phase, at = marks[i]
+            phases[phase] = phases.get(phase, 0.0) + at - marks[i - 1][1]
+        return phases
+
+
+def start_timer():
+    """Заводит секундомер для запроса, обрабатываемого текущим потоком"""
+    timer = PhaseTimer()
+    _local.marks = timer.marks
+    return timer
+
+
+def stop_timer():
+    _local.marks = None
+
+
+def mark(phase):
+    """Отметка фазы для секундомера текущего потока; без секундомера ничего не делает"""
+    marks = getattr(_local, "marks", None)
+    if marks is not None:
+        marks.append((phase, perf_counter()))
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def stats_samples(prefix, stats, labels=()):
+    """Разворачивает вложенный словарь stats() в (имя, метки, значение).
+    Ключи, не годные в имя метрики (например, узлы "host:port"), становятся меткой node,
+    строковые значения - меткой state со значением 1."""
+    for key, value in stats.items():
+        if METRIC_NAME.fullmatch(str(key)):
+            name, item_labels = "%s_%s" % (prefix, key), labels
+        else:
+            name, item_labels = prefix, labels + (("node", key),)
+        if isinstance(value, dict):
+            yield from stats_samples(name, value, item_labels)
+        elif isinstance(value, str):
+            yield name, item_labels + (("state", value),), 1
+        elif isinstance(value, (int, float)):
+            yield name, item_labels, value
+
+
+class Metrics:
+    """Счетчики запросов по методу и коду ответа, гистограммы полной длительности
+    и длительности фаз. record только ставит секундомер в очередь (deque.append
+    потокобезопасен и не требует блокировки), по гистограммам очередь
+    раскладывается при выводе метрик или когда в ней накопится max_pending запросов."""
+
+    def __init__(self, prefix="scoring", buckets=DEFAULT_BUCKETS, max_pending=MAX_PENDING):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.max_pending = max_pending
+        self.requests = {}      # (метод, код) -> число запросов
+        self.durations = {}     # метод -> Histogram
+        self.phases = {}        # (метод, фаза) -> Histogram
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def record(self, method, code, timer):
+        self._pending.append((method, code, timer))
+        if len(self._pending) >= self.max_pending:
+            self.collect()
+
+    def collect(self):
+        """Раскладывает накопленные запросы по счетчикам и гистограммам"""
+        with self._lock:
+            pending, requests, durations, phases = self._pending, self.requests, self.durations, self.phases
+            buckets, bisect_left = self.buckets, bisect.bisect_left
+            while pending:
+                method, code, timer = pending.popleft()
+                key = (method, code)
+                requests[key] = requests.get(key, 0) + 1
+                marks = timer.marks
+                started = previous = marks[0][1]
+                spent = {}
+                for phase, at in marks[1:]:
+                    spent[phase] = spent.get(phase, 0.0) + at - previous
+                    previous = at
+                spent[None] = previous - started
+                for phase, seconds in spent.items():
+                    if phase is None:
+                        histogram = durations.get(method) or self._histogram(durations, method)
+                    else:
+                        key = (method, phase)
+                        histogram = phases.get(key) or self._histogram(phases, key)
+                    histogram.counts[bisect_left(buckets, seconds)] += 1
+                    histogram.sum += seconds
+                    histogram.count += 1
+
+    def reset(self):
+        with self._lock:
+            self._pending.clear()
+            self.requests.clear()
+            self.durations.clear()
+            self.phases.clear()
+
+    def _render_histogram(self, lines, name, labels, histogram):
+        cumulative = 0
+        for le, count in zip(self.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (name, format_labels(labels + (("le", le),)), cumulative))
+        lines.append("%s_sum%s %.9f" % (name, format_labels(labels), histogram.sum))
+        lines.append("%s_count%s %d" % (name, format_labels(labels), histogram.count))
+
+    def render(self, stats=None, server=None):
+        """Текст для GET /metrics; stats - словарь Storage.stats() (кэш, повторы, пул),
+        server - счетчики самого сервера (контроль допуска)"""
+        requests_name = "%s_requests_total" % self.prefix
+        duration_name = "%s_request_duration_seconds" % self.prefix
+        phase_name = "%s_phase_duration_seconds" % self.prefix
+        self.collect()
+        lines = ["# TYPE %s counter" % requests_name]
+        with self._lock:
+            for (method, code), count in sorted(self.requests.items()):
+                lines.append("%s%s %d" % (requests_name, format_labels((("method", method), ("code", code))), count))
+            lines.append("# TYPE %s histogram" % duration_name)
+            for method, histogram in sorted(self.durations.items()):
+                self._render_histogram(lines, duration_name, (("method", method),), histogram)
+            lines.append("# TYPE %s histogram" % phase_name)
+            for (method, phase), histogram in sorted(self.phases.items()):
+                self._render_histogram(lines, phase_name, (("method", method), ("phase", phase)), histogram)
+        if stats:
+            for name, labels, value in stats_samples("%s_store" % self.prefix, stats):
+                lines.append("%s%s %s" % (name, format_labels(labels), value))
+        if server:
+            for name, labels, value in stats_samples("%s_server" % self.prefix, server):
+                lines.append("%s%s %s" % (name, format_labels(labels), value))
+        return "\n".join(lines) + "\n"
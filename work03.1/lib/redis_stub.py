@@ -0,0 +1,168 @@
+"""Минимальный Redis-сервер в процессе (протокол RESP поверх asyncio) для тестов
+и нагрузочных прогонов без настоящего redis-server. Поддерживает команды,
+которыми пользуются хранилища из lib и redis-py: PING, HELLO, CLIENT, SELECT,
+GET, SET [EX|PX] [NX], PTTL, MGET, MSET, DEL, FLUSHDB, MULTI/EXEC."""
+import time
+import asyncio
+import threading
+
+
+class RedisStub:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.data = {}
+        self.commands = 0
+        self.connections = set()
+        self.server = None
+        self.loop = None
+        self._thread = None
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires < time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _set(self, key, value, expires=None):
+        self.data[key] = (value, time.monotonic() + expires if expires is not None else None)
+
+    def execute(self, command, *args):
+        self.commands += 1
+        command = command.upper()
+        if command == b"PING":
+            return "PONG"
+        if command == b"HELLO":
+            proto = int(args[0]) if args else 2
+            return {"server": "redis", "version": "7.0.0", "proto": proto, "mode": "standalone"}
+        if command in (b"CLIENT", b"SELECT"):
+            return "OK"
+        if command == b"GET":
+            return self._get(args[0])
+        if command == b"SET":
+            expires = None
+            options = [a.upper() for a in args[2:]]
+            if b"NX" in options and self._get(args[0]) is not None:
+                return None
+            if b"EX" in options:
+                expires = float(args[2 + options.index(b"EX") + 1])
+            elif b"PX" in options:
+                expires = float(args[2 + options.index(b"PX") + 1]) / 1000
+            self._set(args[0], args[1], expires)
+            return "OK"
+        if command == b"PTTL":
+            if self._get(args[0]) is None:
+                return -2
+            expires = self.data[args[0]][1]
+            return -1 if expires is None else int((expires - time.monotonic()) * 1000)
+        if command == b"MGET":
+            return [self._get(key) for key in args]
+        if command == b"MSET":
+            for i in range(0, len(args), 2):
+                self._set(args[i], args[i + 1])
+            return "OK"
+        if command == b"DEL":
+            return sum(self.data.pop(key, None) is not None for key in args)
+        if command == b"FLUSHDB":
+            self.data.clear()
+            return "OK"
+        return Exception("ERR unknown command '%s'" % command.decode())
+
+    def encode(self, reply, resp3=False):
+        if reply is None:
+            return b"_\r\n" if resp3 else b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return b"-%s\r\n" % str(reply).encode()
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, dict):
+            # RESP3 map в ответ на HELLO 3; для HELLO 2 - плоский массив
+            items = [x for pair in reply.items() for x in pair]
+            if resp3:
+                return b"%%%d\r\n" % len(reply) + b"".join(self.encode(r, resp3) for r in items)
+            return self.encode(items)
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self.encode(r, resp3) for r in reply)
+        if isinstance(reply, str):
+            return b"+%s\r\n" % reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        self.connections.add(writer)
+        resp3 = False
+        transaction = None
+        try:
+            while True:
+                args = await self.read_command(reader)
+                if not args:
+                    break
+                command = args[0].upper()
+                if command == b"HELLO" and args[1:] == [b"3"]:
+                    resp3 = True
+                if command == b"MULTI":
+                    transaction, reply = [], "OK"
+                elif command == b"EXEC" and transaction is not None:
+                    reply = [self.execute(*queued) for queued in transaction]
+                    transaction = None
+                elif transaction is not None:
+                    transaction.append(args)
+                    reply = "QUEUED"
+                else:
+                    reply = self.execute(*args)
+                writer.write(self.encode(reply, resp3))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.connections):
+            writer.close()
+        await self.server.wait_closed()
+        await asyncio.sleep(0)
+
+    def start_in_thread(self):
+        """Запускает сервер в отдельном потоке со своим циклом событий
+        (для синхронных клиентов, например redis-py)"""
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
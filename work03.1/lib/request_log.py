@@ -0,0 +1,173 @@
+"""Неблокирующее журналирование: записи уходят в ограниченную очередь
+(QueueHandler), форматирует и пишет их фоновый поток пачками - одна запись
+в файл и один flush на пачку. Журнал запросов - компактный JSON, успешные
+запросы можно писать выборочно, ошибки и медленные запросы пишутся всегда."""
+import os
+import sys
+import json
+import queue
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler
+
+LOG_FORMAT = '[%(asctime)s] %(levelname).1s %(message)s'
+LOG_DATE_FORMAT = '%Y.%m.%d %H:%M:%S'
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+SLOW_REQUEST = 0.1      # с, запросы дольше этого пишутся в журнал всегда
+
+_writer = None
+
+
+class BatchLogWriter:
+    """Фоновый поток: забирает из очереди все накопившиеся записи (до batch_size),
+    форматирует их и пишет в поток вывода handler одной операцией"""
+
+    def __init__(self, handler, maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.written = 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # как у WriteBehindQueue: после fork поток родителя в дочернем процессе не существует
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def put(self, record):
+        if self._pid != os.getpid():
+            self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._write([record for record in batch if record is not None])
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            if record.levelno < self.handler.level:
+                continue
+            try:
+                lines.append(self.handler.format(record))
+            except Exception:
+                self.handler.handleError(record)
+        if not lines:
+            return
+        stream = self.handler.stream
+        stream.write(self.handler.terminator.join(lines) + self.handler.terminator)
+        stream.flush()
+        self.written += len(lines)
+
+    def flush(self):
+        """Ждет, пока будут записаны все поставленные в очередь записи"""
+        if self._thread is not None and self._pid == os.getpid():
+            self.queue.join()
+
+    def stop(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.handler.close()
+
+
+class AsyncQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке (сообщение
+    собирается в BatchLogWriter) и не ждет, если очередь заполнена"""
+
+    def __init__(self, writer):
+        super().__init__(writer.queue)
+        self.writer = writer
+
+    def prepare(self, record):
+        if record.exc_info:
+            # трассировку форматируем сразу, пока живы кадры стека
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self.writer.put(record)
+
+
+class JsonMessage:
+    """Сообщение журнала, которое сериализуется в JSON только при форматировании"""
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class RequestLogger:
+    """Журнал запросов: ответы с ошибкой и запросы дольше slow_threshold пишутся
+    всегда (с телом запроса), успешные - с вероятностью sample_rate"""
+
+    def __init__(self, sample_rate=1.0, slow_threshold=SLOW_REQUEST, logger=None, rnd=random.random):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.logger = logger or logging.getLogger("api.requests")
+        self.rnd = rnd
+        self.skipped = 0
+
+    def log(self, context, code, elapsed, path=None, body=None):
+        error = code >= 400
+        slow = elapsed >= self.slow_threshold
+        if not error and not slow and self.sample_rate < 1 and self.rnd() >= self.sample_rate:
+            self.skipped += 1
+            return False
+        data = dict(context, elapsed=round(elapsed, 6))
+        if path is not None:
+            data["path"] = path
+        if error or slow:
+            data["body"] = body
+            if slow:
+                data["slow"] = True
+        self.logger.log(logging.WARNING if error or slow else logging.INFO, JsonMessage(data))
+        return True
+
+
+def setup_logging(filename=None, level=logging.INFO, fmt=LOG_FORMAT, datefmt=LOG_DATE_FORMAT,
+                  maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE):
+    """Замена logging.basicConfig: корневой логгер пишет через очередь и BatchLogWriter"""
+    global _writer
+    handler = logging.FileHandler(filename) if filename else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(fmt, datefmt))
+    _writer = BatchLogWriter(handler, maxsize, batch_size)
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(AsyncQueueHandler(_writer))
+    root.setLevel(level)
+    return _writer
+
+
+def stop_logging():
+    """Дописывает очередь журнала текущего процесса и останавливает фоновый поток"""
+    if _writer is not None:
+        _writer.stop()
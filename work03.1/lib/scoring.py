@@ -1,10 +1,18 @@
 import hashlib
 import json
-import random
 import time
+from contextlib import nullcontext
 
+from lib.interests import decode_interests, interests_key
+from lib.singleflight import SingleFlight
+from lib.store import LOCK_TTL
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+LOCK_POLL_INTERVAL = 0.01   # с, как часто проверять кэш, пока расчет держит другой процесс
+
+score_flight = SingleFlight()
+
+
+def score_key(phone, birthday=None, first_name=None, last_name=None):
     if phone:
         try:
             phone = str(phone)
@@ -16,13 +24,11 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         phone or "",
         birthday.strftime("%Y%m%d") if birthday is not None else "",
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
+    return "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
 
-    score = store.cache_get(key) or 0
-    if score:
-        return json.loads(score)
+
+def calc_score(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    score = 0
     if phone:
         score += 1.5
     if email:
@@ -31,19 +37,97 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         score += 1.5
     if first_name and last_name:
         score += 0.5
+    return score
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    key = score_key(phone, birthday, first_name, last_name)
+    # try get from cache,
+    # fallback to heavy calculation in case of cache miss
+
+    args = (phone, email, birthday, gender, first_name, last_name)
+    # устаревшее значение (stale_ttl) пересчитывается в фоне тем же путем, что и промах
+    score = store.cache_get(key, refresh=lambda key: score_flight.do(key, compute_score, store, key, *args)) or 0
+    if score:
+        return json.loads(score)
+    # одновременные промахи по одному ключу считает и записывает в кэш только первый поток
+    return score_flight.do(key, compute_score, store, key, *args)
+
+
+def compute_score(store, key, *args, **kwargs):
+    """Расчет скоринга с записью в кэш. Если у хранилища включен score_lock, расчет
+    одного ключа в разных процессах защищен короткой распределенной блокировкой:
+    не получивший ее сначала ждет, пока результат появится в кэше."""
+    lock = store.distributed_lock("lock:" + key) if store.score_lock else nullcontext(True)
+    with lock as acquired:
+        if not acquired:
+            score = wait_cached(store, key)
+            if score:
+                return json.loads(score)
+        score = calc_score(*args, **kwargs)
+        # cache for 60 minutes
+        store.cache_set(key, score, 60 * 60)
+        return score
+
+
+def wait_cached(store, key, timeout=LOCK_TTL, interval=LOCK_POLL_INTERVAL):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        score = store.cache_get(key)
+        if score:
+            return score
+    return None
+
+
+def get_scores_many(store, requests):
+    """get_score для списка запросов (словари с аргументами get_score без store):
+    кэш читается и пополняется за одно обращение к хранилищу. Промахи проходят
+    через тот же score_flight, что и одиночные запросы: ключ, который уже считает
+    другой запрос, пакет не пересчитывает, а ждет его результат"""
+    keys = [score_key(r.get("phone"), r.get("birthday"), r.get("first_name"), r.get("last_name"))
+            for r in requests]
+    by_key = dict(zip(keys, requests))
+    cached = store.cache_get_many(
+        keys, refresh=lambda key: score_flight.do(key, compute_score, store, key, **by_key[key]))
+    missing = [key for key, value in zip(keys, cached) if not value]
+    computed = score_flight.do_many(missing, lambda keys: compute_scores(store, {key: by_key[key] for key in keys}))
+    return [json.loads(value) if value else computed[key] for key, value in zip(keys, cached)]
+
+
+def compute_scores(store, requests):
+    """compute_score для нескольких ключей ({ключ: аргументы calc_score}). С score_lock
+    каждый ключ считается под своей блокировкой, как в compute_score, иначе
+    результаты пишутся в кэш одной пачкой"""
+    if store.score_lock:
+        return {key: compute_score(store, key, **r) for key, r in requests.items()}
+    scores = {key: calc_score(**r) for key, r in requests.items()}
     # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
+    store.cache_set_many(scores, 60 * 60)
+    return scores
+
+
+async def async_get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    """get_score для асинхронного хранилища (lib.async_store.AsyncStorage)"""
+    key = score_key(phone, birthday, first_name, last_name)
+    score = await store.cache_get(key) or 0
+    if score:
+        return json.loads(score)
+    score = calc_score(phone, email, birthday, gender, first_name, last_name)
+    await store.cache_set(key, score, 60 * 60)
     return score
 
 
 def get_interests(store, cid):
-    key = "i:%s" % cid
+    return decode_interests(store.get(interests_key(cid)))
+
+
+def get_interests_many(store, cids):
+    """get_interests для списка клиентов за одно обращение к хранилищу"""
+    values = store.get_many([interests_key(cid) for cid in cids])
+    return {cid: decode_interests(r) for cid, r in zip(cids, values)}
 
-    # -- запишем в базу случайные данные, чтобы потом их считать
-    interests = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
-    res = random.sample(interests, cid)
-    store.set(key, json.dumps(res))
-    # --
 
-    r = store.get(key)
-    return json.loads(r) if r else []
+async def async_get_interests(store, cid):
+    """get_interests для асинхронного хранилища (lib.async_store.AsyncStorage)"""
+    return decode_interests(await store.get(interests_key(cid)))
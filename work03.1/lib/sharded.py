@@ -0,0 +1,139 @@
+import bisect
+import hashlib
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.store import RedisStorage, RetryPolicy, request_deadline, remaining_deadline
+
+VIRTUAL_NODES = 160
+
+
+def parse_nodes(addresses):
+    """'host1:6379,host2:6380' -> [('host1', 6379), ('host2', 6380)]"""
+    nodes = []
+    for address in addresses.split(","):
+        host, _, port = address.strip().rpartition(":")
+        nodes.append((host or "localhost", int(port)))
+    return nodes
+
+
+class HashRing:
+    """Кольцо консистентного хеширования: у каждого узла vnodes точек на кольце,
+    ключ принадлежит узлу первой точки по часовой стрелке от хеша ключа.
+    При добавлении/удалении узла переезжает примерно 1/N ключей."""
+
+    def __init__(self, nodes, vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        points = sorted((self.hash("%s#%d" % (node, i)), node) for node in nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def get_node(self, key):
+        i = bisect.bisect(self._hashes, self.hash(key))
+        return self._nodes[i % len(self._nodes)]
+
+
+class ShardedStorage:
+    """Хранилище поверх нескольких Redis: ключи распределяются консистентным
+    хешированием, у каждого узла свой клиент (пул соединений) и своя RetryPolicy
+    с предохранителем - отказ одного узла не задевает ключи остальных.
+    Пакетные операции делятся по узлам и выполняются параллельно."""
+
+    # повторы выполняются по узлам, Storage повторно их не оборачивает
+    manages_retries = True
+
+    def __init__(self, nodes, vnodes=VIRTUAL_NODES, timeout=1, storage_factory=None, policy_factory=RetryPolicy):
+        if storage_factory is None:
+            storage_factory = lambda host, port: RedisStorage(host=host, port=port, timeout=timeout)
+        self.names = ["%s:%s" % (host, port) for host, port in nodes]
+        self.nodes = {name: storage_factory(host, port) for name, (host, port) in zip(self.names, nodes)}
+        self.policies = {name: policy_factory() for name in self.names}
+        self.ring = HashRing(self.names, vnodes)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.names))
+
+    def node_for(self, key):
+        return self.ring.get_node(key)
+
+    def _call(self, name, method, *args, **kwargs):
+        return self.policies[name].call(getattr(self.nodes[name], method), *args, **kwargs)
+
+    def get(self, key):
+        return self._call(self.node_for(key), "get", key)
+
+    def set(self, key, value, expires=None):
+        return self._call(self.node_for(key), "set", key, value, expires=expires)
+
+    def lock(self, key, token, ttl):
+        return self._call(self.node_for(key), "lock", key, token, ttl)
+
+    def unlock(self, key, token):
+        return self._call(self.node_for(key), "unlock", key, token)
+
+    def get_with_ttl(self, key):
+        return self._call(self.node_for(key), "get_with_ttl", key)
+
+    def _split(self, keys):
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self.node_for(key), []).append(i)
+        return groups
+
+    def _call_in_parallel(self, calls):
+        """calls - {узел: (метод, аргументы)}; возвращает {узел: результат}"""
+        if len(calls) == 1:
+            (name, (method, args)), = calls.items()
+            return {name: self._call(name, method, *args)}
+        remaining = remaining_deadline()
+
+        def run(name, method, args):
+            # request_deadline хранится в потоке запроса, переносим его в поток пула
+            with request_deadline(remaining) if remaining is not None else nullcontext():
+                return self._call(name, method, *args)
+
+        futures = {name: self._executor.submit(run, name, method, args) for name, (method, args) in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _get_many(self, method, keys):
+        keys = list(keys)
+        groups = self._split(keys)
+        replies = self._call_in_parallel({name: (method, ([keys[i] for i in idx],))
+                                          for name, idx in groups.items()})
+        result = [None] * len(keys)
+        for name, idx in groups.items():
+            for i, value in zip(idx, replies[name]):
+                result[i] = value
+        return result
+
+    def get_many(self, keys):
+        return self._get_many("get_many", keys)
+
+    def get_many_with_ttl(self, keys):
+        return self._get_many("get_many_with_ttl", keys)
+
+    def set_many(self, mapping, expires=None):
+        groups = {}
+        for key, value in mapping.items():
+            groups.setdefault(self.node_for(key), {})[key] = value
+        if groups:
+            self._call_in_parallel({name: ("set_many", (items, expires)) for name, items in groups.items()})
+
+    def warm_up(self, connections=None):
+        return sum(node.warm_up(connections) for node in self.nodes.values() if hasattr(node, "warm_up"))
+
+    def stats(self):
+        stats = {}
+        for name, policy in self.policies.items():
+            stats[name] = {"retry": policy.stats()}
+            if hasattr(self.nodes[name], "stats"):
+                stats[name]["pool"] = self.nodes[name].stats()
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for node in self.nodes.values():
+            if hasattr(node, "close"):
+                node.close()
@@ -0,0 +1,91 @@
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых вычислений: пока первый вызов do(key, ...)
+    выполняется, остальные вызовы с тем же ключом ждут и получают его результат
+    (или его исключение), не повторяя работу."""
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self._inflight.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._inflight[key] = _Call()
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def do_many(self, keys, func):
+        """do для нескольких ключей: ключи, которые уже вычисляются, ждут своего
+        первого вызова, остальные вычисляются одним вызовом func(ключи) -> {ключ: результат}.
+        Чужие вычисления ждем только после своих, поэтому встречные пакеты не блокируют друг друга."""
+        led, waiting = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                self.calls += 1
+                call = self._inflight.get(key)
+                if call is not None:
+                    call.waiters += 1
+                    self.shared += 1
+                    waiting[key] = call
+                else:
+                    led[key] = self._inflight[key] = _Call()
+        results = {}
+        if led:
+            try:
+                results.update(func(list(led)))
+                for key, call in led.items():
+                    call.result = results[key]
+            except Exception as e:
+                for call in led.values():
+                    call.error = e
+                raise
+            finally:
+                with self._lock:
+                    for key in led:
+                        del self._inflight[key]
+                for call in led.values():
+                    call.done.set()
+        for key, call in waiting.items():
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            results[key] = call.result
+        return results
+
+    def stats(self):
+        return {"calls": self.calls, "shared": self.shared, "inflight": len(self._inflight)}
@@ -1,97 +1,668 @@
+import os
+import uuid
 import redis
-import functools
+import random
+import threading
 import time
-from functools import lru_cache
+import queue
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from lib.cache import LocalCache
 
 MAX_RETRIES_RECONNECT = 3
-TIME_DELAY_TO_RECONNECT = 1     # ms
+TIME_DELAY_TO_RECONNECT = 0.005     # с, пауза перед первым повтором, дальше растет вдвое
+MAX_TIME_DELAY_TO_RECONNECT = 0.1   # с, предел паузы между повторами
+STORE_DEADLINE = 0.5                # с, бюджет на одну операцию с хранилищем вместе с повторами
+BREAKER_FAILURE_THRESHOLD = 10      # ошибок подряд до размыкания
+BREAKER_RESET_TIMEOUT = 5           # с, через сколько пропустить пробный запрос
 MAX_CACHE_SIZE = 256
+WRITE_BEHIND_QUEUE_SIZE = 10000
+WRITE_BEHIND_BATCH_SIZE = 100
+WRITE_BEHIND_FLUSH_INTERVAL = 0.05  # с
+MAX_POOL_CONNECTIONS = 50
+POOL_TIMEOUT = 0.2                  # с, сколько ждать свободного соединения в пуле
+HEALTH_CHECK_INTERVAL = 30          # с, простой соединения, после которого перед командой шлется PING
+LOCK_TTL = 0.1                      # с, срок жизни распределенной блокировки
 
+_deadlines = threading.local()
+
+
+class CircuitOpenError(ConnectionError):
+    """Хранилище отключено предохранителем, запрос к нему не выполнялся"""
+
+
+@contextmanager
+def request_deadline(seconds):
+    """Общий бюджет времени на все обращения к хранилищу внутри блока
+    (в текущем потоке): повторы, не укладывающиеся в бюджет, не выполняются."""
+    previous = getattr(_deadlines, "deadline", None)
+    deadline = time.monotonic() + seconds
+    _deadlines.deadline = deadline if previous is None else min(previous, deadline)
+    try:
+        yield
+    finally:
+        _deadlines.deadline = previous
+
+
+def remaining_deadline():
+    """Сколько секунд осталось от request_deadline текущего потока (None - без ограничения)"""
+    deadline = getattr(_deadlines, "deadline", None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def backoff_delay(attempt, base_delay=TIME_DELAY_TO_RECONNECT, max_delay=MAX_TIME_DELAY_TO_RECONNECT, rnd=random):
+    """Экспоненциальная пауза перед повтором номер attempt (с нуля) с полным разбросом (full jitter)"""
+    return rnd.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Предохранитель: после failure_threshold ошибок подряд размыкается и сразу
+    отказывает, через reset_timeout пропускает один пробный запрос (полуоткрыт)."""
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self.trips += 1
+
+    def record_error(self):
+        """Ошибка не из числа сетевых (ResponseError, DataError): на счетчик ошибок
+        не влияет, но пробный запрос полуоткрытого предохранителя ею провален -
+        иначе предохранитель навсегда остался бы полуоткрытым и отказывал бы всем"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self.trips += 1
+
+
+class RetryPolicy:
+    """Повторы операций с хранилищем: экспоненциальная пауза с разбросом,
+    бюджет времени (deadline на операцию и request_deadline на запрос)
+    и общий для всех операций предохранитель."""
+
+    def __init__(self, exceptions=(TimeoutError, ConnectionError), retries=MAX_RETRIES_RECONNECT,
+                 base_delay=TIME_DELAY_TO_RECONNECT, max_delay=MAX_TIME_DELAY_TO_RECONNECT,
+                 deadline=STORE_DEADLINE, breaker=None, clock=time.monotonic, sleep=time.sleep, rnd=random):
+        self.exceptions = exceptions
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker if breaker is not None else CircuitBreaker(clock=clock)
+        self.clock = clock
+        self.sleep = sleep
+        self.rnd = rnd
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.deadline_exceeded = 0
+
+    def call(self, f, *args, **kwargs):
+        self.calls += 1
+        deadline = self.clock() + self.deadline if self.deadline else None
+        request_deadline = getattr(_deadlines, "deadline", None)
+        if request_deadline is not None:
+            deadline = request_deadline if deadline is None else min(deadline, request_deadline)
+        for attempt in range(self.retries):
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise CircuitOpenError
+            try:
+                result = f(*args, **kwargs)
+            except self.exceptions:
+                self.breaker.record_failure()
+                if attempt == self.retries - 1:
+                    break
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay, self.rnd)
+                if deadline is not None and self.clock() + delay > deadline:
+                    self.deadline_exceeded += 1
+                    break
+                self.retried += 1
+                self.sleep(delay)
+            except BaseException:
+                self.breaker.record_error()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+        self.failed += 1
+        raise ConnectionError
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retried,
+            "failures": self.failed,
+            "rejected": self.rejected,
+            "deadline_exceeded": self.deadline_exceeded,
+            "breaker_trips": self.breaker.trips,
+            "breaker_state": self.breaker.state,
+        }
+
+
+def no_retry_policy():
+    """Политика из одной попытки без предохранителя"""
+    return RetryPolicy(retries=1, breaker=CircuitBreaker(failure_threshold=float("inf")))
 
-def retry(exceptions, retries=MAX_RETRIES_RECONNECT, time_delay=TIME_DELAY_TO_RECONNECT):
-    def decorator(f):
-        @functools.wraps(f)
-        def wrapper(*args, **kwargs):
-            for n in range(retries):
-                try:
-                    return f(*args, **kwargs)
-                except exceptions as e:
-                    time.sleep(time_delay)
-                    if n == retries:
-                        raise ConnectionError
-        return wrapper
-    return decorator
+
+class PoolExhaustedError(redis.exceptions.ConnectionError):
+    """За pool_timeout в пуле не освободилось ни одного соединения"""
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """BlockingConnectionPool, который считает выдачи соединений, ожидания
+    свободного соединения и отказы по таймауту (для метрик).
+    Занятыми считаются только выданные соединения: если connect() не удался,
+    redis-py сам возвращает в пул соединение, которое так и не было выдано."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquired = 0
+        self.exhausted = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self._stats_lock = threading.Lock()
+
+    def get_connection(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.exceptions.ConnectionError as e:
+            if str(e) != "No connection available.":
+                raise
+            with self._stats_lock:
+                self.exhausted += 1
+            raise PoolExhaustedError(str(e))
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self.acquired += 1
+            self._issued.add(connection)
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        return connection
+
+    def release(self, connection):
+        with self._stats_lock:
+            self._issued.discard(connection)
+        super().release(connection)
+
+    def reset(self):
+        # вызывается и из __init__ базового класса, и после fork (_checkpid)
+        super().reset()
+        self._issued = set()
+
+    @property
+    def in_use(self):
+        return len(self._issued)
+
+    def stats(self):
+        return {
+            "max_connections": self.max_connections,
+            "created": len(self._connections),
+            "in_use": self.in_use,
+            "acquired": self.acquired,
+            "exhausted": self.exhausted,
+            "wait_time": self.wait_time,
+            "max_wait": self.max_wait,
+        }
 
 
 class RedisStorage:
-    def __init__(self, host='172.17.0.2', port='6379', timeout=1):
+    """Клиент Redis поверх явного блокирующего пула: не больше max_connections
+    соединений, при их нехватке поток ждет свободное до pool_timeout секунд.
+    Соединения с TCP keepalive; простаивавшее дольше health_check_interval
+    соединение перед командой проверяется PING. После обрыва соединения пул
+    закрываются свободные соединения пула (вероятно, оборванные тем же сбоем), и
+    следующая операция открывает новые; соединения, занятые другими потоками, не трогаются."""
+
+    def __init__(self, host='172.17.0.2', port='6379', timeout=1, max_connections=MAX_POOL_CONNECTIONS,
+                 pool_timeout=POOL_TIMEOUT, health_check_interval=HEALTH_CHECK_INTERVAL, keepalive=True):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
+        self.health_check_interval = health_check_interval
+        self.keepalive = keepalive
+        self.pool = None
         self.db = None
+        self.resets = 0
 
     def reconnect(self):
         try:
             if not self.db:
-                self.db = redis.StrictRedis(
+                self.pool = InstrumentedConnectionPool(
+                    max_connections=self.max_connections,
+                    timeout=self.pool_timeout,
                     host=self.host,
                     port=self.port,
                     db=0,
                     socket_timeout=self.timeout,
                     socket_connect_timeout=self.timeout,
+                    socket_keepalive=self.keepalive,
+                    health_check_interval=self.health_check_interval,
                     decode_responses=True
                 )
+                self.db = redis.StrictRedis(connection_pool=self.pool)
         except Exception as e:
             raise ConnectionError
 
-    def get(self, key):
+    def warm_up(self, connections=None):
+        """Заранее открывает connections соединений (по умолчанию - весь пул),
+        чтобы первые запросы не тратили время на подключение; возвращает число открытых"""
         if not self.db:
             self.reconnect()
+        opened = []
         try:
-            res = self.db.get(key)
-        except redis.exceptions.TimeoutError:
-            raise TimeoutError
-        except redis.exceptions.ConnectionError:
-            raise ConnectionError
-        except Exception as e:
-            raise e
-        return res
+            for _ in range(connections or self.max_connections):
+                connection = self.pool.get_connection()
+                opened.append(connection)
+                connection.connect()
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+            pass
+        finally:
+            for connection in opened:
+                self.pool.release(connection)
+        return len(opened)
 
-    def set(self, key, value, expires=None):
+    def _reset(self):
+        """Закрывает свободные соединения пула после обрыва: следующие операции откроют новые.
+        Оборвавшееся соединение redis-py закрывает сам, а занятые другими потоками
+        не закрываются, чтобы не сорвать их запросы"""
+        self.resets += 1
+        if self.pool is not None:
+            self.pool.disconnect(inuse_connections=False)
+
+    @contextmanager
+    def _errors(self):
+        """Переводит исключения redis-py во встроенные TimeoutError/ConnectionError"""
         if not self.db:
             self.reconnect()
         try:
-            self.db.set(key, value, ex=expires)
+            yield
+        except PoolExhaustedError:
+            raise TimeoutError
         except redis.exceptions.TimeoutError:
             raise TimeoutError
         except redis.exceptions.ConnectionError:
+            self._reset()
             raise ConnectionError
 
+    def get(self, key):
+        with self._errors():
+            return self.db.get(key)
+
+    def set(self, key, value, expires=None):
+        with self._errors():
+            self.db.set(key, value, ex=expires)
+
+    def get_with_ttl(self, key):
+        """Значение ключа и оставшийся срок его жизни в секундах (None - бессрочно)"""
+        with self._errors():
+            pipe = self.db.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.pttl(key)
+            value, pttl = pipe.execute()
+        return value, pttl / 1000 if pttl and pttl > 0 else None
+
+    def get_many_with_ttl(self, keys):
+        """get_with_ttl для списка ключей одним конвейером: [(значение, ttl), ...]"""
+        if not keys:
+            return []
+        with self._errors():
+            pipe = self.db.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+                pipe.pttl(key)
+            replies = pipe.execute()
+        return [(value, pttl / 1000 if pttl and pttl > 0 else None)
+                for value, pttl in zip(replies[::2], replies[1::2])]
+
+    def get_many(self, keys):
+        """Значения ключей keys (None для отсутствующих) за один MGET"""
+        if not keys:
+            return []
+        with self._errors():
+            return self.db.mget(keys)
+
+    def set_many(self, mapping, expires=None):
+        """Записывает все пары mapping одним конвейером (pipeline без транзакции)"""
+        if not mapping:
+            return
+        with self._errors():
+            pipe = self.db.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=expires)
+            pipe.execute()
+
+    def lock(self, key, token, ttl=LOCK_TTL):
+        """SET NX PX: True, если ключ блокировки был свободен и теперь занят token"""
+        with self._errors():
+            return bool(self.db.set(key, token, nx=True, px=max(1, int(ttl * 1000))))
+
+    def unlock(self, key, token):
+        """Снимает блокировку, если она все еще принадлежит token. GET и DEL - две
+        команды: если блокировка между ними истекла и ее взял другой, она будет
+        снята раньше срока, и тот же расчет может выполниться дважды."""
+        with self._errors():
+            if self.db.get(key) == token:
+                self.db.delete(key)
+
+    def stats(self):
+        stats = self.pool.stats() if self.pool is not None else {}
+        stats["resets"] = self.resets
+        return stats
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.disconnect()
+
+
+class WriteBehindQueue:
+    """Отложенная запись: set кладет пару в ограниченную очередь, фоновый поток
+    записывает накопленное пачками через set_many. Если очередь заполнена,
+    запись отбрасывается (dropped) - вызывающий поток никогда не ждет хранилище."""
+
+    def __init__(self, storage, policy, maxsize=WRITE_BEHIND_QUEUE_SIZE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL):
+        self.storage = storage
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # поток запускается при первой записи в том процессе, который пишет
+        # (после fork поток родителя в дочернем процессе не существует)
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def put(self, key, value, expires=None):
+        if self._pid != os.getpid():
+            self._ensure_started()
+        try:
+            self.queue.put_nowait((key, value, expires))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while not self._stopped or not self.queue.empty():
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write(self, batch):
+        by_expires = {}
+        for key, value, expires in batch:
+            by_expires.setdefault(expires, {})[key] = value
+        for expires, mapping in by_expires.items():
+            try:
+                self.policy.call(self.storage.set_many, mapping, expires=expires)
+                self.written += len(mapping)
+            except Exception:
+                self.failed += len(mapping)
+        self.batches += 1
+
+    def flush(self):
+        """Ждет, пока будут записаны все поставленные в очередь значения"""
+        self.queue.join()
+
+    def close(self):
+        self._stopped = True
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+
+    def stats(self):
+        return {
+            "depth": self.queue.qsize(),
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
 
 class Storage:
-    def __init__(self, storage):
+    """Обертка над хранилищем с повторами запросов (RetryPolicy, общая для всех
+    операций). cache_get/cache_set работают через кэш процесса (L1,
+    lib.cache.LocalCache): ключ живет в нем столько же, сколько в Redis,
+    cache_set обновляет обе копии. Ошибки кэша не мешают расчету скоринга:
+    cache_get в этом случае возвращает None, cache_set обновляет только L1.
+
+    write_behind=True - cache_set пишет в Redis в фоне пачками (WriteBehindQueue).
+    stale_ttl > 0 - cache_get еще stale_ttl секунд после истечения отдает
+    устаревшее значение из L1 и обновляет ключ в фоне: вызывает refresh(key),
+    который пересчитывает значение и пишет его через cache_set, а без refresh
+    перечитывает ключ из Redis (его мог обновить другой процесс).
+    negative_ttl > 0 - отсутствующий в Redis ключ столько секунд не перечитывается, cache_get
+    отдает None из L1. stale_ttl и negative_ttl относятся к кэшу по умолчанию, с cache не используются."""
+
+    def __init__(self, storage, cache=None, policy=None, write_behind=False, stale_ttl=0, score_lock=False,
+                 negative_ttl=0):
         self.storage = storage
+        self.score_lock = score_lock
+        if cache is None:
+            cache = LocalCache(MAX_CACHE_SIZE, negative_ttl=negative_ttl, stale_ttl=stale_ttl)
+        self.cache = cache
+        if policy is None:
+            # хранилище с собственными повторами (например, по узлам) повторно не оборачиваем
+            policy = no_retry_policy() if getattr(storage, "manages_retries", False) else RetryPolicy()
+        self.policy = policy
+        self.write_queue = WriteBehindQueue(storage, self.policy) if write_behind else None
+        self._refresher = None
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
 
-    @retry((TimeoutError, ConnectionError))
     def get(self, key):
-        return self.storage.get(key)
+        return self.policy.call(self.storage.get, key)
 
-    @retry((TimeoutError, ConnectionError))
     def set(self, key, value, time_expires=None):
-        return self.storage.set(key, value, expires=time_expires)
+        return self.policy.call(self.storage.set, key, value, expires=time_expires)
+
+    def get_many(self, keys):
+        return self.policy.call(self.storage.get_many, list(keys))
+
+    def set_many(self, mapping, time_expires=None):
+        return self.policy.call(self.storage.set_many, mapping, expires=time_expires)
+
+    def _get_with_ttl(self, key):
+        if hasattr(self.storage, "get_with_ttl"):
+            return self.policy.call(self.storage.get_with_ttl, key)
+        return self.policy.call(self.storage.get, key), None
+
+    def cache_get(self, key, refresh=None):
+        found, value, stale = self.cache.lookup(key)
+        if found:
+            if stale:
+                self._revalidate(key, refresh)
+            return value
+        try:
+            value, ttl = self._get_with_ttl(key)
+        except Exception:
+            # хранилище недоступно - промах не кэшируем
+            return None
+        self.cache.set(key, value, ttl)
+        return value
 
-    @lru_cache(maxsize=MAX_CACHE_SIZE)
-    @retry((TimeoutError, ConnectionError))
-    def cache_get(self, key):
+    def cache_get_many(self, keys, refresh=None):
+        """cache_get для списка ключей: промахи L1 читаются из хранилища за одно обращение"""
+        values = {}
+        missing = []
+        for key in keys:
+            found, value, stale = self.cache.lookup(key)
+            if found:
+                if stale:
+                    self._revalidate(key, refresh)
+                values[key] = value
+            else:
+                missing.append(key)
+        if missing:
+            try:
+                if hasattr(self.storage, "get_many_with_ttl"):
+                    replies = self.policy.call(self.storage.get_many_with_ttl, missing)
+                else:
+                    replies = [(value, None) for value in self.policy.call(self.storage.get_many, missing)]
+            except Exception:
+                replies = None
+            for i, key in enumerate(missing):
+                if replies is None:
+                    values[key] = None
+                    continue
+                value, ttl = replies[i]
+                self.cache.set(key, value, ttl)
+                values[key] = value
+        return [values[key] for key in keys]
+
+    def _revalidate(self, key, refresh=None):
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(max_workers=1)
+        self._refresher.submit(self._refresh, key, refresh)
+
+    def _refresh(self, key, refresh=None):
         try:
-            result_get = self.storage.get(key)
+            if refresh is not None:
+                refresh(key)
+                return
+            value, ttl = self._get_with_ttl(key)
+            if value is None:
+                # в Redis ключа уже нет - следующий запрос пересчитает значение
+                self.cache.delete(key)
+            else:
+                self.cache.set(key, value, ttl)
         except Exception:
-            result_get = None
-        return result_get
+            pass
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(key)
 
-    @retry((TimeoutError, ConnectionError))
     def cache_set(self, key, value, time_expires=60*60):
-        return self.storage.set(key, value, expires=time_expires)
+        # в L1 храним то же строковое представление, которое вернул бы Redis;
+        # если Redis недоступен, значение остается хотя бы в L1
+        if self.write_queue is not None:
+            self.write_queue.put(key, value, time_expires)
+        else:
+            try:
+                self.policy.call(self.storage.set, key, value, expires=time_expires)
+            except Exception:
+                pass
+        self.cache.set(key, value if isinstance(value, str) else str(value), time_expires)
+
+    def cache_set_many(self, mapping, time_expires=60*60):
+        """cache_set для нескольких ключей: одна пачка записей в хранилище"""
+        if self.write_queue is not None:
+            for key, value in mapping.items():
+                self.write_queue.put(key, value, time_expires)
+        elif mapping:
+            try:
+                self.policy.call(self.storage.set_many, mapping, expires=time_expires)
+            except Exception:
+                pass
+        for key, value in mapping.items():
+            self.cache.set(key, value if isinstance(value, str) else str(value), time_expires)
+
+    @contextmanager
+    def distributed_lock(self, key, ttl=LOCK_TTL):
+        """Короткая блокировка в хранилище, общая для процессов и узлов. Отдает True,
+        если блокировка взята, и False, если ее держит другой. Если хранилище
+        блокировок не поддерживает или недоступно, отдает True: без блокировки
+        работа просто может выполниться несколько раз."""
+        if not hasattr(self.storage, "lock"):
+            yield True
+            return
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.storage.lock(key, token, ttl)
+        except Exception:
+            yield True
+            return
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    self.storage.unlock(key, token)
+                except Exception:
+                    pass
+
+    def warm_up(self, connections=None):
+        """Заранее открывает соединения с хранилищем, если оно это поддерживает"""
+        if hasattr(self.storage, "warm_up"):
+            return self.storage.warm_up(connections)
+        return 0
+
+    def stats(self):
+        stats = {"cache": self.cache.stats(), "retry": self.policy.stats()}
+        if hasattr(self.storage, "stats"):
+            stats["storage"] = self.storage.stats()
+        if self.write_queue is not None:
+            stats["write_behind"] = self.write_queue.stats()
+        return stats
+
+    def close(self):
+        """Дописывает очередь отложенной записи и останавливает фоновые потоки"""
+        if self.write_queue is not None:
+            self.write_queue.close()
+        if self._refresher is not None:
+            self._refresher.shutdown(wait=True)
+        if hasattr(self.storage, "close"):
+            self.storage.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Загрузка интересов клиентов в хранилище сервера скоринга.
+Файл - по клиенту на строку: JSON {"client_id": 1, "interests": ["cars", "pets"]}
+или "<id><TAB>cars,pets"; "-" - стандартный ввод.
+    python3 load_interests.py interests.tsv --redis 127.0.0.1:6379 [--encoding bitmask]
+    python3 load_interests.py interests.tsv --snapshot store.json   # для api.py --memory --snapshot"""
+import sys
+from optparse import OptionParser
+
+from lib.interests import ENCODINGS, LOAD_CHUNK_SIZE, load_interests
+from lib.memory_store import MemoryStorage
+from lib.sharded import ShardedStorage, parse_nodes
+from lib.store import Storage, RedisStorage
+
+
+def open_storage(opts):
+    if opts.snapshot:
+        return MemoryStorage(max_memory=opts.max_memory * 1024 * 1024, sweep_interval=0,
+                             snapshot_path=opts.snapshot)
+    nodes = parse_nodes(opts.redis)
+    return ShardedStorage(nodes) if len(nodes) > 1 else RedisStorage(*nodes[0])
+
+
+def report(loaded, elapsed):
+    sys.stderr.write("\rзагружено %d клиентов, %.0f в секунду" % (loaded, loaded / elapsed if elapsed else 0))
+    sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] FILE")
+    op.add_option("--redis", action="store", default="172.17.0.2:6379",
+                  help="узлы Redis host:port[,host:port...], как у api.py")
+    op.add_option("--snapshot", action="store", default=None,
+                  help="вместо Redis дописать снимок хранилища в памяти (api.py --memory --snapshot)")
+    op.add_option("--max-memory", action="store", type=int, default=64,
+                  help="предел хранилища в памяти для --snapshot, МБ (как у api.py)")
+    op.add_option("--encoding", action="store", type="choice", choices=ENCODINGS, default="json",
+                  help="json | bitmask (компактная маска по словарю интересов)")
+    op.add_option("--chunk-size", action="store", type=int, default=LOAD_CHUNK_SIZE,
+                  help="клиентов в одной пачке записи")
+    op.add_option("--ttl", action="store", type=int, default=None, help="срок жизни ключей, с")
+    op.add_option("-q", "--quiet", action="store_true", default=False)
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("нужен файл с интересами")
+
+    store = Storage(open_storage(opts))
+    lines = sys.stdin if args[0] == "-" else open(args[0], encoding="utf-8")
+    try:
+        loaded = load_interests(store, lines, opts.chunk_size, opts.encoding, opts.ttl,
+                                progress=None if opts.quiet else report)
+        evicted = getattr(store.storage, "evictions", 0)
+        if evicted:
+            # неполный снимок не сохраняем: вытесненные ключи пропали бы молча
+            store.storage.snapshot_path = None
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+        store.close()
+    if not opts.quiet:
+        sys.stderr.write("\n")
+    if evicted:
+        sys.exit("Не хватило --max-memory %d МБ: вытеснено ключей %d, снимок не сохранен" % (opts.max_memory, evicted))
+    print("Загружено клиентов: %d" % loaded)
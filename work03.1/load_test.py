@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Нагрузочный прогон сервера скоринга: для каждого режима сервера и хранилища
+запускает api.py, нагружает /method смесью запросов из многих клиентов
+и сохраняет пропускную способность и задержки p50/p95/p99 в JSON.
+    python3 load_test.py -m single,thread,prefork -b stub,memory -c 32 -d 10 -o results.json
+Хранилища: stub - заглушка Redis в процессе (lib/redis_stub.py), redis - локальный
+redis-server (должен быть в PATH), memory - хранилище в памяти api.py (--memory)."""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import hashlib
+import datetime
+import platform
+import threading
+import tempfile
+import subprocess
+import http.client
+import multiprocessing
+from optparse import OptionParser
+
+from api import SALT, ADMIN_LOGIN, ADMIN_SALT
+from lib.interests import INTERESTS, load_interests
+from lib.memory_store import MemoryStorage
+from lib.redis_stub import RedisStub
+from lib.store import Storage, RedisStorage
+
+DEFAULT_MIX = "online_score=70,clients_interests=25,admin=5"
+PERCENTILES = (50, 95, 99)
+START_TIMEOUT = 10      # с, сколько ждать, пока api.py начнет принимать соединения
+CLIENTS = 10000         # клиентов с интересами, загружаемых в хранилище перед прогоном
+
+
+def parse_mix(spec):
+    """'online_score=70,admin=5' -> [('online_score', 70.0), ('admin', 5.0)]"""
+    mix = []
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def make_request(kind, rnd):
+    if kind == "admin":
+        login, method = ADMIN_LOGIN, "online_score"
+        token = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+    else:
+        login, method = "h&f", kind
+        token = hashlib.sha512(("horns&hoofs" + login + SALT).encode()).hexdigest()
+    if method == "online_score":
+        # ограниченное число разных пользователей - часть запросов попадает в кэш
+        n = rnd.randrange(1000)
+        arguments = {"phone": "7917%07d" % n, "email": "user%d@otus.ru" % n, "gender": n % 3,
+                     "birthday": "01.01.1990", "first_name": "a", "last_name": "b"}
+    else:
+        arguments = {"client_ids": rnd.sample(range(1, CLIENTS + 1), rnd.randint(1, 5)), "date": "20.07.2017"}
+    return {"account": "horns&hoofs", "login": login, "method": method, "token": token, "arguments": arguments}
+
+
+def percentile(values, p):
+    """p-й процентиль (ближайший ранг) по отсортированному списку"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def run_client(port, mix, deadline, seed, latencies, errors):
+    rnd = random.Random(seed)
+    kinds, weights = zip(*mix)
+    bodies = {kind: [json.dumps(make_request(kind, rnd)) for _ in range(50)] for kind in kinds}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    while time.monotonic() < deadline:
+        kind = rnd.choices(kinds, weights)[0]
+        body = rnd.choice(bodies[kind])
+        started = time.perf_counter()
+        try:
+            conn.request("POST", "/method/", body, {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            status = "connection"
+        latencies[kind].append(time.perf_counter() - started)
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    conn.close()
+
+
+def run_clients(port, mix, clients, deadline, seed):
+    """Клиенты одного процесса нагрузки - потоки с постоянными соединениями"""
+    latencies = {kind: [] for kind, _ in mix}
+    errors = [{} for _ in range(clients)]
+    threads = [threading.Thread(target=run_client, args=(port, mix, deadline, seed + i, latencies, errors[i]))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, merge_counts(errors)
+
+
+def merge_counts(dicts):
+    total = {}
+    for counts in dicts:
+        for key, count in counts.items():
+            total[key] = total.get(key, 0) + count
+    return total
+
+
+def wait_port(port, timeout=START_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("api.py не начал принимать соединения на порту %s" % port)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def interests_lines(seed):
+    rnd = random.Random(seed)
+    for cid in range(1, CLIENTS + 1):
+        yield "%d\t%s" % (cid, ",".join(rnd.sample(INTERESTS, rnd.randint(1, 5))))
+
+
+class Backend:
+    """Хранилище для api.py: start() загружает в него интересы клиентов
+    и возвращает аргументы командной строки api.py"""
+
+    def __init__(self, name, seed=1):
+        self.name = name
+        self.seed = seed
+        self.stub = None
+        self.process = None
+        self.snapshot = None
+
+    def start(self):
+        if self.name == "memory":
+            self.snapshot = tempfile.NamedTemporaryFile(suffix=".json", delete=False).name
+            os.unlink(self.snapshot)
+            self.load(MemoryStorage(sweep_interval=0, snapshot_path=self.snapshot))
+            return ["--memory", "--snapshot", self.snapshot]
+        if self.name == "stub":
+            self.stub = RedisStub().start_in_thread()
+            self.load(RedisStorage(self.stub.host, self.stub.port))
+            return ["--redis", "%s:%s" % (self.stub.host, self.stub.port)]
+        if self.name == "redis":
+            if not shutil.which("redis-server"):
+                raise RuntimeError("redis-server не найден в PATH")
+            port = free_port()
+            self.process = subprocess.Popen(["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+                                            stdout=subprocess.DEVNULL)
+            wait_port(port)
+            self.load(RedisStorage("127.0.0.1", port))
+            return ["--redis", "127.0.0.1:%s" % port]
+        raise ValueError("Неизвестное хранилище: %s" % self.name)
+
+    def load(self, storage):
+        store = Storage(storage)
+        load_interests(store, interests_lines(self.seed))
+        store.close()
+
+    def stop(self):
+        if self.stub is not None:
+            self.stub.stop_thread()
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        if self.snapshot is not None and os.path.exists(self.snapshot):
+            os.unlink(self.snapshot)
+
+
+def run_scenario(mode, backend_name, opts, mix):
+    backend = Backend(backend_name, opts.seed)
+    port = free_port()
+    command = [sys.executable, "api.py", "-p", str(port), "-m", mode, "-w", str(opts.workers),
+               "-n", str(opts.processes), "--log-sample", "0", "-l", os.devnull] + backend.start()
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        wait_port(port)
+        per_process = [opts.clients // opts.client_processes + (i < opts.clients % opts.client_processes)
+                       for i in range(opts.client_processes)]
+        started = time.monotonic()
+        deadline = started + opts.duration
+        with multiprocessing.Pool(opts.client_processes) as pool:
+            parts = pool.starmap(run_clients, [(port, mix, n, deadline, opts.seed + 1000 * i)
+                                               for i, n in enumerate(per_process) if n])
+        elapsed = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.wait()
+        backend.stop()
+
+    latencies = {kind: [] for kind, _ in mix}
+    for part_latencies, _ in parts:
+        for kind, values in part_latencies.items():
+            latencies[kind].extend(values)
+    errors = merge_counts(part_errors for _, part_errors in parts)
+    return summarize(mode, backend_name, latencies, errors, elapsed)
+
+
+def latency_summary(values):
+    values = sorted(values)
+    summary = {"requests": len(values)}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary["p%d_ms" % p] = round(value * 1000, 3) if value is not None else None
+    return summary
+
+
+def summarize(mode, backend, latencies, errors, elapsed):
+    everything = [value for values in latencies.values() for value in values]
+    result = {"mode": mode, "backend": backend, "duration": round(elapsed, 3),
+              "throughput": round(len(everything) / elapsed, 1), "errors": errors}
+    result.update(latency_summary(everything))
+    result["by_request"] = {kind: latency_summary(values) for kind, values in latencies.items()}
+    return result
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-m", "--modes", action="store", default="single,thread,prefork",
+                  help="режимы api.py через запятую")
+    op.add_option("-b", "--backends", action="store", default="stub,memory",
+                  help="хранилища через запятую: stub, memory, redis")
+    op.add_option("--mix", action="store", default=DEFAULT_MIX,
+                  help="доли запросов: online_score, clients_interests, admin")
+    op.add_option("-c", "--clients", action="store", type=int, default=32, help="число одновременных клиентов")
+    op.add_option("--client-processes", action="store", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                  help="между сколькими процессами распределить клиентов")
+    op.add_option("-d", "--duration", action="store", type=float, default=10, help="длительность прогона, с")
+    op.add_option("-w", "--workers", action="store", type=int, default=8, help="потоков в api.py")
+    op.add_option("-n", "--processes", action="store", type=int, default=os.cpu_count(),
+                  help="процессов api.py в режиме prefork")
+    op.add_option("--seed", action="store", type=int, default=1)
+    op.add_option("-o", "--output", action="store", default="load_test_results.json")
+    (opts, args) = op.parse_args()
+
+    mix = parse_mix(opts.mix)
+    results = []
+    for backend in opts.backends.split(","):
+        for mode in opts.modes.split(","):
+            try:
+                result = run_scenario(mode, backend, opts, mix)
+            except RuntimeError as e:
+                print("%-8s %-7s пропущен: %s" % (mode, backend, e))
+                continue
+            results.append(result)
+            print("%-8s %-7s %9.1f req/s  p50 %7.3f ms  p95 %7.3f ms  p99 %7.3f ms  errors %s" % (
+                mode, backend, result["throughput"], result["p50_ms"] or 0, result["p95_ms"] or 0,
+                result["p99_ms"] or 0, sum(result["errors"].values())))
+
+    report = {
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {"mix": dict(mix), "clients": opts.clients, "client_processes": opts.client_processes,
+                     "duration": opts.duration, "workers": opts.workers, "processes": opts.processes},
+        "results": results,
+    }
+    with open(opts.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print("Результаты сохранены в %s" % opts.output)
@@ -4,6 +4,7 @@ import unittest
 import api
 from lib.test import cases
 from lib.store import Storage, RedisStorage
+from lib.interests import load_interests
 
 
 class TestSuite(unittest.TestCase):
@@ -11,6 +12,7 @@ class TestSuite(unittest.TestCase):
         self.context = {}
         self.headers = {}
         self.settings = Storage(RedisStorage())
+        load_interests(self.settings, ["1\tcars,pets", "2\ttravel", "3\tsport,music,books"])
 
     def get_response(self, request):
         return api.method_handler({"body": request, "headers": self.headers}, self.context, self.settings)
@@ -0,0 +1,63 @@
+import time
+import unittest
+
+from lib.admission import AdmissionController
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_unlimited(self):
+        admission = AdmissionController()
+        for _ in range(100):
+            self.assertTrue(admission.accept())
+        for _ in range(100):
+            self.assertIsNone(admission.admit())
+        self.assertEqual(100, admission.stats()["inflight"])
+        self.assertEqual({"backlog": 0, "inflight": 0, "queue_time": 0}, admission.stats()["shed"])
+
+    def test_backlog_limit(self):
+        admission = AdmissionController(max_inflight=2, admin_reserve=1)
+        self.assertEqual([True, True, True, False], [admission.accept() for _ in range(4)])
+        # соединение взято потоком пула - место в очереди освободилось
+        admission.started(time.monotonic())
+        self.assertTrue(admission.accept())
+        self.assertEqual(1, admission.stats()["shed"]["backlog"])
+        self.assertEqual(3, admission.stats()["queued"])
+
+    def test_inflight_per_request(self):
+        admission = AdmissionController(max_inflight=1)
+        # простаивающие соединения, уже взятые потоками, лимит не занимают
+        for _ in range(3):
+            admission.accept()
+            admission.started(time.monotonic())
+        self.assertIsNone(admission.admit())
+        self.assertEqual("inflight", admission.admit())
+        admission.done()
+        self.assertIsNone(admission.admit())
+        self.assertEqual(1, admission.stats()["inflight"])
+
+    def test_admin_reserve(self):
+        admission = AdmissionController(max_inflight=1, admin_reserve=1)
+        self.assertIsNone(admission.admit())
+        self.assertEqual("inflight", admission.admit())
+        self.assertIsNone(admission.admit(admin=True))
+        self.assertEqual("inflight", admission.admit(admin=True))
+        stats = admission.stats()
+        self.assertEqual(2, stats["admitted"])
+        self.assertEqual(2, stats["shed"]["inflight"])
+
+    def test_queue_time(self):
+        admission = AdmissionController(max_queue_time=0.05)
+        admission.started(time.monotonic() - 0.1)
+        self.assertEqual("queue_time", admission.admit())
+        # следующий запрос того же соединения в очереди не ждал
+        self.assertIsNone(admission.admit())
+        admission.started(time.monotonic() - 0.1)
+        self.assertIsNone(admission.admit(admin=True))
+        admission.started(time.monotonic())
+        self.assertIsNone(admission.admit())
+        self.assertEqual(1, admission.stats()["shed"]["queue_time"])
+
+
+if __name__ == "__main__":
+    unittest.main()
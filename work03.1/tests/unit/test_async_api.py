@@ -0,0 +1,86 @@
+import json
+import asyncio
+import hashlib
+import unittest
+import api
+import async_api
+from lib.async_store import AsyncStorage, AsyncRedisStorage
+from lib.redis_stub import RedisStub
+
+
+class TestAsyncAPI(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.redis = await RedisStub().start()
+        self.store = AsyncStorage(AsyncRedisStorage(host=self.redis.host, port=self.redis.port))
+        self.context = {}
+
+    async def asyncTearDown(self):
+        await self.store.storage.close()
+        await self.redis.stop()
+
+    def make_request(self, method, arguments, login="h&f"):
+        request = {"account": "horns&hoofs", "login": login, "method": method, "arguments": arguments}
+        msg = request["account"] + request["login"] + api.SALT
+        request["token"] = hashlib.sha512(msg.encode()).hexdigest()
+        return {"body": request, "headers": {}}
+
+    async def test_store_set_get(self):
+        await self.store.set("key", "value")
+        self.assertEqual("value", await self.store.get("key"))
+        self.assertIsNone(await self.store.cache_get("missing"))
+
+    async def test_online_score_is_cached(self):
+        request = self.make_request("online_score", {"phone": "79175002040", "email": "stupnikov@otus.ru"})
+        response, code = await async_api.method_handler(request, self.context, self.store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(3.0, response["score"])
+        self.assertEqual(1, len(self.redis.data))
+        self.assertEqual(sorted(self.context["has"]), ["email", "phone"])
+
+    async def test_clients_interests(self):
+        self.redis.data[b"i:1"] = (b'["cars", "pets"]', None)
+        self.redis.data[b"i:2"] = (b"#3", None)
+        request = self.make_request("clients_interests", {"client_ids": [1, 2, 3]})
+        response, code = await async_api.method_handler(request, self.context, self.store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual({1: ["cars", "pets"], 2: ["cars", "pets"], 3: []}, response)
+
+    async def test_invalid_and_forbidden(self):
+        request = self.make_request("online_score", {"phone": "79175002040"})
+        _, code = await async_api.method_handler(request, self.context, self.store)
+        self.assertEqual(api.INVALID_REQUEST, code)
+        request["body"]["token"] = ""
+        _, code = await async_api.method_handler(request, self.context, self.store)
+        self.assertEqual(api.FORBIDDEN, code)
+
+    async def test_concurrent_requests(self):
+        requests = [self.make_request("online_score", {"first_name": "a%s" % i, "last_name": "b"})
+                    for i in range(500)]
+        results = await asyncio.gather(*(async_api.method_handler(r, {}, self.store) for r in requests))
+        self.assertTrue(all(code == api.OK and response["score"] == 0.5 for response, code in results))
+        self.assertEqual(500, len(self.redis.data))
+
+    async def test_store_down_raises_connection_error(self):
+        await self.redis.stop()
+        store = AsyncStorage(AsyncRedisStorage(host=self.redis.host, port=self.redis.port))
+        with self.assertRaises(ConnectionError):
+            await store.get("key")
+        self.assertIsNone(await store.cache_get("key"))
+
+    async def test_http_keep_alive(self):
+        server = await async_api.AsyncHTTPServer(self.store, port=0).start()
+        self.addAsyncCleanup(server.stop)
+        reader, writer = await asyncio.open_connection("localhost", server.port)
+        body = json.dumps(self.make_request("online_score", {"first_name": "a", "last_name": "b"})["body"]).encode()
+        request = b"POST /method/ HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        writer.write(request + request)
+        for _ in range(2):
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            self.assertEqual({"response": {"score": 0.5}, "code": api.OK}, json.loads(await reader.readexactly(length)))
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import hashlib
+import datetime
+import unittest
+
+import api
+from lib.auth import AdminToken, TokenCache
+
+
+def user_token(account, login, salt=api.SALT):
+    return hashlib.sha512((account + login + salt).encode()).hexdigest()
+
+
+def admin_token(moment, salt=api.ADMIN_SALT):
+    return hashlib.sha512((moment.strftime("%Y%m%d%H") + salt).encode()).hexdigest()
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def test_check(self):
+        cache = TokenCache(api.SALT)
+        token = user_token("horns&hoofs", "h&f")
+        self.assertTrue(cache.check("horns&hoofs", "h&f", token))
+        self.assertTrue(cache.check("horns&hoofs", "h&f", token))
+        self.assertEqual({"size": 1, "hits": 1, "misses": 1}, cache.stats())
+        self.assertFalse(cache.check("horns&hoofs", "h&f", token[:-1]))
+        self.assertFalse(cache.check("horns&hoofs", "h&f", ""))
+        self.assertFalse(cache.check("horns&hoofs", "h&f", None))
+        self.assertFalse(cache.check("horns&hoofs", "h&f", "токен"))
+        self.assertFalse(cache.check("horns&hoofs", "other", token))
+
+    def test_only_verified_tokens_cached(self):
+        cache = TokenCache(api.SALT, maxsize=2)
+        for login in ("a", "b", "c"):
+            cache.check("", login, "wrong")
+        self.assertEqual(0, cache.stats()["size"])
+        for login in ("a", "b", "c"):
+            self.assertTrue(cache.check("", login, user_token("", login)))
+        self.assertEqual(2, cache.stats()["size"])
+        self.assertTrue(cache.check("", "a", user_token("", "a")))
+
+
+class TestAdminToken(unittest.TestCase):
+
+    def test_rollover(self):
+        start = datetime.datetime(2020, 3, 1, 10, 59, 59)
+        now = [start.timestamp()]
+        token = AdminToken(api.ADMIN_SALT, clock=lambda: now[0])
+        self.assertTrue(token.check(admin_token(start)))
+        self.assertTrue(token.check(admin_token(start)))
+        self.assertEqual(1, token.rollovers)
+        now[0] += 1
+        self.assertFalse(token.check(admin_token(start)))
+        self.assertTrue(token.check(admin_token(start + datetime.timedelta(seconds=1))))
+        self.assertEqual(2, token.rollovers)
+
+    def test_check_auth(self):
+        body = {"account": "", "login": api.ADMIN_LOGIN, "method": "online_score",
+                "token": admin_token(datetime.datetime.now()), "arguments": {}}
+        for token, authorized in ((body["token"], True), ("0" * 128, False)):
+            request = api.MethodRequest(dict(body, token=token))
+            self.assertTrue(request.is_valid())
+            self.assertEqual(authorized, api.check_auth(request))
+
+
+if __name__ == "__main__":
+    unittest.main()
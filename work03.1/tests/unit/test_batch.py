@@ -0,0 +1,80 @@
+import hashlib
+import datetime
+import unittest
+from unittest.mock import patch
+import api
+from lib.redis_stub import RedisStub
+from lib.store import Storage, RedisStorage
+
+
+class TestBatchRequests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = RedisStub().start_in_thread()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.stop_thread()
+
+    def setUp(self):
+        self.context = {}
+        self.store = Storage(RedisStorage(host=self.redis.host, port=self.redis.port))
+
+    def make_request(self, method, arguments, login="h&f"):
+        request = {"account": "horns&hoofs", "login": login, "method": method, "arguments": arguments}
+        if login == api.ADMIN_LOGIN:
+            msg = datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT
+        else:
+            msg = request["account"] + request["login"] + api.SALT
+        request["token"] = hashlib.sha512(msg.encode()).hexdigest()
+        return request
+
+    def get_response(self, body):
+        return api.method_handler({"body": body, "headers": {}}, self.context, self.store)
+
+    def test_results_in_order_with_own_codes(self):
+        forbidden = self.make_request("online_score", {"first_name": "a", "last_name": "b"})
+        forbidden["token"] = ""
+        batch = [
+            self.make_request("online_score", {"phone": "79175002040", "email": "stupnikov@otus.ru"}),
+            forbidden,
+            self.make_request("clients_interests", {"client_ids": [1, 2]}),
+            self.make_request("online_score", {"phone": "79175002040"}),
+            self.make_request("online_score", {"first_name": "a", "last_name": "b"}, login=api.ADMIN_LOGIN),
+            self.make_request("unknown", {}),
+            "not a request",
+        ]
+        response, code = self.get_response(batch)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.FORBIDDEN, api.OK, api.INVALID_REQUEST, api.OK, api.NOT_FOUND,
+                          api.INVALID_REQUEST], [r["code"] for r in response])
+        self.assertEqual({"score": 3.0}, response[0]["response"])
+        self.assertEqual([1, 2], sorted(response[2]["response"]))
+        self.assertEqual({"score": 42}, response[4]["response"])
+        self.assertEqual(["email", "phone"], sorted(self.context["batch"][0]["has"]))
+
+    def test_auth_checked_once_per_credentials(self):
+        batch = [self.make_request("online_score", {"first_name": "a%s" % i, "last_name": "b"}) for i in range(50)]
+        with patch("api.check_auth", wraps=api.check_auth) as check_auth:
+            response, code = self.get_response(batch)
+        self.assertEqual(1, check_auth.call_count)
+        self.assertTrue(all(r == {"response": {"score": 0.5}, "code": api.OK} for r in response))
+
+    def test_store_access_is_batched(self):
+        batch = [self.make_request("online_score", {"first_name": "b%s" % i, "last_name": "b"}) for i in range(50)]
+        batch += [self.make_request("clients_interests", {"client_ids": [i % 5 + 1]}) for i in range(50)]
+        self.store.get("warm-up")
+        commands = self.redis.commands
+        self.get_response(batch)
+        # scores: GET+PTTL на ключ одним конвейером и SET на ключ одним конвейером,
+        # interests: один MGET
+        self.assertEqual(50 * 2 + 50 + 1, self.redis.commands - commands)
+        commands = self.redis.commands
+        response, _ = self.get_response(batch[:50])
+        self.assertEqual(commands, self.redis.commands)
+        self.assertTrue(all(r["response"] == {"score": 0.5} for r in response))
+
+
+if __name__ == "__main__":
+    unittest.main()
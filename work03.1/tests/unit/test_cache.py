@@ -0,0 +1,59 @@
+import unittest
+from lib.cache import LocalCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_ttl_per_key(self):
+        cache = LocalCache(maxsize=10, clock=self.clock)
+        cache.set("short", "1", ttl=5)
+        cache.set("long", "2", ttl=60)
+        self.clock.now = 10
+        self.assertEqual((False, None), cache.get("short"))
+        self.assertEqual((True, "2"), cache.get("long"))
+
+    def test_lru_eviction(self):
+        cache = LocalCache(maxsize=2, clock=self.clock)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertEqual((False, None), cache.get("b"))
+        self.assertEqual((True, "1"), cache.get("a"))
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_negative_caching(self):
+        cache = LocalCache(clock=self.clock)
+        cache.set("missing", None)
+        self.assertEqual((False, None), cache.get("missing"))
+        cache = LocalCache(negative_ttl=1, clock=self.clock)
+        cache.set("missing", None)
+        self.assertEqual((True, None), cache.get("missing"))
+        self.clock.now = 2
+        self.assertEqual((False, None), cache.get("missing"))
+
+    def test_stats(self):
+        cache = LocalCache(negative_ttl=1, clock=self.clock)
+        cache.set("a", "1")
+        cache.set("none", None)
+        cache.get("a")
+        cache.get("none")
+        cache.get("b")
+        stats = cache.stats()
+        self.assertEqual((1, 1, 1), (stats["hits"], stats["negative_hits"], stats["misses"]))
+        self.assertAlmostEqual(2 / 3, stats["hit_ratio"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import gzip
+import json
+import zlib
+import unittest
+
+from lib import codec
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_codecs_agree(self):
+        response = {"response": {1: ["cars", "путешествия"], 2: []}, "code": 200}
+        expected = json.loads(codec.StdlibCodec.dumps(response))
+        self.assertEqual({"1": ["cars", "путешествия"], "2": []}, expected["response"])
+        for name in codec.available_codecs():
+            self.assertEqual(expected, json.loads(codec.get_codec(name).dumps(response)))
+
+    def test_big_integers(self):
+        response = {"response": {2 ** 70: ["cars"]}, "code": 200, "score": 2 ** 64}
+        for name in codec.available_codecs():
+            self.assertEqual({"response": {str(2 ** 70): ["cars"]}, "code": 200, "score": 2 ** 64},
+                             json.loads(codec.get_codec(name).dumps(response)), name)
+
+    def test_get_codec(self):
+        self.assertIn(codec.get_codec(), (codec.StdlibCodec, codec.OrjsonCodec))
+        self.assertIs(codec.StdlibCodec, codec.get_codec("json"))
+        with self.assertRaises(ValueError):
+            codec.get_codec("yaml")
+
+    def test_choose_encoding(self):
+        cases = {
+            None: None,
+            "": None,
+            "identity": None,
+            "gzip, deflate, br": "gzip",
+            "deflate": "deflate",
+            "gzip;q=0.5, deflate": "deflate",
+            "GZIP": "gzip",
+            "*": "gzip",
+            "*, gzip;q=0": "deflate",
+            "gzip;q=0, deflate;q=0": None,
+            "gzip;q=abc": None,
+        }
+        for header, encoding in cases.items():
+            self.assertEqual(encoding, codec.choose_encoding(header), header)
+
+    def test_compress(self):
+        body = json.dumps({i: ["cars", "pets"] for i in range(1000)}).encode()
+        self.assertEqual(body, gzip.decompress(codec.compress(body, "gzip")))
+        self.assertEqual(body, zlib.decompress(codec.compress(body, "deflate")))
+        chunks = list(codec.compress_chunks(body, "gzip", chunk_size=1000))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(body, gzip.decompress(b"".join(chunks)))
+        self.assertLess(len(codec.compress(body, "gzip")), len(body) // 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
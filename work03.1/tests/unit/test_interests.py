@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import MagicMock
+from lib.interests import decode_interests, encode_interests, load_interests, parse_line
+from lib.memory_store import MemoryStorage
+from lib.scoring import get_interests, get_interests_many
+from lib.store import Storage
+
+
+class TestInterests(unittest.TestCase):
+
+    def test_encodings_round_trip(self):
+        self.assertEqual('["pets", "cars"]', encode_interests(["pets", "cars"]))
+        self.assertEqual("#3", encode_interests(["pets", "cars"], "bitmask"))
+        self.assertEqual(["cars", "pets"], decode_interests("#3"))
+        self.assertEqual(["pets", "cars"], decode_interests('["pets", "cars"]'))
+        self.assertEqual([], decode_interests(None))
+        self.assertEqual([], decode_interests("#0"))
+
+    def test_bitmask_falls_back_to_json_for_unknown_interests(self):
+        self.assertEqual('["cars", "chess"]', encode_interests(["cars", "chess"], "bitmask"))
+
+    def test_parse_line(self):
+        self.assertEqual((1, ["cars", "pets"]), parse_line('{"client_id": 1, "interests": ["cars", "pets"]}'))
+        self.assertEqual((2, ["tv", "books"]), parse_line("2\ttv, books\n"))
+        self.assertEqual((3, []), parse_line("3\t"))
+        self.assertIsNone(parse_line("  \n"))
+
+    def test_load_in_chunks_with_progress(self):
+        storage = MagicMock()
+        progress = MagicMock()
+        lines = ["%d\tcars" % i for i in range(1, 6)] + [""]
+        self.assertEqual(5, load_interests(storage, lines, chunk_size=2, progress=progress))
+        self.assertEqual([2, 2, 1], [len(c.args[0]) for c in storage.set_many.call_args_list])
+        self.assertEqual([2, 4, 5], [c.args[0] for c in progress.call_args_list])
+
+    def test_get_interests_reads_only(self):
+        store = Storage(MemoryStorage(sweep_interval=0))
+        load_interests(store, ["1\tcars,pets", "2\tgeek"], encoding="bitmask")
+        store.set = MagicMock()
+        store.set_many = MagicMock()
+        self.assertEqual(["cars", "pets"], get_interests(store, 1))
+        self.assertEqual({1: ["cars", "pets"], 2: ["geek"], 3: []}, get_interests_many(store, [1, 2, 3]))
+        store.set.assert_not_called()
+        store.set_many.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
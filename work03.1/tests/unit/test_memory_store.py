@@ -0,0 +1,93 @@
+import os
+import tempfile
+import threading
+import unittest
+from lib.memory_store import MemoryStorage, ITEM_OVERHEAD
+from lib.store import Storage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.storage = MemoryStorage(sweep_interval=0, clock=self.clock)
+
+    def test_set_get_with_expiry(self):
+        self.storage.set("a", 1.5, expires=10)
+        self.storage.set("b", "forever")
+        self.assertEqual(self.storage.get("a"), "1.5")
+        self.assertEqual(self.storage.get_with_ttl("a"), ("1.5", 10))
+        self.assertEqual(self.storage.get_with_ttl("b"), ("forever", None))
+        self.clock.now += 10
+        self.assertIsNone(self.storage.get("a"))
+        self.assertEqual(self.storage.get("b"), "forever")
+        self.assertEqual(self.storage.stats()["expired"], 1)
+
+    def test_batch_operations(self):
+        self.storage.set_many({"k%d" % i: str(i) for i in range(100)}, expires=5)
+        keys = ["k3", "missing", "k99"]
+        self.assertEqual(self.storage.get_many(keys), ["3", None, "99"])
+        self.assertEqual(self.storage.get_many_with_ttl(keys), [("3", 5), (None, None), ("99", 5)])
+
+    def test_sweep_removes_expired(self):
+        self.storage.set_many({"k%d" % i: "v" for i in range(50)}, expires=1)
+        self.storage.set("keep", "v")
+        self.clock.now += 2
+        self.assertEqual(self.storage.sweep(), 50)
+        self.assertEqual(len(self.storage), 1)
+        self.assertEqual(self.storage.stats()["memory"], len("keep") + 1 + ITEM_OVERHEAD)
+
+    def test_max_memory_evicts_least_recently_used(self):
+        item = len("k0") + len("v") + ITEM_OVERHEAD
+        storage = MemoryStorage(max_memory=3 * item, stripes=1, sweep_interval=0, clock=self.clock)
+        for i in range(3):
+            storage.set("k%d" % i, "v")
+        storage.get("k0")
+        storage.set("k3", "v")
+        self.assertIsNone(storage.get("k1"))
+        self.assertEqual(storage.get_many(["k0", "k2", "k3"]), ["v", "v", "v"])
+        self.assertEqual(storage.stats()["evictions"], 1)
+        self.assertLessEqual(storage.stats()["memory"], 3 * item)
+
+    def test_snapshot_restores_live_keys(self):
+        path = os.path.join(tempfile.mkdtemp(), "store.json")
+        storage = MemoryStorage(sweep_interval=0, snapshot_path=path, clock=self.clock)
+        storage.set("score", "3.0", expires=60)
+        storage.set("old", "1", expires=1)
+        storage.set("forever", "x")
+        self.clock.now += 2
+        storage.close()
+        restored = MemoryStorage(sweep_interval=0, snapshot_path=path)
+        self.assertEqual(restored.get_many(["score", "old", "forever"]), ["3.0", None, "x"])
+        self.assertLessEqual(restored.get_with_ttl("score")[1], 58)
+
+    def test_background_sweep(self):
+        storage = MemoryStorage(sweep_interval=0.01)
+        storage.set("a", "1", expires=0.01)
+        for _ in range(100):
+            if not len(storage):
+                break
+            threading.Event().wait(0.01)
+        storage.close()
+        self.assertEqual(len(storage), 0)
+
+    def test_works_behind_storage(self):
+        store = Storage(MemoryStorage(sweep_interval=0))
+        store.cache_set("uid:1", 2.5, 60)
+        store.cache.clear()
+        self.assertEqual(store.cache_get("uid:1"), "2.5")
+        store.set("i:1", '["cars"]')
+        self.assertEqual(store.get("i:1"), '["cars"]')
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
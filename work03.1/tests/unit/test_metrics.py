@@ -0,0 +1,99 @@
+import json
+import hashlib
+import threading
+import unittest
+import http.client
+from unittest.mock import patch
+import api
+from lib.memory_store import MemoryStorage
+from lib.metrics import Histogram, Metrics, PhaseTimer, stats_samples, start_timer, stop_timer, mark
+from lib.store import Storage
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_buckets(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual([2, 1, 1], histogram.counts)
+        self.assertEqual(4, histogram.count)
+
+    def test_phase_marks_go_to_current_timer(self):
+        mark("auth")
+        timer = start_timer()
+        mark("auth")
+        mark("store")
+        mark("auth")
+        stop_timer()
+        mark("store")
+        self.assertEqual({"auth", "store"}, set(timer.phases))
+        self.assertAlmostEqual(timer.elapsed, sum(timer.phases.values()))
+
+    def test_render(self):
+        metrics = Metrics(buckets=(0.1, 1))
+        timer = PhaseTimer()
+        timer.mark("parse")
+        metrics.record("online_score", 200, timer)
+        metrics.record("online_score", 403, timer)
+        text = metrics.render({"cache": {"hits": 3}, "retry": {"breaker_state": "closed"}})
+        self.assertIn('scoring_requests_total{method="online_score",code="200"} 1', text)
+        self.assertIn('scoring_request_duration_seconds_bucket{method="online_score",le="+Inf"} 2', text)
+        self.assertIn('scoring_phase_duration_seconds_count{method="online_score",phase="parse"} 2', text)
+        self.assertIn("scoring_store_cache_hits 3", text)
+        self.assertIn('scoring_store_retry_breaker_state{state="closed"} 1', text)
+
+    def test_stats_node_labels(self):
+        samples = list(stats_samples("s", {"storage": {"10.0.0.1:6379": {"pool": {"in_use": 2}}}}))
+        self.assertEqual([("s_storage_pool_in_use", (("node", "10.0.0.1:6379"),), 2)], samples)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.multiple(api.MainHTTPHandler, store=Storage(MemoryStorage(sweep_interval=0)),
+                                 metrics=Metrics())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        server = api.make_server(0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.port = server.server_address[1]
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        result = response.status, response.getheader("Content-Type"), response.read().decode()
+        conn.close()
+        return result
+
+    def test_metrics_after_requests(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        request["token"] = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest()
+        self.request("POST", "/method/", json.dumps(request))
+        self.request("POST", "/method/", json.dumps(dict(request, token="")))
+        self.request("POST", "/method/", "{")
+        status, content_type, text = self.request("GET", "/metrics")
+        self.assertEqual(api.OK, status)
+        self.assertTrue(content_type.startswith("text/plain"))
+        self.assertIn('scoring_requests_total{method="online_score",code="200"} 1', text)
+        self.assertIn('scoring_requests_total{method="online_score",code="403"} 1', text)
+        self.assertIn('scoring_requests_total{method="other",code="400"} 1', text)
+        for phase in ("read", "parse", "validate", "auth", "store", "serialize", "write"):
+            self.assertIn('phase="%s"' % phase, text)
+        self.assertIn("scoring_store_cache_misses 1", text)
+        self.assertIn("scoring_store_storage_keys 1", text)
+
+    def test_unknown_get_path(self):
+        status, _, text = self.request("GET", "/other")
+        self.assertEqual(api.NOT_FOUND, status)
+        self.assertEqual(api.NOT_FOUND, json.loads(text)["code"])
+
+
+if __name__ == "__main__":
+    unittest.main()
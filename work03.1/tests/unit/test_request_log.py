@@ -0,0 +1,66 @@
+import io
+import os
+import json
+import logging
+import unittest
+from lib.request_log import AsyncQueueHandler, BatchLogWriter, JsonMessage, RequestLogger
+
+
+class TestRequestLog(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        handler = logging.StreamHandler(self.stream)
+        handler.setFormatter(logging.Formatter("%(levelname).1s %(message)s"))
+        self.writer = BatchLogWriter(handler, maxsize=100, batch_size=10)
+        self.logger = logging.getLogger("test.request_log")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(AsyncQueueHandler(self.writer))
+        self.addCleanup(self.logger.handlers.clear)
+
+    def lines(self):
+        self.writer.flush()
+        return self.stream.getvalue().splitlines()
+
+    def test_records_written_in_background(self):
+        for i in range(25):
+            self.logger.info("message %d", i)
+        self.assertEqual(["I message %d" % i for i in range(25)], self.lines())
+        self.writer.stop()
+        self.assertEqual(25, self.writer.written)
+
+    def test_exception_text_kept(self):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            self.logger.exception("failed")
+        lines = self.lines()
+        self.assertEqual("E failed", lines[0])
+        self.assertIn("ZeroDivisionError", lines[-1])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        writer = BatchLogWriter(logging.StreamHandler(io.StringIO()), maxsize=1)
+        writer._pid = os.getpid()    # поток не запущен, очередь не разбирается
+        for _ in range(3):
+            writer.put(logging.makeLogRecord({"msg": "x"}))
+        self.assertEqual(2, writer.dropped)
+
+    def test_sampling_keeps_errors_and_slow_requests(self):
+        request_log = RequestLogger(sample_rate=0.0, slow_threshold=0.5, logger=self.logger)
+        self.assertFalse(request_log.log({"request_id": "a", "code": 200}, 200, 0.01, "/method/", "{}"))
+        self.assertTrue(request_log.log({"request_id": "b", "code": 403}, 403, 0.01, "/method/", "{}"))
+        self.assertTrue(request_log.log({"request_id": "c", "code": 200}, 200, 0.7, "/method/", "{}"))
+        lines = self.lines()
+        self.assertEqual(2, len(lines))
+        error = json.loads(lines[0][2:])
+        self.assertEqual({"request_id": "b", "code": 403, "elapsed": 0.01, "path": "/method/", "body": "{}"}, error)
+        self.assertTrue(json.loads(lines[1][2:])["slow"])
+        self.assertEqual(1, request_log.skipped)
+
+    def test_json_message_is_compact(self):
+        self.assertEqual('{"a":[1,2],"b":"ы"}', str(JsonMessage({"a": [1, 2], "b": "ы"})))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,319 @@
+import gzip
+import json
+import time
+import socket
+import threading
+import unittest
+import http.client
+from unittest import mock
+import api
+from lib.admission import AdmissionController
+
+
+class TestServerModes(unittest.TestCase):
+
+    def start(self, server):
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def post(self, port, path, body):
+        conn = http.client.HTTPConnection("localhost", port, timeout=5)
+        conn.request("POST", path, json.dumps(body))
+        response = conn.getresponse()
+        result = response.status, json.loads(response.read())
+        conn.close()
+        return result
+
+    def check_server(self, server):
+        port = self.start(server)
+        request = {"account": "", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+        status, body = self.post(port, "/method/", request)
+        self.assertEqual(api.FORBIDDEN, status)
+        self.assertEqual(api.FORBIDDEN, body["code"])
+        status, _ = self.post(port, "/unknown/", request)
+        self.assertEqual(api.NOT_FOUND, status)
+
+    def test_single(self):
+        self.check_server(api.make_server(0))
+
+    def test_thread_pool(self):
+        self.check_server(api.make_server(0, workers=4))
+
+    def test_reuse_port(self):
+        self.check_server(api.make_server(0, workers=2, reuse_port=True))
+
+
+class TestKeepAlive(unittest.TestCase):
+    request = {"account": "", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+
+    def setUp(self):
+        self.server = api.make_server(0, workers=2)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        api.configure_keep_alive()
+
+    def test_requests_share_connection(self):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        self.addCleanup(conn.close)
+        for _ in range(3):
+            conn.request("POST", "/method/", json.dumps(self.request))
+            response = conn.getresponse()
+            self.assertEqual(api.FORBIDDEN, json.loads(response.read())["code"])
+            self.assertIsNone(response.getheader("Connection"))
+        self.assertEqual(api.MainHTTPHandler.protocol_version, "HTTP/1.1")
+
+    def test_pipelined_requests_in_order(self):
+        body = json.dumps(self.request).encode()
+        one = b"POST /method/ HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        other = b"POST /unknown/ HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        self.addCleanup(sock.close)
+        sock.sendall(one + other + one)
+        f = sock.makefile("rb")
+        codes = []
+        for _ in range(3):
+            f.readline()
+            headers = http.client.parse_headers(f)
+            codes.append(json.loads(f.read(int(headers["Content-Length"])))["code"])
+        self.assertEqual([api.FORBIDDEN, api.NOT_FOUND, api.FORBIDDEN], codes)
+
+    def test_max_requests_per_connection(self):
+        api.configure_keep_alive(max_requests=2)
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        self.addCleanup(conn.close)
+        headers = []
+        for _ in range(2):
+            conn.request("POST", "/method/", json.dumps(self.request))
+            response = conn.getresponse()
+            response.read()
+            headers.append(response.getheader("Connection"))
+        self.assertEqual([None, "close"], headers)
+
+    def test_idle_connections_do_not_hold_workers(self):
+        # простаивающих соединений больше, чем потоков в пуле
+        for _ in range(4):
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+            self.addCleanup(conn.close)
+            conn.request("POST", "/method/", json.dumps(self.request))
+            conn.getresponse().read()
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        self.addCleanup(conn.close)
+        started = time.monotonic()
+        conn.request("POST", "/method/", json.dumps(self.request))
+        self.assertEqual(api.FORBIDDEN, json.loads(conn.getresponse().read())["code"])
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_idle_timeout(self):
+        api.configure_keep_alive(timeout=0.2)
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request("POST", "/method/", json.dumps(self.request))
+        conn.getresponse().read()
+        started = time.monotonic()
+        # сервер закрывает простоявшее соединение
+        self.assertEqual(b"", conn.sock.recv(1))
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class TestAdmission(unittest.TestCase):
+    request = {"account": "", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+
+    def start(self, admission, workers=2):
+        self.addCleanup(setattr, api.MainHTTPHandler, "admission", api.MainHTTPHandler.admission)
+        api.MainHTTPHandler.admission = admission
+        server = api.ThreadPoolHTTPServer(("localhost", 0), api.MainHTTPHandler, workers=workers)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def hold(self):
+        """Обработчик /slow/ не отвечает, пока не выставлен возвращенный Event"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow(request, ctx, store):
+            release.wait(5)
+            return {}, api.OK
+
+        patcher = mock.patch.dict(api.MainHTTPHandler.router, {"slow": slow})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return release
+
+    def connect(self, port):
+        sock = socket.create_connection(("localhost", port), timeout=5)
+        self.addCleanup(sock.close)
+        return sock
+
+    def wait(self, predicate):
+        deadline = time.monotonic() + 5
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(predicate())
+
+    def post(self, port, body, path="/method/", conn=None):
+        if conn is None:
+            conn = http.client.HTTPConnection("localhost", port, timeout=5)
+            self.addCleanup(conn.close)
+        conn.request("POST", path, json.dumps(body))
+        response = conn.getresponse()
+        return response.status, response.getheader("Retry-After"), json.loads(response.read())
+
+    def test_shed_on_accept(self):
+        admission = AdmissionController(max_inflight=1, retry_after=3)
+        port = self.start(admission, workers=1)
+        # единственный поток занят медленным запросом, следующее соединение ждет в очереди
+        release = self.hold()
+        slow = threading.Thread(target=self.post, args=(port, self.request, "/slow/"))
+        slow.start()
+        self.addCleanup(slow.join)
+        self.wait(lambda: admission.inflight == 1)
+        self.connect(port)
+        self.wait(lambda: admission.queued == 1)
+        status, retry_after, body = self.post(port, self.request)
+        self.assertEqual(api.SERVICE_UNAVAILABLE, status)
+        self.assertEqual("3", retry_after)
+        self.assertEqual(api.SERVICE_UNAVAILABLE, body["code"])
+        self.assertEqual(1, admission.stats()["shed"]["backlog"])
+        release.set()
+
+    def test_idle_connections(self):
+        admission = AdmissionController(max_inflight=1)
+        port = self.start(admission, workers=4)
+        # постоянные соединения после ответа простаивают, но запросами в обработке не считаются
+        for _ in range(3):
+            conn = http.client.HTTPConnection("localhost", port, timeout=5)
+            self.addCleanup(conn.close)
+            status, _, _ = self.post(port, self.request, conn=conn)
+            self.assertEqual(api.FORBIDDEN, status)
+        self.assertEqual(0, admission.inflight)
+        self.assertEqual({"backlog": 0, "inflight": 0, "queue_time": 0}, admission.stats()["shed"])
+
+    def test_admin_priority(self):
+        admission = AdmissionController(max_inflight=1, admin_reserve=1)
+        port = self.start(admission, workers=3)
+        release = self.hold()
+        slow = threading.Thread(target=self.post, args=(port, self.request, "/slow/"))
+        slow.start()
+        self.addCleanup(slow.join)
+        self.wait(lambda: admission.inflight == 1)
+        status, retry_after, _ = self.post(port, self.request)
+        self.assertEqual((api.SERVICE_UNAVAILABLE, "1"), (status, retry_after))
+        self.assertEqual(1, admission.stats()["shed"]["inflight"])
+        status, _, _ = self.post(port, dict(self.request, login=api.ADMIN_LOGIN))
+        self.assertEqual(api.FORBIDDEN, status)
+        release.set()
+        self.wait(lambda: admission.inflight == 0)
+
+    def test_metrics(self):
+        admission = AdmissionController(max_inflight=1)
+        port = self.start(admission)
+        release = self.hold()
+        slow = threading.Thread(target=self.post, args=(port, self.request, "/slow/"))
+        slow.start()
+        self.addCleanup(slow.join)
+        self.wait(lambda: admission.inflight == 1)
+        self.post(port, self.request)
+        release.set()
+        self.wait(lambda: admission.inflight == 0)
+        conn = http.client.HTTPConnection("localhost", port, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request("GET", "/metrics")
+        text = conn.getresponse().read().decode()
+        self.assertIn("scoring_server_admission_shed_inflight 1", text)
+        self.assertIn("scoring_server_admission_max_inflight 1", text)
+
+
+class TestCompression(unittest.TestCase):
+    request = {"account": "", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+
+    def setUp(self):
+        self.server = api.make_server(0, workers=2)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.port = self.server.server_address[1]
+        # любой ответ считается большим
+        patcher = mock.patch.object(api.MainHTTPHandler, "compress_min_size", 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, headers):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request("POST", "/method/", json.dumps(self.request), headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def test_identity(self):
+        response, body = self.post({})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertEqual("Accept-Encoding", response.getheader("Vary"))
+        self.assertEqual(api.FORBIDDEN, json.loads(body)["code"])
+
+    def test_gzip(self):
+        response, body = self.post({"Accept-Encoding": "gzip"})
+        self.assertEqual("gzip", response.getheader("Content-Encoding"))
+        self.assertEqual(str(len(body)), response.getheader("Content-Length"))
+        self.assertEqual(api.FORBIDDEN, json.loads(gzip.decompress(body))["code"])
+
+    def test_below_threshold(self):
+        with mock.patch.object(api.MainHTTPHandler, "compress_min_size", 10000):
+            response, body = self.post({"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertIsNone(response.getheader("Vary"))
+        self.assertEqual(api.FORBIDDEN, json.loads(body)["code"])
+
+    def test_streaming(self):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        self.addCleanup(conn.close)
+        codes = []
+        with mock.patch.object(api, "STREAM_CHUNK_SIZE", 8):
+            # после ответа по частям соединение остается рабочим
+            for _ in range(2):
+                conn.request("POST", "/method/", json.dumps(self.request), {"Accept-Encoding": "gzip"})
+                response = conn.getresponse()
+                self.assertEqual("chunked", response.getheader("Transfer-Encoding"))
+                self.assertIsNone(response.getheader("Content-Length"))
+                codes.append(json.loads(gzip.decompress(response.read()))["code"])
+        self.assertEqual([api.FORBIDDEN, api.FORBIDDEN], codes)
+
+    def test_no_streaming_over_http10(self):
+        # режим single: постоянные соединения выключены, сервер отвечает HTTP/1.0
+        api.configure_keep_alive(0)
+        self.addCleanup(api.configure_keep_alive)
+        server = api.make_server(0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        conn = http.client.HTTPConnection("localhost", server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+        with mock.patch.object(api, "STREAM_CHUNK_SIZE", 8):
+            conn.request("POST", "/method/", json.dumps(self.request), {"Accept-Encoding": "gzip"})
+            response = conn.getresponse()
+            body = response.read()
+        self.assertEqual(10, response.version)
+        self.assertIsNone(response.getheader("Transfer-Encoding"))
+        self.assertEqual(str(len(body)), response.getheader("Content-Length"))
+        self.assertEqual(api.FORBIDDEN, json.loads(gzip.decompress(body))["code"])
+
+
+if __name__ == "__main__":
+    unittest.main()
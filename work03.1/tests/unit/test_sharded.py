@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import patch
+from lib.redis_stub import RedisStub
+from lib.sharded import HashRing, ShardedStorage, parse_nodes
+from lib.store import CircuitBreaker, RetryPolicy, Storage
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_keys_spread_over_nodes(self):
+        ring = HashRing(["a:1", "b:1", "c:1"])
+        counts = {}
+        for i in range(3000):
+            node = ring.get_node("uid:%d" % i)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(set(counts), {"a:1", "b:1", "c:1"})
+        for count in counts.values():
+            self.assertGreater(count, 700)
+
+    def test_adding_node_moves_about_one_nth_of_keys(self):
+        keys = ["uid:%d" % i for i in range(4000)]
+        before = HashRing(["a:1", "b:1", "c:1"])
+        after = HashRing(["a:1", "b:1", "c:1", "d:1"])
+        moved = [key for key in keys if before.get_node(key) != after.get_node(key)]
+        # ключи переезжают только на новый узел, и их около 1/4
+        self.assertTrue(all(after.get_node(key) == "d:1" for key in moved))
+        self.assertLess(abs(len(moved) / len(keys) - 0.25), 0.07)
+
+    def test_parse_nodes(self):
+        self.assertEqual(parse_nodes("h1:6379, h2:6380"), [("h1", 6379), ("h2", 6380)])
+
+
+class TestShardedStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = [RedisStub().start_in_thread() for _ in range(3)]
+        self.storage = ShardedStorage(
+            [(stub.host, stub.port) for stub in self.stubs],
+            policy_factory=lambda: RetryPolicy(retries=1, breaker=CircuitBreaker(failure_threshold=2)))
+        self.by_port = {stub.port: stub for stub in self.stubs}
+
+    def tearDown(self):
+        self.storage.close()
+        for stub in self.stubs:
+            if stub.server is not None:
+                stub.stop_thread()
+
+    def stub_for(self, key):
+        return self.by_port[int(self.storage.node_for(key).rsplit(":", 1)[1])]
+
+    def test_keys_stored_on_their_node(self):
+        for i in range(30):
+            self.storage.set("key%d" % i, str(i))
+        for i in range(30):
+            key = "key%d" % i
+            self.assertIn(key.encode(), self.stub_for(key).data)
+            self.assertEqual(self.storage.get(key), str(i))
+
+    def test_batch_split_by_node_and_kept_in_order(self):
+        mapping = {"key%d" % i: str(i) for i in range(50)}
+        self.storage.set_many(mapping, expires=60)
+        self.assertEqual(sum(len(stub.data) for stub in self.stubs), 50)
+        self.assertTrue(all(stub.data for stub in self.stubs))
+        keys = list(reversed(list(mapping))) + ["missing"]
+        self.assertEqual(self.storage.get_many(keys), [mapping[key] for key in keys[:-1]] + [None])
+        values = self.storage.get_many_with_ttl(keys[:3])
+        self.assertEqual([value for value, ttl in values], [mapping[key] for key in keys[:3]])
+
+    def test_failed_node_does_not_affect_others(self):
+        keys = ["key%d" % i for i in range(30)]
+        dead = self.stubs[0]
+        dead.stop_thread()
+        dead.server = None
+        dead_name = "%s:%s" % (dead.host, dead.port)
+        alive_keys = [key for key in keys if self.storage.node_for(key) != dead_name]
+        dead_keys = [key for key in keys if self.storage.node_for(key) == dead_name]
+        for key in dead_keys[:3]:
+            with self.assertRaises(ConnectionError):
+                self.storage.set(key, "1")
+        self.assertEqual(self.storage.policies[dead_name].breaker.state, CircuitBreaker.OPEN)
+        for key in alive_keys:
+            self.storage.set(key, "1")
+        self.assertTrue(all(self.storage.policies[name].breaker.state == CircuitBreaker.CLOSED
+                            for name in self.storage.names if name != dead_name))
+
+    def test_storage_does_not_retry_twice(self):
+        store = Storage(self.storage)
+        self.assertEqual(store.policy.retries, 1)
+        with patch.object(self.storage.nodes[self.storage.node_for("key")], "get",
+                          side_effect=ConnectionError) as get:
+            with self.assertRaises(ConnectionError):
+                store.get("key")
+        self.assertEqual(get.call_count, 1)
+        self.storage.set("key", "value")
+        self.assertEqual(store.cache_get("key"), "value")
+
+
+if __name__ == "__main__":
+    unittest.main()
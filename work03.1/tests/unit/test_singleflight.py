@@ -0,0 +1,160 @@
+import threading
+import unittest
+from unittest.mock import patch
+from lib.memory_store import MemoryStorage
+from lib.redis_stub import RedisStub
+from lib.scoring import get_score, get_scores_many, score_flight, score_key
+from lib.singleflight import SingleFlight
+from lib.store import Storage, RedisStorage
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 42
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("k", compute))) for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while flight._inflight["k"].waiters < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([42] * 5, results)
+        self.assertEqual(1, len(calls))
+        self.assertEqual({"calls": 5, "shared": 4, "inflight": 0}, flight.stats())
+
+    def test_do_many_computes_new_keys_in_one_call(self):
+        flight = SingleFlight()
+        calls = []
+
+        def compute(keys):
+            calls.append(keys)
+            return {key: key * 2 for key in keys}
+
+        self.assertEqual({"a": "aa", "b": "bb"}, flight.do_many(["a", "b", "a"], compute))
+        self.assertEqual([["a", "b"]], calls)
+        self.assertEqual({}, flight.do_many([], compute))
+        self.assertEqual(0, flight.stats()["inflight"])
+
+    def test_error_passed_to_waiters_and_not_cached(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("k", int, "x")
+        self.assertEqual(3, flight.do("k", int, "3"))
+
+
+class TestScoreCoalescing(unittest.TestCase):
+
+    def test_concurrent_misses_compute_once(self):
+        store = Storage(MemoryStorage(sweep_interval=0))
+        barrier = threading.Barrier(8)
+        original = store.cache_get
+
+        def cache_get(key, refresh=None):
+            # все потоки промахиваются по кэшу одновременно
+            value = original(key, refresh)
+            barrier.wait(5)
+            return value
+
+        def slow_calc(*args):
+            threading.Event().wait(0.05)
+            return 3.0
+
+        store.cache_get = cache_get
+        with patch("lib.scoring.calc_score", side_effect=slow_calc) as calc:
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(get_score(store, "79175002040", "a@b.c")))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([3.0] * 8, results)
+        self.assertEqual(1, calc.call_count)
+
+    def test_batch_waits_for_single_request_in_flight(self):
+        store = Storage(MemoryStorage(sweep_interval=0))
+        started, release = threading.Event(), threading.Event()
+
+        def slow_calc(*args, **kwargs):
+            if not started.is_set():
+                started.set()
+                release.wait(5)
+            return 3.0
+
+        batch = [{"phone": "79175002040", "email": "a@b.c"}, {"phone": "79175002041", "email": "a@b.c"}]
+        results = []
+        with patch("lib.scoring.calc_score", side_effect=slow_calc) as calc:
+            single = threading.Thread(target=get_score, args=(store, "79175002040", "a@b.c"))
+            single.start()
+            started.wait(5)
+            shared = score_flight.shared
+            thread = threading.Thread(target=lambda: results.extend(get_scores_many(store, batch)))
+            thread.start()
+            for _ in range(5000):
+                if score_flight.shared != shared:
+                    break
+                threading.Event().wait(0.001)
+            release.set()
+            thread.join()
+            single.join()
+        self.assertEqual([3.0, 3.0], results)
+        # первый ключ пакет не пересчитывал, а дождался одиночного запроса
+        self.assertEqual(2, calc.call_count)
+
+
+class TestScoreLock(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = RedisStub().start_in_thread()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.stop_thread()
+
+    def setUp(self):
+        self.redis.data.clear()
+        self.store = Storage(RedisStorage(host=self.redis.host, port=self.redis.port), score_lock=True)
+
+    def test_lock_is_exclusive_and_released(self):
+        with self.store.distributed_lock("lock:a") as first:
+            with self.store.distributed_lock("lock:a") as second:
+                self.assertTrue(first)
+                self.assertFalse(second)
+        self.assertNotIn(b"lock:a", self.redis.data)
+
+    def test_waits_for_result_of_lock_holder(self):
+        key = score_key("79175002040")
+        with patch("lib.scoring.calc_score") as calc:
+            with self.store.distributed_lock("lock:" + key):
+                # другой процесс держит блокировку и успевает записать результат
+                threading.Timer(0.02, self.store.storage.set, (key, "5.0", 60)).start()
+                self.assertEqual(5.0, get_score(self.store, "79175002040", "a@b.c"))
+        calc.assert_not_called()
+
+    def test_computes_when_lock_holder_does_not_finish(self):
+        with self.store.distributed_lock("lock:" + score_key("79175002040")):
+            self.assertEqual(3.0, get_score(self.store, "79175002040", "a@b.c"))
+
+    def test_unavailable_storage_does_not_block(self):
+        store = Storage(MemoryStorage(sweep_interval=0), score_lock=True)
+        with patch.object(store.storage, "lock", side_effect=ConnectionError):
+            self.assertEqual(3.0, get_score(store, "79175002040", "a@b.c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,18 @@
 import hashlib
+import redis
 import unittest
 import random
 import time
-from unittest.mock import MagicMock
-from lib.store import Storage, RedisStorage, MAX_RETRIES_RECONNECT, TIME_DELAY_TO_RECONNECT
+import socket
+import threading
+from unittest.mock import MagicMock, patch
+from lib.store import (Storage, RedisStorage, RetryPolicy, CircuitBreaker, CircuitOpenError, request_deadline,
+                       WriteBehindQueue,
+                       MAX_RETRIES_RECONNECT, TIME_DELAY_TO_RECONNECT)
+from lib.redis_stub import RedisStub
+from lib.cache import LocalCache
+from lib.interests import load_interests
+from lib.scoring import get_interests_many, get_score
 
 
 class TestStore(unittest.TestCase):
@@ -27,14 +36,339 @@ class TestStore(unittest.TestCase):
     def test_retry_on_connection_error(self):
         redis_storage = RedisStorage()
         redis_storage.reconnect()
+        redis_storage.get_with_ttl = MagicMock(side_effect=ConnectionError())
         redis_storage.db.get = MagicMock(side_effect=ConnectionError())
         redis_storage.db.set = MagicMock(side_effect=ConnectionError())
         redis_storage.reconnect()
         storage = Storage(redis_storage)
         self.assertEqual(storage.cache_get("key"), None)
         self.assertEqual(storage.cache_set("key", "value"), None)
-        self.assertEqual(redis_storage.db.get.call_count, MAX_RETRIES_RECONNECT)
+        self.assertEqual(redis_storage.get_with_ttl.call_count, MAX_RETRIES_RECONNECT)
         self.assertEqual(redis_storage.db.set.call_count, MAX_RETRIES_RECONNECT)
+        with self.assertRaises(ConnectionError):
+            storage.get("key")
+
+
+class FakeClock:
+    def __init__(self):
+        # request_deadline отсчитывается по time.monotonic
+        self.now = time.monotonic()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.f = MagicMock(side_effect=ConnectionError())
+
+    def make_policy(self, **kwargs):
+        return RetryPolicy(clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_raises_after_last_attempt(self):
+        policy = self.make_policy()
+        with self.assertRaises(ConnectionError):
+            policy.call(self.f)
+        self.assertEqual(MAX_RETRIES_RECONNECT, self.f.call_count)
+        self.assertEqual(MAX_RETRIES_RECONNECT - 1, policy.stats()["retries"])
+
+    def test_backoff_is_short_and_bounded(self):
+        policy = self.make_policy(retries=5, deadline=None)
+        start = self.clock.now
+        with self.assertRaises(ConnectionError):
+            policy.call(self.f)
+        self.assertLessEqual(self.clock.now - start, TIME_DELAY_TO_RECONNECT * (1 + 2 + 4 + 8))
+
+    def test_deadline_stops_retries(self):
+        policy = self.make_policy(retries=100, base_delay=0.1, max_delay=0.1, deadline=None)
+        with request_deadline(0):
+            with self.assertRaises(ConnectionError):
+                policy.call(self.f)
+        self.assertEqual(1, self.f.call_count)
+        self.assertEqual(1, policy.stats()["deadline_exceeded"])
+
+    def test_success_after_retry(self):
+        self.f.side_effect = [TimeoutError(), "value"]
+        self.assertEqual("value", self.make_policy().call(self.f))
+
+    def test_circuit_breaker_trips_and_half_opens(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=5, clock=self.clock)
+        policy = self.make_policy(breaker=breaker)
+        with self.assertRaises(ConnectionError):
+            policy.call(self.f)
+        with self.assertRaises(CircuitOpenError):
+            policy.call(self.f)
+        self.assertEqual(MAX_RETRIES_RECONNECT, self.f.call_count)
+        self.assertEqual((1, 1, "open"), (policy.stats()["breaker_trips"], policy.stats()["rejected"],
+                                           breaker.state))
+        self.clock.now += 5
+        self.f.side_effect = None
+        self.f.return_value = "value"
+        self.assertEqual("value", policy.call(self.f))
+        self.assertEqual("closed", breaker.state)
+
+    def test_half_open_probe_with_other_error_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=self.clock)
+        policy = self.make_policy(breaker=breaker)
+        with self.assertRaises(ConnectionError):
+            policy.call(self.f)
+        self.clock.now += 5
+        self.f.side_effect = redis.exceptions.ResponseError("OOM command not allowed")
+        with self.assertRaises(redis.exceptions.ResponseError):
+            policy.call(self.f)
+        self.assertEqual("open", breaker.state)
+        with self.assertRaises(CircuitOpenError):
+            policy.call(self.f)
+        self.clock.now += 5
+        self.f.side_effect = None
+        self.f.return_value = "value"
+        self.assertEqual("value", policy.call(self.f))
+        self.assertEqual("closed", breaker.state)
+
+    def test_other_error_does_not_count_as_failure(self):
+        breaker = CircuitBreaker(failure_threshold=1, clock=self.clock)
+        self.f.side_effect = redis.exceptions.DataError()
+        with self.assertRaises(redis.exceptions.DataError):
+            self.make_policy(breaker=breaker).call(self.f)
+        self.assertEqual(("closed", 1), (breaker.state, self.f.call_count))
+
+
+class TestStoreBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = RedisStub().start_in_thread()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.stop_thread()
+
+    def setUp(self):
+        self.storage = Storage(RedisStorage(host=self.redis.host, port=self.redis.port))
+
+    def test_set_many_get_many(self):
+        self.storage.set_many({"a": "1", "b": "2"})
+        self.assertEqual(["1", None, "2"], self.storage.get_many(["a", "missing", "b"]))
+        self.assertEqual([], self.storage.get_many([]))
+
+    def test_get_interests_many_round_trips(self):
+        load_interests(self.storage, ["1\tcars", "2\tcars,pets", "3\tcars,pets,tv"])
+        commands = self.redis.commands
+        interests = get_interests_many(self.storage, [1, 2, 3, 4])
+        self.assertEqual({1: ["cars"], 2: ["cars", "pets"], 3: ["cars", "pets", "tv"], 4: []}, interests)
+        # только чтение: один MGET
+        self.assertEqual(1, self.redis.commands - commands)
+
+
+class TestStorageLocalCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = RedisStub().start_in_thread()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.stop_thread()
+
+    def setUp(self):
+        self.storage = Storage(RedisStorage(host=self.redis.host, port=self.redis.port))
+
+    def test_cache_get_uses_local_cache(self):
+        self.storage.set("key", "value", time_expires=60)
+        self.assertEqual("value", self.storage.cache_get("key"))
+        commands = self.redis.commands
+        self.assertEqual("value", self.storage.cache_get("key"))
+        self.assertEqual(commands, self.redis.commands)
+        self.assertEqual(1, self.storage.cache.stats()["hits"])
+
+    def test_local_ttl_follows_redis_expiry(self):
+        self.storage.set("short", "value", time_expires=1)
+        self.assertEqual("value", self.storage.cache_get("short"))
+        time.sleep(1.1)
+        self.assertIsNone(self.storage.cache_get("short"))
+
+    def test_misses_are_not_cached_by_default(self):
+        self.assertIsNone(self.storage.cache_get("late"))
+        self.storage.set("late", "value")
+        self.assertEqual("value", self.storage.cache_get("late"))
+
+    def test_cache_set_writes_through(self):
+        self.storage.cache_set("score", 1.5)
+        self.assertEqual("1.5", self.storage.cache_get("score"))
+        self.storage.cache_set("score", 3.0)
+        self.assertEqual("3.0", self.storage.cache_get("score"))
+        self.assertEqual("3.0", self.storage.get("score"))
+
+    def test_get_score_served_from_local_cache(self):
+        self.assertEqual(3.0, get_score(self.storage, "79175002040", "a@b.c"))
+        commands = self.redis.commands
+        self.assertEqual(3.0, get_score(self.storage, "79175002040", "a@b.c"))
+        self.assertEqual(commands, self.redis.commands)
+
+
+class TestWriteBehindAndStale(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = RedisStub().start_in_thread()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.stop_thread()
+
+    def make_storage(self, **kwargs):
+        storage = Storage(RedisStorage(host=self.redis.host, port=self.redis.port), **kwargs)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_write_behind_flushes_in_background(self):
+        storage = self.make_storage(write_behind=True)
+        for i in range(10):
+            storage.cache_set("wb:%s" % i, i)
+        self.assertEqual("3", storage.cache_get("wb:3"))
+        storage.write_queue.flush()
+        self.assertEqual(["0", "9"], storage.get_many(["wb:0", "wb:9"]))
+        stats = storage.stats()["write_behind"]
+        self.assertEqual((0, 0, 10), (stats["depth"], stats["dropped"], stats["written"]))
+
+    def test_write_behind_drops_when_full(self):
+        release = threading.Event()
+        slow_storage = MagicMock()
+        slow_storage.set_many.side_effect = lambda mapping, expires=None: release.wait()
+        writer = WriteBehindQueue(slow_storage, RetryPolicy(), maxsize=1)
+        writer.put("first", 1)
+        while not slow_storage.set_many.called:
+            time.sleep(0.001)
+        self.assertTrue(writer.put("queued", 2))
+        self.assertFalse(writer.put("dropped", 3))
+        release.set()
+        writer.flush()
+        writer.close()
+        self.assertEqual({"depth": 0, "dropped": 1, "written": 2, "failed": 0, "batches": 2}, writer.stats())
+
+    def test_stale_value_served_while_refreshing(self):
+        storage = self.make_storage(stale_ttl=60)
+        storage.set("swr", "old", time_expires=1)
+        self.assertEqual("old", storage.cache_get("swr"))
+        storage.set("swr", "new", time_expires=60)
+        time.sleep(1.1)
+        self.assertEqual("old", storage.cache_get("swr"))
+        storage._refresher.shutdown(wait=True)
+        storage._refresher = None
+        self.assertEqual("new", storage.cache_get("swr"))
+        self.assertEqual(1, storage.cache.stats()["stale_hits"])
+
+    def test_stale_score_recomputed_in_background(self):
+        clock = MagicMock(return_value=0.0)
+        storage = self.make_storage(cache=LocalCache(stale_ttl=60, clock=clock))
+        with patch("lib.scoring.calc_score", side_effect=[3.0, 5.0]) as calc:
+            self.assertEqual(3.0, get_score(storage, "79175002040", "a@b.c"))
+            # L1 истек вместе с ключом в Redis: устаревшее значение отдается сразу,
+            # а скоринг пересчитывается в фоне и снова пишется через cache_set
+            clock.return_value = 60 * 60 + 1
+            self.assertEqual(3.0, get_score(storage, "79175002040", "a@b.c"))
+            storage._refresher.shutdown(wait=True)
+            storage._refresher = None
+            self.assertEqual(5.0, get_score(storage, "79175002040", "a@b.c"))
+        self.assertEqual(2, calc.call_count)
+        self.assertEqual(1, storage.cache.stats()["stale_hits"])
+
+    def test_negative_ttl_caches_misses(self):
+        storage = self.make_storage(negative_ttl=60)
+        self.assertIsNone(storage.cache_get("absent"))
+        storage.set("absent", "late", time_expires=60)
+        # промах запомнен в L1, Redis до истечения negative_ttl не перечитывается
+        self.assertIsNone(storage.cache_get("absent"))
+        self.assertEqual(1, storage.cache.stats()["negative_hits"])
+        self.assertEqual(0, self.make_storage().cache.negative_ttl)
+
+
+class TestRedisPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.redis = RedisStub().start_in_thread()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.stop_thread()
+
+    def make_storage(self, **kwargs):
+        storage = RedisStorage(host=self.redis.host, port=self.redis.port, **kwargs)
+        self.addCleanup(storage.close)
+        return storage
+
+    def test_warm_up_opens_connections(self):
+        storage = self.make_storage(max_connections=4)
+        before = len(self.redis.connections)
+        self.assertEqual(4, storage.warm_up())
+        self.assertEqual(before + 4, len(self.redis.connections))
+        storage.set("a", "1")
+        stats = storage.stats()
+        self.assertEqual(4, stats["created"])
+        self.assertEqual(0, stats["in_use"])
+        self.assertEqual(5, stats["acquired"])
+
+    def test_exhausted_pool_times_out(self):
+        storage = self.make_storage(max_connections=1, pool_timeout=0.01)
+        storage.reconnect()
+        connection = storage.pool.get_connection()
+        try:
+            with self.assertRaises(TimeoutError):
+                storage.get("a")
+        finally:
+            storage.pool.release(connection)
+        self.assertEqual(1, storage.stats()["exhausted"])
+        self.assertIsNone(storage.get("a"))
+        # исчерпание пула - не обрыв соединения, пул не сбрасывается
+        self.assertEqual(0, storage.stats()["resets"])
+
+    def test_pool_reset_after_connection_error(self):
+        storage = self.make_storage()
+        storage.set("a", "1")
+        # соединение, занятое другим потоком, и свободное соединение пула
+        busy = storage.pool.get_connection()
+        busy.connect()
+        sock = busy._sock
+        idle = storage.pool.get_connection()
+        idle.connect()
+        storage.pool.release(idle)
+        storage.db.get = MagicMock(side_effect=redis.exceptions.ConnectionError)
+        with self.assertRaises(ConnectionError):
+            storage.get("a")
+        self.assertEqual(1, storage.stats()["resets"])
+        self.assertIsNone(idle._sock)
+        # занятое соединение не переподключалось
+        self.assertIs(sock, busy._sock)
+        busy.send_command("PING")
+        self.assertEqual("PONG", busy.read_response())
+        storage.pool.release(busy)
+        del storage.db.get
+        self.assertEqual("1", storage.get("a"))
+
+    def test_in_use_not_negative_when_connect_fails(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        storage = RedisStorage(host="127.0.0.1", port=port, timeout=0.1)
+        self.addCleanup(storage.close)
+        store = Storage(storage, policy=RetryPolicy(sleep=lambda seconds: None))
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                store.get("a")
+        stats = storage.stats()
+        self.assertEqual(0, stats["in_use"])
+        self.assertEqual(0, stats["acquired"])
+
+    def test_storage_stats_include_pool(self):
+        storage = Storage(self.make_storage())
+        storage.get("a")
+        self.assertEqual(1, storage.stats()["storage"]["acquired"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Smoke check of the selectors engine: starts it in-process on a temporary
+DOCUMENT_ROOT, sends good and malformed requests and checks the status codes
+and that the worker keeps serving afterwards.
+    python3 check_engine.py"""
+import os
+import sys
+import socket
+import logging
+import tempfile
+import threading
+
+import httpd
+
+CASES = [
+    (b"GET / HTTP/1.1\r\n\r\n", 200),
+    (b"HEAD /page.html HTTP/1.1\r\n\r\n", 200),
+    (b"GET /page.html?x=1 HTTP/1.1\r\n\r\n", 200),
+    (b"GET /missing.html HTTP/1.1\r\n\r\n", 404),
+    (b"POST / HTTP/1.1\r\n\r\n", 405),
+    (b"GARBAGE\r\n\r\n", 400),
+    (b"GET /%00 HTTP/1.1\r\n\r\n", 400),
+    (b"GET /page.html%00.txt HTTP/1.1\r\n\r\n", 400),
+    (b"GET /dir/%00/ HTTP/1.1\r\n\r\n", 400),
+    (b"GET /%ff%fe HTTP/1.1\r\n\r\n", 404),
+    (b"GET /\xff\xfe HTTP/1.1\r\n\r\n", 400),
+    (b"GET ../../etc/passwd HTTP/1.1\r\n\r\n", 403),
+    (b"GET /" + b"a" * 5000 + b" HTTP/1.1\r\n\r\n", 404),
+    (b"GET / HTTP/1.1\r\n\r\n", 200),
+]
+
+
+def status(port, request):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(request)
+        data = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return int(data.split(b" ", 2)[1])
+
+
+def main():
+    logging.basicConfig(level=logging.CRITICAL)
+    httpd.log = logging.getLogger("httpd")
+    root = tempfile.mkdtemp()
+    os.mkdir(os.path.join(root, "dir"))
+    for name in ("index.html", "page.html"):
+        with open(os.path.join(root, name), "w") as f:
+            f.write("<html></html>")
+    server = httpd.SelectorsHTTPServer(port=0, document_root=root)
+    port = server.socket.getsockname()[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    failed = 0
+    for request, expected in CASES:
+        code = status(port, request)
+        print("%-5s %s -> %s" % ("ok" if code == expected else "FAIL", request.split(b"\r\n")[0][:60], code))
+        failed += code != expected
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,29 +2,44 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
+import errno
 import logging
-import asyncore
-import asynchat
 import socket
 import argparse
+import selectors
 import mimetypes
 import multiprocessing
 import urllib.parse
 from time import strftime, gmtime
 from collections import namedtuple
 
+try:
+    import asyncore
+    import asynchat
+except ImportError:
+    # removed in Python 3.12: only the selectors engine is available there
+    asyncore = asynchat = None
 
-def get_path_from_filter_url(path):
+ENGINES = ("asyncore", "selectors")
+SERVER_NAME = "simple-http-server"
+MAX_HEAD_SIZE = 64 * 1024
+RECV_SIZE = 64 * 1024
+SENDFILE_CHUNK = 1024 * 1024
+ACCEPT_BATCH = 64
+
+
+def get_path_from_filter_url(path, document_root=None):
     path = path.split('?', 1)[0]
     path = path.split('#', 1)[0]
     path = urllib.parse.unquote(path)
     path = os.path.normpath(path)
     parts = path.split('/')
-    path = os.path.join(DOCUMENT_ROOT, *parts)
+    path = os.path.join(document_root or DOCUMENT_ROOT, *parts)
     return path
 
 
-class HTTPRequestHandler(asynchat.async_chat):
+class HTTPRequestHandler(asynchat.async_chat if asynchat else object):
     def __init__(self, sock):
         asynchat.async_chat.__init__(self, sock)
         self.set_terminator(b"\r\n\r\n")
@@ -162,7 +177,7 @@ class HTTPRequestHandler(asynchat.async_chat):
     }
 
 
-class HTTPServer(asyncore.dispatcher_with_send):
+class HTTPServer(asyncore.dispatcher_with_send if asyncore else object):
     def __init__(self, host="127.0.0.1", port=8000):
         asyncore.dispatcher.__init__(self)
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -189,6 +204,204 @@ class HTTPServer(asyncore.dispatcher_with_send):
             self.close()
 
 
+class HTTPDate:
+    """Date header value, formatted at most once per second"""
+
+    def __init__(self):
+        self.second = None
+        self.value = None
+
+    def __call__(self):
+        now = int(time.time())
+        if now != self.second:
+            self.value = strftime("%a, %d %b %Y %H:%M:%S GMT", gmtime(now))
+            self.second = now
+        return self.value
+
+
+class SelectorsRequestHandler:
+    """One client connection of SelectorsHTTPServer. Same semantics as HTTPRequestHandler:
+    GET/HEAD of files under DOCUMENT_ROOT (index.html for directories), 400 for a malformed
+    request, 404 for a missing file, 405 for other methods, connection closed after the response.
+    In addition a path resolving outside DOCUMENT_ROOT (including through symlinks) gets 403.
+    The file body goes out with os.sendfile, without copying it through Python."""
+    responses = HTTPRequestHandler.responses
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.data = bytearray()
+        self.out = None
+        self.file = None
+        self.offset = 0
+        self.remaining = 0
+        self.writing = False
+        server.selector.register(sock, selectors.EVENT_READ, self.on_read)
+
+    def on_read(self, sock, mask):
+        try:
+            data = sock.recv(RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+        if not data:
+            self.close()
+            return
+        self.data += data
+        end = self.data.find(b"\r\n\r\n")
+        if end >= 0:
+            self.handle_request(bytes(self.data[:end]))
+        elif len(self.data) > MAX_HEAD_SIZE:
+            self.send_error("HTTP/1.1", 400)
+
+    def handle_request(self, head):
+        try:
+            method, uri, protocol = head.decode().split("\r\n", 1)[0].split(" ")
+        except ValueError:
+            self.send_error("HTTP/1.1", 400)
+            return
+        log.debug(f'{method} "{uri}"')
+        if method not in ("GET", "HEAD"):
+            self.send_error(protocol, 405)
+            return
+        try:
+            real_path = os.path.realpath(get_path_from_filter_url(uri, self.server.document_root))
+        except ValueError:
+            # e.g. %00 in the path: no such file name is possible
+            self.send_error(protocol, 400)
+            return
+        if real_path != self.server.document_root and not real_path.startswith(self.server.root_prefix):
+            self.send_error(protocol, 403)
+            return
+        try:
+            if os.path.isdir(real_path):
+                real_path = os.path.join(real_path, "index.html")
+            f = open(real_path, mode='rb')
+            size = os.fstat(f.fileno()).st_size
+        except (OSError, ValueError):
+            self.send_error(protocol, 404)
+            return
+        _, ext = os.path.splitext(real_path)
+        ctype = mimetypes.types_map.get(ext.lower(), "application/octet-stream")
+        if method == "GET":
+            self.file, self.remaining = f, size
+        else:
+            f.close()
+        self.send_response(protocol, 200, ctype, size)
+
+    def send_error(self, protocol, code):
+        self.send_response(protocol, code, "text/plain", 0)
+
+    def send_response(self, protocol, code, ctype, length):
+        log.debug(f'Response code: "{code}"')
+        self.out = memoryview((
+            f"{protocol} {code} {self.responses.get(code, '')}\r\n"
+            f"Server: {SERVER_NAME}\r\nDate: {self.server.date()}\r\n"
+            f"Content-Type: {ctype}\r\nContent-Length: {length}\r\nConnection: close\r\n\r\n").encode())
+        self.on_write(self.sock, selectors.EVENT_WRITE)
+
+    def on_write(self, sock, mask):
+        try:
+            while self.out:
+                sent = sock.send(self.out)
+                self.out = self.out[sent:]
+            while self.remaining:
+                sent = self.server.sendfile(sock, self.file, self.offset, min(self.remaining, SENDFILE_CHUNK))
+                if not sent:
+                    break
+                self.offset += sent
+                self.remaining -= sent
+        except BlockingIOError:
+            if not self.writing:
+                self.writing = True
+                self.server.selector.modify(sock, selectors.EVENT_WRITE, self.on_write)
+            return
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        try:
+            self.server.selector.unregister(self.sock)
+        except (KeyError, ValueError):
+            pass
+        self.sock.close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SelectorsHTTPServer:
+    """Event loop on selectors.DefaultSelector (epoll on Linux) without asyncore:
+    one selector, callbacks stored in the registration data, batched accept"""
+
+    def __init__(self, host="127.0.0.1", port=8000, document_root=None, backlog=1024):
+        self.document_root = os.path.realpath(document_root or DOCUMENT_ROOT)
+        self.root_prefix = os.path.join(self.document_root, "")
+        self.date = HTTPDate()
+        self.sendfile = sendfile if hasattr(os, "sendfile") else sendfile_fallback
+        self.selector = selectors.DefaultSelector()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            self.socket.bind((host, port))
+            self.socket.listen(backlog)
+            log.info(f"Listening on address {host}:{port}. PID: {os.getpid()}, engine: selectors")
+        except Exception as e:
+            log.exception("Socket error")
+            self.socket.close()
+            raise e
+        self.socket.setblocking(False)
+        self.selector.register(self.socket, selectors.EVENT_READ, self.accept)
+
+    def accept(self, sock, mask):
+        for _ in range(ACCEPT_BATCH):
+            try:
+                conn, addr = sock.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # out of descriptors or the client has gone: keep serving
+                if e.errno not in (errno.EMFILE, errno.ENFILE, errno.ECONNABORTED):
+                    raise
+                log.warning(f"accept failed: {e}")
+                return
+            conn.setblocking(False)
+            SelectorsRequestHandler(self, conn)
+
+    def serve_forever(self):
+        try:
+            while True:
+                for key, mask in self.selector.select(timeout=1):
+                    try:
+                        key.data(key.fileobj, mask)
+                    except Exception:
+                        # a failing request must not stop the worker: drop only its connection
+                        log.exception("Unexpected error")
+                        if key.fileobj is not self.socket:
+                            key.data.__self__.close()
+        except KeyboardInterrupt:
+            log.debug("Worker shutdown")
+        finally:
+            self.close()
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+
+
+def sendfile(sock, f, offset, count):
+    return os.sendfile(sock.fileno(), f.fileno(), offset, count)
+
+
+def sendfile_fallback(sock, f, offset, count):
+    f.seek(offset)
+    return sock.send(f.read(min(count, RECV_SIZE)))
+
+
 def parse_cmd_args():
     parser = argparse.ArgumentParser("Simple HTTP server")
     parser.add_argument("--host", dest="host", default="127.0.0.1")
@@ -196,11 +409,20 @@ def parse_cmd_args():
     parser.add_argument("--logfile", dest="logfile", default=None)
     parser.add_argument("-w", dest="n_workers", type=int, default=1)
     parser.add_argument("-r", dest="document_root", default=".")
-    return parser.parse_args()
+    parser.add_argument("--engine", dest="engine", choices=ENGINES,
+                        default="asyncore" if asyncore else "selectors",
+                        help="event loop: asyncore (Python < 3.12) or selectors (epoll)")
+    args = parser.parse_args()
+    if args.engine == "asyncore" and asyncore is None:
+        parser.error("asyncore is not available in this Python, use --engine selectors")
+    return args
 
 
 def run():
-    server = HTTPServer(host=args.host, port=args.port)
+    if args.engine == "selectors":
+        server = SelectorsHTTPServer(host=args.host, port=args.port)
+    else:
+        server = HTTPServer(host=args.host, port=args.port)
     server.serve_forever()
 
 
@@ -209,7 +431,7 @@ if __name__ == "__main__":
     logging.basicConfig(filename=None, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
     log = logging.getLogger(__name__)
-    log.info(f"Starting server at {args.host} {args.port}")
+    log.info(f"Starting server at {args.host} {args.port}, engine: {args.engine}")
 
     DOCUMENT_ROOT = args.document_root
 